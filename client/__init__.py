@@ -0,0 +1,14 @@
+"""
+Importable PyKV client library.
+
+    from client import PyKVClient, AsyncPyKVClient
+
+client/client.py remains the interactive REPL.
+"""
+from .connection import (
+    PyKVError, ResponseError, ReadOnlyError, StaleReadError, ConnectionError, PoolTimeoutError,
+    Connection, ConnectionPool, AsyncConnection, AsyncConnectionPool,
+)
+from .near_cache import NearCache
+from .sync_client import PyKVClient, Pipeline
+from .async_client import AsyncPyKVClient, AsyncPipeline
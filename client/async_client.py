@@ -0,0 +1,142 @@
+import asyncio
+
+from core.protocol import Error, encode_command
+from .commands import CommandsMixin, parse_results
+from .connection import AsyncConnectionPool, response_error
+from .near_cache import NearCache, AsyncInvalidationListener, written_keys
+
+class AsyncPyKVClient(CommandsMixin):
+    """
+    asyncio client. Many coroutines can share one instance; each call
+    borrows a pooled connection for one round trip, and at most
+    `max_connections` sockets are ever open. `max_lag` bounds the staleness
+    of reads served by a follower, and `near_cache_size` enables the
+    in-process GET cache, as for PyKVClient. The invalidation connection is
+    opened with the first command, since it needs a running event loop.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8889, max_connections=10, pool_timeout=None,
+                 pool=None, max_lag=None, near_cache_size=0):
+        init_commands = [("MAXLAG", max_lag)] if max_lag else []
+        self.pool = pool or AsyncConnectionPool(host, port, max_connections, pool_timeout,
+                                                init_commands)
+        self.near_cache = NearCache(near_cache_size) if near_cache_size else None
+        self._invalidations = None
+        self._tracking_lock = asyncio.Lock()
+
+    async def _start_tracking(self):
+        async with self._tracking_lock:
+            if self._invalidations is None:
+                self._invalidations = await AsyncInvalidationListener.open(
+                    self.pool.host, self.pool.port, self.near_cache, self.pool.timeout)
+                self.pool.init_commands.append(("CLIENT", "TRACKING", "ON", "REDIRECT",
+                                                self._invalidations.client_id))
+
+    async def execute_command(self, *args):
+        cache = self.near_cache
+        if cache is None or len(args) != 2 or str(args[0]).upper() != "GET":
+            return (await self._execute([args]))[0]
+        hit, found = cache.get(args[1])
+        if hit:
+            return found
+        value, ok = None, False
+        try:
+            value, ok = (await self._execute([args]))[0], True
+        finally:
+            cache.put(args[1], found, value, cache=ok)
+        return value
+
+    async def _execute(self, commands, raise_on_error=True):
+        """Sends all commands in one write and returns their parsed results in order."""
+        return parse_results(commands, await self._round_trip(commands), raise_on_error)
+
+    async def _round_trip(self, commands):
+        """Sends all commands in one write and reads their raw replies in order."""
+        written = None
+        if self.near_cache is not None:
+            if self._invalidations is None:
+                await self._start_tracking()
+            # Dropped before sending and again once applied, so this client reads its own writes
+            written = written_keys(commands)
+            if written:
+                self.near_cache.invalidate(written)
+        conn = await self.pool.get_connection()
+        try:
+            await conn.send(b"".join(encode_command(*args) for args in commands))
+            replies = await conn.read_replies(len(commands))
+        except BaseException:
+            # Broken or cancelled mid-read: the connection state is unknown
+            await self.pool.discard(conn)
+            raise
+        self.pool.release(conn)
+        if written:
+            self.near_cache.invalidate(written)
+        return replies
+
+    async def scan_iter(self, match: str = None, count: int = None):
+        """Yields every key (matching `match`) with successive SCAN calls."""
+        cursor = "0"
+        while True:
+            cursor, keys = await self.scan(cursor, match, count)
+            for key in keys:
+                yield key
+            if cursor == "0":
+                return
+
+    def pipeline(self, transaction=False):
+        return AsyncPipeline(self, transaction)
+
+    async def close(self):
+        if self._invalidations is not None:
+            await self._invalidations.close()
+        await self.pool.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+class AsyncPipeline(CommandsMixin):
+    """
+    Queues commands and flushes them in a single round trip:
+
+        async with client.pipeline() as pipe:
+            pipe.set("a", 1).incr("a").get("a")
+            results = await pipe.execute()
+
+    With transaction=True the commands are wrapped in MULTI/EXEC and run
+    atomically on the server.
+    """
+
+    def __init__(self, client, transaction=False):
+        self.client = client
+        self.transaction = transaction
+        self.commands = []
+
+    def execute_command(self, *args):
+        self.commands.append(args)
+        return self
+
+    async def execute(self, raise_on_error=True):
+        commands, self.commands = self.commands, []
+        if not commands:
+            return []
+        if not self.transaction:
+            return await self.client._execute(commands, raise_on_error)
+        # MULTI ... EXEC in the same round trip; EXEC's reply holds every result
+        replies = await self.client._round_trip([("MULTI",)] + commands + [("EXEC",)])
+        # A command refused while queuing makes the server discard the whole transaction
+        for reply in replies:
+            if isinstance(reply, Error):
+                raise response_error(reply)
+        return parse_results(commands, replies[-1], raise_on_error)
+
+    def __len__(self):
+        return len(self.commands)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.commands = []
@@ -27,7 +27,7 @@ def run_client(host='127.0.0.1', port=8889):
                         break
 
                     # Send command to server
-                    s.sendall(cmd.encode())
+                    s.sendall(f"{cmd}\n".encode())
 
                     # Receive response
                     data = s.recv(1024)
@@ -0,0 +1,133 @@
+"""
+Typed command helpers shared by the blocking client, the asyncio client and
+their pipelines. Each helper only builds the argument list and hands it to
+execute_command(), which either runs it (returning a value or a coroutine)
+or queues it on a pipeline.
+"""
+from core.protocol import Error
+from .connection import response_error
+
+def _ok(reply):
+    return reply == "OK"
+
+# Post-processing applied to raw replies, keyed by command name
+RESPONSE_CALLBACKS = {
+    "SET": _ok,
+    "DEL": _ok,
+    "INCR": int,
+    "INCRBY": int,
+    "DECRBY": int,
+    "APPEND": int,
+    "MSET": _ok,
+    "MSETEX": _ok,
+    "MDEL": int,
+    "MAXLAG": _ok,
+    "SCAN": lambda reply: (reply[0], reply[1]),
+    # SLOWLOG RESET replies OK, GET and LEN are returned as they are
+    "SLOWLOG": lambda reply: True if reply == "OK" else reply,
+}
+
+def parse_reply(name, reply):
+    callback = RESPONSE_CALLBACKS.get(name)
+    return callback(reply) if callback else reply
+
+def parse_results(commands, replies, raise_on_error):
+    """Parses each reply for its command; error replies are raised or returned as exceptions."""
+    results = []
+    for args, reply in zip(commands, replies):
+        if isinstance(reply, Error):
+            if raise_on_error:
+                raise response_error(reply)
+            results.append(response_error(reply))
+        else:
+            results.append(parse_reply(str(args[0]).upper(), reply))
+    return results
+
+class CommandsMixin:
+    def set(self, key: str, value, ex: int = None):
+        """SET key value [EX seconds]; returns True on success."""
+        if ex is not None:
+            return self.execute_command("SET", key, value, "EX", int(ex))
+        return self.execute_command("SET", key, value)
+
+    def get(self, key: str):
+        """Returns the value as a str, or None when the key is missing or expired."""
+        return self.execute_command("GET", key)
+
+    def delete(self, key: str):
+        """Returns True if the key existed."""
+        return self.execute_command("DEL", key)
+
+    def incr(self, key: str):
+        """Increments a numeric value by 1 and returns the new integer."""
+        return self.execute_command("INCR", key)
+
+    def incrby(self, key: str, amount: int):
+        """Atomically adds `amount` and returns the new integer."""
+        return self.execute_command("INCRBY", key, int(amount))
+
+    def decrby(self, key: str, amount: int):
+        """Atomically subtracts `amount` and returns the new integer."""
+        return self.execute_command("DECRBY", key, int(amount))
+
+    def append(self, key: str, value):
+        """Appends to the value (creating the key if needed) and returns the new length."""
+        return self.execute_command("APPEND", key, value)
+
+    def mget(self, *keys: str):
+        """Returns a list of values (None for missing keys) in key order."""
+        return self.execute_command("MGET", *keys)
+
+    def mset(self, mapping: dict, ex: int = None):
+        """Sets every key in `mapping` in one server-side step, optionally with a shared TTL."""
+        args = [item for pair in mapping.items() for item in pair]
+        if ex is not None:
+            return self.execute_command("MSETEX", int(ex), *args)
+        return self.execute_command("MSET", *args)
+
+    def mdelete(self, *keys: str):
+        """Returns how many of the keys existed."""
+        return self.execute_command("MDEL", *keys)
+
+    def memory_usage(self, key: str):
+        """Estimated bytes the server holds for `key`, or None if it doesn't exist."""
+        return self.execute_command("MEMORY", "USAGE", key)
+
+    def scan(self, cursor="0", match: str = None, count: int = None):
+        """
+        One SCAN step: returns (next cursor, keys). Start with "0" and pass
+        each returned cursor back until it is "0" again; see scan_iter().
+        """
+        args = ["SCAN", cursor]
+        if match is not None:
+            args += ["MATCH", match]
+        if count is not None:
+            args += ["COUNT", int(count)]
+        return self.execute_command(*args)
+
+    def keyrange(self, start="-", end="+", limit: int = None):
+        """
+        Keys between two bounds in lexicographic order (server started with
+        --ordered-index). Bounds are "[key" (inclusive), "(key" (exclusive), "-" or "+".
+        """
+        if limit is not None:
+            return self.execute_command("KEYRANGE", start, end, "LIMIT", int(limit))
+        return self.execute_command("KEYRANGE", start, end)
+
+    def info(self, section: str = None):
+        """INFO text: "# Section" headers followed by "field: value" lines (one section if given)."""
+        if section is not None:
+            return self.execute_command("INFO", section)
+        return self.execute_command("INFO")
+
+    def slowlog_get(self, count: int = None):
+        """The most recent slow commands as [id, unix time, microseconds, args] entries, newest first."""
+        if count is not None:
+            return self.execute_command("SLOWLOG", "GET", int(count))
+        return self.execute_command("SLOWLOG", "GET")
+
+    def slowlog_len(self):
+        return self.execute_command("SLOWLOG", "LEN")
+
+    def slowlog_reset(self):
+        return self.execute_command("SLOWLOG", "RESET")
@@ -0,0 +1,258 @@
+import socket
+import asyncio
+import threading
+import queue
+
+from core.protocol import ReplyParser, Error, encode_command
+
+class PyKVError(Exception):
+    pass
+
+class ResponseError(PyKVError):
+    """The server answered a command with an error reply."""
+
+class ReadOnlyError(ResponseError):
+    """A write was sent to a follower. `leader` is the (host, port) to send it to instead."""
+
+    def __init__(self, message, leader):
+        super().__init__(message)
+        self.leader = leader
+
+class StaleReadError(ResponseError):
+    """A follower's replication lag is above the MAXLAG bound set for the connection."""
+
+def response_error(reply):
+    """The ResponseError (or subclass) matching an error reply."""
+    message = str(reply)
+    code = message.removeprefix("ERROR: ").split(" ", 2)
+    if code[0] == "READONLY" and len(code) > 1:
+        host, _, port = code[1].rpartition(":")
+        return ReadOnlyError(message, (host, int(port)))
+    if code[0] == "STALE":
+        return StaleReadError(message)
+    return ResponseError(message)
+
+class ConnectionError(PyKVError):
+    pass
+
+class PoolTimeoutError(PyKVError):
+    """No pooled connection became available before the timeout."""
+
+class Connection:
+    """A blocking socket to the server that speaks RESP."""
+
+    def __init__(self, host="127.0.0.1", port=8889, timeout=None, init_commands=()):
+        self.host, self.port = host, port
+        try:
+            self.sock = socket.create_connection((host, port), timeout)
+        except OSError as e:
+            raise ConnectionError(f"Could not connect to {host}:{port}: {e}")
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.parser = ReplyParser()
+        self._replies = []
+        if init_commands:
+            self.send(b"".join(encode_command(*args) for args in init_commands))
+            for reply in self.read_replies(len(init_commands)):
+                if isinstance(reply, Error):
+                    self.close()
+                    raise response_error(reply)
+
+    def send(self, data):
+        try:
+            self.sock.sendall(data)
+        except OSError as e:
+            raise ConnectionError(str(e))
+
+    def read_replies(self, count):
+        """Blocks until `count` replies have been received and returns them in order."""
+        replies = self._replies
+        while len(replies) < count:
+            try:
+                data = self.sock.recv(64 * 1024)
+            except OSError as e:
+                raise ConnectionError(str(e))
+            if not data:
+                raise ConnectionError("Connection closed by server.")
+            self.parser.feed(data)
+            replies.extend(self.parser)
+        result, self._replies = replies[:count], replies[count:]
+        return result
+
+    def is_closed_by_server(self):
+        """True if the server has closed this idle connection (e.g. the server's --timeout)."""
+        timeout = self.sock.gettimeout()
+        self.sock.setblocking(False)
+        try:
+            return self.sock.recv(1, socket.MSG_PEEK) == b""
+        except BlockingIOError:
+            return False
+        except OSError:
+            return True
+        finally:
+            self.sock.settimeout(timeout)
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+class ConnectionPool:
+    """
+    Thread-safe bounded pool of blocking connections. Callers block (up to
+    `timeout` seconds) once `max_connections` are checked out. Every new
+    connection first runs `init_commands` (e.g. MAXLAG).
+    """
+
+    def __init__(self, host="127.0.0.1", port=8889, max_connections=10, timeout=None,
+                 socket_timeout=None, init_commands=()):
+        self.host, self.port = host, port
+        self.init_commands = list(init_commands)
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.socket_timeout = socket_timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def get_connection(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if not conn.is_closed_by_server():
+                return conn
+            self.discard(conn)
+        with self._lock:
+            if self._created < self.max_connections:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return Connection(self.host, self.port, self.socket_timeout, self.init_commands)
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeoutError(f"No connection available within {self.timeout}s")
+        if conn.is_closed_by_server():
+            self.discard(conn)
+            return self.get_connection()
+        return conn
+
+    def release(self, conn):
+        self._idle.put(conn)
+
+    def discard(self, conn):
+        """Drops a broken connection so the pool may open a fresh one."""
+        conn.close()
+        with self._lock:
+            self._created -= 1
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._created -= 1
+
+class AsyncConnection:
+    """An asyncio stream to the server that speaks RESP."""
+
+    def __init__(self, reader, writer):
+        self.reader, self.writer = reader, writer
+        self.parser = ReplyParser()
+        self._replies = []
+
+    @classmethod
+    async def open(cls, host="127.0.0.1", port=8889, timeout=None, init_commands=()):
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise ConnectionError(f"Could not connect to {host}:{port}: {e}")
+        conn = cls(reader, writer)
+        if init_commands:
+            await conn.send(b"".join(encode_command(*args) for args in init_commands))
+            for reply in await conn.read_replies(len(init_commands)):
+                if isinstance(reply, Error):
+                    await conn.close()
+                    raise response_error(reply)
+        return conn
+
+    async def send(self, data):
+        try:
+            self.writer.write(data)
+            await self.writer.drain()
+        except OSError as e:
+            raise ConnectionError(str(e))
+
+    async def read_replies(self, count):
+        replies = self._replies
+        while len(replies) < count:
+            try:
+                data = await self.reader.read(64 * 1024)
+            except OSError as e:
+                raise ConnectionError(str(e))
+            if not data:
+                raise ConnectionError("Connection closed by server.")
+            self.parser.feed(data)
+            replies.extend(self.parser)
+        result, self._replies = replies[:count], replies[count:]
+        return result
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+class AsyncConnectionPool:
+    """Bounded pool of asyncio connections shared by many coroutines."""
+
+    def __init__(self, host="127.0.0.1", port=8889, max_connections=10, timeout=None,
+                 init_commands=()):
+        self.host, self.port = host, port
+        self.init_commands = list(init_commands)
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._idle = []
+        self._slots = asyncio.Semaphore(max_connections)
+
+    async def get_connection(self):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeoutError(f"No connection available within {self.timeout}s")
+        while self._idle:
+            conn = self._idle.pop()
+            if not conn.reader.at_eof():
+                return conn
+            # Closed by the server while idle (e.g. its --timeout)
+            await conn.close()
+        try:
+            return await AsyncConnection.open(self.host, self.port, self.timeout, self.init_commands)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn):
+        self._idle.append(conn)
+        self._slots.release()
+
+    async def discard(self, conn):
+        await conn.close()
+        self._slots.release()
+
+    async def close(self):
+        while self._idle:
+            await self._idle.pop().close()
+
@@ -0,0 +1,186 @@
+"""
+Client side of server-assisted caching: an in-process cache of GET results
+that the server keeps valid (see server/tracking.py).
+
+A dedicated invalidation connection sends CLIENT ID and then only receives
+["invalidate", [key, ...]] pushes; every pooled connection turns tracking
+on with REDIRECT to that id, so the server notifies it about any key read
+through the pool. If the invalidation connection is lost, nothing can be
+trusted any more: the cache is emptied and disabled for the rest of the
+client's life, and reads simply go to the server again.
+
+Only the leader tracks keys; CLIENT TRACKING fails on followers and with
+--workers, so the first command of such a client raises ResponseError.
+"""
+import asyncio
+import collections
+import socket
+import threading
+
+from core.protocol import Error, encode_command
+from .connection import Connection, AsyncConnection, ConnectionError, response_error
+
+# Commands whose keys are dropped from the cache before and after they are sent
+_WRITE_KEYS = {
+    "SET": lambda args: args[1:2],
+    "SETZ": lambda args: args[1:2],
+    "DEL": lambda args: args[1:2],
+    "INCR": lambda args: args[1:2],
+    "INCRBY": lambda args: args[1:2],
+    "DECRBY": lambda args: args[1:2],
+    "APPEND": lambda args: args[1:2],
+    "MDEL": lambda args: args[1:],
+    "MSET": lambda args: args[1::2],
+    "MSETEX": lambda args: args[2::2],
+}
+
+def written_keys(commands):
+    """The keys the given commands may modify (as str)."""
+    keys = []
+    for args in commands:
+        select = _WRITE_KEYS.get(str(args[0]).upper())
+        if select is not None:
+            keys.extend(str(key) for key in select(args))
+    return keys
+
+class NearCache:
+    """
+    Thread-safe LRU of up to `max_size` GET results. A read that misses
+    gets a token from get(); its result is cached by put() only if the key
+    wasn't invalidated since, so a reply racing with an invalidation can't
+    bring an old value back.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.enabled = True
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+        self._lock = threading.Lock()
+        self._seq = 0            # Bumped by every invalidation
+        self._inflight = {}      # key -> GETs between get() and put()
+        self._invalidated = {}   # key -> _seq of its last invalidation while in flight
+
+    def get(self, key):
+        """(True, value) on a hit, otherwise (False, token) with the token to pass to put()."""
+        key = str(key)
+        with self._lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return True, self.entries[key]
+            self.stats["misses"] += 1
+            self._inflight[key] = self._inflight.get(key, 0) + 1
+            return False, self._seq
+
+    def put(self, key, token, value, cache=True):
+        """Ends a missed read; caches `value` unless the key was invalidated after get()."""
+        key = str(key)
+        with self._lock:
+            fresh = self._invalidated.get(key, token) <= token
+            count = self._inflight.pop(key) - 1
+            if count:
+                self._inflight[key] = count
+            else:
+                self._invalidated.pop(key, None)
+            if cache and fresh and self.enabled:
+                self.entries[key] = value
+                self.entries.move_to_end(key)
+                if len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+
+    def invalidate(self, keys):
+        with self._lock:
+            self._seq += 1
+            for key in keys:
+                key = str(key)
+                self.entries.pop(key, None)
+                if key in self._inflight:
+                    self._invalidated[key] = self._seq
+            self.stats["invalidations"] += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._seq += 1
+            self.entries.clear()
+            for key in self._inflight:
+                self._invalidated[key] = self._seq
+
+    def disable(self):
+        self.enabled = False
+        self.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+def _apply(cache, push):
+    if isinstance(push, list) and len(push) == 2 and push[0] == "invalidate":
+        cache.invalidate(push[1])
+
+class InvalidationListener:
+    """The blocking invalidation connection, read by a daemon thread."""
+
+    def __init__(self, host, port, cache, timeout=None):
+        self.cache = cache
+        self.conn = Connection(host, port, timeout)
+        self.conn.send(encode_command("CLIENT", "ID"))
+        (reply,) = self.conn.read_replies(1)
+        if isinstance(reply, Error):
+            self.conn.close()
+            raise response_error(reply)
+        self.client_id = reply
+        # Pushes may be minutes apart
+        self.conn.sock.settimeout(None)
+        self._thread = threading.Thread(target=self._run, name="pykv-invalidations", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                for push in self.conn.read_replies(1):
+                    _apply(self.cache, push)
+        except ConnectionError:
+            pass
+        finally:
+            self.cache.disable()
+
+    def close(self):
+        try:
+            # Wakes up the thread blocked in recv()
+            self.conn.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.conn.close()
+
+class AsyncInvalidationListener:
+    """The asyncio invalidation connection, read by a background task."""
+
+    def __init__(self, conn, cache, client_id):
+        self.conn = conn
+        self.cache = cache
+        self.client_id = client_id
+        self._task = asyncio.create_task(self._run())
+
+    @classmethod
+    async def open(cls, host, port, cache, timeout=None):
+        conn = await AsyncConnection.open(host, port, timeout)
+        await conn.send(encode_command("CLIENT", "ID"))
+        (reply,) = await conn.read_replies(1)
+        if isinstance(reply, Error):
+            await conn.close()
+            raise response_error(reply)
+        return cls(conn, cache, reply)
+
+    async def _run(self):
+        try:
+            while True:
+                for push in await self.conn.read_replies(1):
+                    _apply(self.cache, push)
+        except ConnectionError:
+            pass
+        finally:
+            self.cache.disable()
+
+    async def close(self):
+        self._task.cancel()
+        await self.conn.close()
@@ -0,0 +1,136 @@
+from core.protocol import Error, encode_command
+from .commands import CommandsMixin, parse_results
+from .connection import ConnectionPool, response_error
+from .near_cache import NearCache, InvalidationListener, written_keys
+
+class PyKVClient(CommandsMixin):
+    """
+    Blocking client. Safe to share between threads: every call borrows a
+    connection from the bounded pool for exactly one round trip.
+
+    Pointed at a follower, `max_lag` (seconds) makes reads fail with
+    StaleReadError instead of returning data more out of date than that;
+    writes to a follower raise ReadOnlyError carrying the leader's address.
+
+    With `near_cache_size` > 0 up to that many GET results are kept
+    in-process and served without a round trip; the leader pushes an
+    invalidation whenever one of those keys changes (see client/near_cache.py).
+    """
+
+    def __init__(self, host="127.0.0.1", port=8889, max_connections=10, pool_timeout=None,
+                 socket_timeout=None, pool=None, max_lag=None, near_cache_size=0):
+        init_commands = [("MAXLAG", max_lag)] if max_lag else []
+        self.pool = pool or ConnectionPool(host, port, max_connections, pool_timeout, socket_timeout,
+                                           init_commands)
+        self.near_cache = None
+        self._invalidations = None
+        if near_cache_size:
+            self.near_cache = NearCache(near_cache_size)
+            self._invalidations = InvalidationListener(self.pool.host, self.pool.port, self.near_cache,
+                                                       socket_timeout)
+            self.pool.init_commands.append(("CLIENT", "TRACKING", "ON", "REDIRECT",
+                                            self._invalidations.client_id))
+
+    def execute_command(self, *args):
+        cache = self.near_cache
+        if cache is None or len(args) != 2 or str(args[0]).upper() != "GET":
+            return self._execute([args])[0]
+        hit, found = cache.get(args[1])
+        if hit:
+            return found
+        value, ok = None, False
+        try:
+            value, ok = self._execute([args])[0], True
+        finally:
+            cache.put(args[1], found, value, cache=ok)
+        return value
+
+    def _execute(self, commands, raise_on_error=True):
+        """Sends all commands in one write and returns their parsed results in order."""
+        return parse_results(commands, self._round_trip(commands), raise_on_error)
+
+    def _round_trip(self, commands):
+        """Sends all commands in one write and reads their raw replies in order."""
+        # Dropped before sending and again once applied, so this client reads its own writes
+        written = written_keys(commands) if self.near_cache is not None else None
+        if written:
+            self.near_cache.invalidate(written)
+        conn = self.pool.get_connection()
+        try:
+            conn.send(b"".join(encode_command(*args) for args in commands))
+            replies = conn.read_replies(len(commands))
+        except BaseException:
+            # Broken or interrupted mid-read: the connection state is unknown
+            self.pool.discard(conn)
+            raise
+        self.pool.release(conn)
+        if written:
+            self.near_cache.invalidate(written)
+        return replies
+
+    def scan_iter(self, match: str = None, count: int = None):
+        """Yields every key (matching `match`) with successive SCAN calls."""
+        cursor = "0"
+        while True:
+            cursor, keys = self.scan(cursor, match, count)
+            yield from keys
+            if cursor == "0":
+                return
+
+    def pipeline(self, transaction=False):
+        return Pipeline(self, transaction)
+
+    def close(self):
+        if self._invalidations is not None:
+            self._invalidations.close()
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class Pipeline(CommandsMixin):
+    """
+    Queues commands and flushes them in a single round trip:
+
+        with client.pipeline() as pipe:
+            pipe.set("a", 1).incr("a").get("a")
+            results = pipe.execute()
+
+    With transaction=True the commands are wrapped in MULTI/EXEC and run
+    atomically on the server.
+    """
+
+    def __init__(self, client, transaction=False):
+        self.client = client
+        self.transaction = transaction
+        self.commands = []
+
+    def execute_command(self, *args):
+        self.commands.append(args)
+        return self
+
+    def execute(self, raise_on_error=True):
+        commands, self.commands = self.commands, []
+        if not commands:
+            return []
+        if not self.transaction:
+            return self.client._execute(commands, raise_on_error)
+        # MULTI ... EXEC in the same round trip; EXEC's reply holds every result
+        replies = self.client._round_trip([("MULTI",)] + commands + [("EXEC",)])
+        # A command refused while queuing makes the server discard the whole transaction
+        for reply in replies:
+            if isinstance(reply, Error):
+                raise response_error(reply)
+        return parse_results(commands, replies[-1], raise_on_error)
+
+    def __len__(self):
+        return len(self.commands)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.commands = []
@@ -0,0 +1,167 @@
+"""
+maxmemory eviction policies.
+
+A policy decides which key of a shard to evict next once the shard is over
+its memory budget. Shards call the hooks below while holding their lock:
+`added` for a new key, `touched` when an existing key is read or
+overwritten, `removed` when a key leaves the db, and `victim` to pick the
+next key to evict (None when nothing can be evicted). `counter` and
+`restore_counter` carry a key's access count across a warm restart.
+"""
+import collections
+import heapq
+import random
+import sys
+import time
+
+class NoEviction:
+    name = "noeviction"
+
+    def new_db(self):
+        return {}
+
+    def added(self, shard, key):
+        pass
+
+    def touched(self, shard, key):
+        pass
+
+    def removed(self, shard, key):
+        pass
+
+    def victim(self, shard):
+        return None
+
+    def counter(self, shard, key):
+        """The key's access counter, for policies that keep one (0 otherwise)."""
+        return 0
+
+    def restore_counter(self, shard, key, counter):
+        pass
+
+    def overhead(self, shard):
+        """Bytes used by the policy's own bookkeeping."""
+        return 0
+
+class AllKeysLRU(NoEviction):
+    """
+    Exact LRU over the whole dataset: the shard's db is an OrderedDict kept
+    in access order, so the victim is simply its first key.
+    """
+    name = "allkeys-lru"
+
+    def new_db(self):
+        return collections.OrderedDict()
+
+    def touched(self, shard, key):
+        shard.db.move_to_end(key)
+
+    def victim(self, shard):
+        return next(iter(shard.db), None)
+
+# Redis-style logarithmic access counter
+LFU_INIT_VAL = 5
+LFU_LOG_FACTOR = 10
+LFU_MAX_VAL = 255
+LFU_DECAY_SECONDS = 60
+
+# Per-key cost of the LFU index: a counters dict slot plus an int and a bucket (OrderedDict) slot
+LFU_ENTRY_SIZE = 32 + 75
+
+class AllKeysLFU(NoEviction):
+    """
+    Approximate LFU over the whole dataset. Every key has an 8-bit
+    logarithmic counter (starting at LFU_INIT_VAL so new keys are not evicted
+    straight away). Keys are grouped in buckets by counter, each bucket in
+    access order, so the victim is the least recently used of the least
+    frequently used keys. All counters decay by one every LFU_DECAY_SECONDS:
+    counters are stored relative to a shard-wide base that moves instead.
+    """
+    name = "allkeys-lfu"
+
+    def __init__(self):
+        self.counters = {}  # key -> stored counter (effective value + base)
+        self.buckets = {}   # stored counter -> OrderedDict of keys
+        self.started = time.monotonic()
+
+    def _base(self):
+        return int((time.monotonic() - self.started) // LFU_DECAY_SECONDS)
+
+    def _place(self, key, stored):
+        bucket = self.buckets.get(stored)
+        if bucket is None:
+            bucket = self.buckets[stored] = collections.OrderedDict()
+        bucket[key] = None
+        self.counters[key] = stored
+
+    def _unplace(self, key):
+        stored = self.counters.pop(key)
+        bucket = self.buckets[stored]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[stored]
+        return stored
+
+    def added(self, shard, key):
+        if key in self.counters:
+            self._unplace(key)
+        self._place(key, self._base() + LFU_INIT_VAL)
+
+    def touched(self, shard, key):
+        if key not in self.counters:
+            return self.added(shard, key)
+        base = self._base()
+        counter = max(self._unplace(key) - base, 0)
+        if counter < LFU_MAX_VAL and random.random() < 1 / (max(counter - LFU_INIT_VAL, 0) * LFU_LOG_FACTOR + 1):
+            counter += 1
+        self._place(key, base + counter)
+
+    def removed(self, shard, key):
+        if key in self.counters:
+            self._unplace(key)
+
+    def counter(self, shard, key):
+        stored = self.counters.get(key)
+        return 0 if stored is None else max(stored - self._base(), 0)
+
+    def restore_counter(self, shard, key, counter):
+        base = self._base()
+        if key in self.counters:
+            counter = max(counter, self._unplace(key) - base)
+        self._place(key, base + min(counter, LFU_MAX_VAL))
+
+    def victim(self, shard):
+        if not self.buckets:
+            return None
+        return next(iter(self.buckets[min(self.buckets)]))
+
+    def overhead(self, shard):
+        return sys.getsizeof(self.counters) + len(self.counters) * LFU_ENTRY_SIZE
+
+class VolatileTTL(NoEviction):
+    """Evicts the key with the nearest expiry; keys without a TTL are never evicted."""
+    name = "volatile-ttl"
+
+    def victim(self, shard):
+        heap, db = shard.expiry_heap, shard.db
+        # Drop stale heap entries (deleted keys, replaced TTLs) sitting on top
+        while heap and db.get(heap[0].key) is not heap[0]:
+            heapq.heappop(heap)
+        return heap[0].key if heap else None
+
+EVICTION_POLICIES = {
+    policy.name: policy for policy in (NoEviction, AllKeysLRU, AllKeysLFU, VolatileTTL)
+}
+
+def make_policy(name):
+    if name not in EVICTION_POLICIES:
+        raise ValueError(f"maxmemory policy must be one of {tuple(EVICTION_POLICIES)}")
+    return EVICTION_POLICIES[name]()
+
+def parse_memory(text):
+    """'0', '1048576', '512kb', '100mb', '2gb' -> bytes."""
+    text = str(text).strip().lower()
+    for suffix, factor in (("gb", 1024 ** 3), ("mb", 1024 ** 2), ("kb", 1024), ("b", 1)):
+        if text.endswith(suffix):
+            return int(float(text[:-len(suffix)]) * factor)
+    return int(text)
@@ -0,0 +1,313 @@
+"""
+Hot-tier policies.
+
+Every shard keeps a few keys in a small hot tier in front of its db. The
+policy decides what a hit does, whether a key just read from the db is
+admitted, and which key leaves when the tier is full. Shards call these
+methods while holding their lock:
+
+    lookup(key)         the hot Node for a read (recording the access) or None
+    admit(key, value)   after a miss; the policy may decline or evict a key
+    update(key, value)  a write to a key that may be hot (not an access)
+    remove(key)         the key left the db
+
+For warm restarts, checkpoint() lists the hot keys (with their segment and
+access frequency) and restore() puts such a key back where it was.
+"""
+import sys
+
+from .node import Node
+
+class LRUSegment:
+    """An index plus a Node list in recency order (most recent at the head)."""
+
+    def __init__(self, name="main"):
+        self.name = name
+        self.entries = {}
+        self.head = Node()
+        self.tail = Node()
+        self.head.next = self.tail
+        self.tail.prev = self.head
+
+    def __len__(self):
+        return len(self.entries)
+
+    def push_front(self, node):
+        self.entries[node.key] = node
+        node.prev = self.head
+        node.next = self.head.next
+        self.head.next.prev = node
+        self.head.next = node
+
+    def push_back(self, node):
+        self.entries[node.key] = node
+        node.next = self.tail
+        node.prev = self.tail.prev
+        self.tail.prev.next = node
+        self.tail.prev = node
+
+    def unlink(self, node):
+        del self.entries[node.key]
+        p, n = node.prev, node.next
+        p.next, n.prev = n, p
+
+    def move_to_front(self, node):
+        p, n = node.prev, node.next
+        p.next, n.prev = n, p
+        node.prev = self.head
+        node.next = self.head.next
+        self.head.next.prev = node
+        self.head.next = node
+
+    def last(self):
+        node = self.tail.prev
+        return None if node is self.head else node
+
+    def pop_last(self):
+        node = self.last()
+        if node is not None:
+            self.unlink(node)
+        return node
+
+class LRUHotCache:
+    """Plain LRU: every miss is admitted and pushes out the least recently used key."""
+    name = "lru"
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.segments = [LRUSegment()]
+
+    def __len__(self):
+        return sum(len(segment) for segment in self.segments)
+
+    def find(self, key):
+        """The hot Node for `key`, without counting an access."""
+        for segment in self.segments:
+            node = segment.entries.get(key)
+            if node is not None:
+                return node
+        return None
+
+    def lookup(self, key):
+        segment = self.segments[0]
+        node = segment.entries.get(key)
+        if node is not None:
+            segment.move_to_front(node)
+        return node
+
+    def admit(self, key, value):
+        segment = self.segments[0]
+        segment.push_front(Node(key, value))
+        if len(segment) > self.capacity:
+            segment.pop_last()
+
+    def update(self, key, value):
+        # In place: a write neither promotes the key nor counts as a read
+        node = self.find(key)
+        if node is not None:
+            node.value = value
+
+    def remove(self, key):
+        for segment in self.segments:
+            node = segment.entries.get(key)
+            if node is not None:
+                segment.unlink(node)
+                return
+
+    def frequency(self, key):
+        """Estimated recent reads of `key`, for policies that count them."""
+        return 0
+
+    def checkpoint(self):
+        """
+        Yields (segment name, key, frequency) for every hot key, most valuable
+        first: later (protected) segments before earlier ones, each from its
+        most recently used key.
+        """
+        for segment in reversed(self.segments):
+            node = segment.head.next
+            while node is not segment.tail:
+                yield segment.name, node.key, self.frequency(node.key)
+                node = node.next
+
+    def restore(self, segment, key, value, frequency=0):
+        """
+        Puts back a key listed by checkpoint() (possibly under another policy),
+        behind the keys already hot. Returns False once there is no room left.
+        """
+        if len(self) >= self.capacity:
+            return False
+        if self.find(key) is None:
+            self.segments[0].push_back(Node(key, value))
+        return True
+
+    def index_size(self):
+        """Bytes used by the segment indexes."""
+        return sum(sys.getsizeof(segment.entries) for segment in self.segments)
+
+# Share of an SLRU's capacity reserved for keys hit at least twice
+SLRU_PROTECTED_RATIO = 0.8
+
+class SLRUHotCache(LRUHotCache):
+    """
+    Segmented LRU. New keys enter a probation segment; a second hit
+    promotes them to the protected segment, whose overflow is demoted back
+    to probation. Victims always come from probation, so a scan that
+    touches each key once can only churn probation and leaves the keys
+    that were hit repeatedly in place. Each segment gets at least one
+    slot, so the capacity is at least 2 whatever is asked for.
+    """
+    name = "slru"
+
+    def __init__(self, capacity):
+        self.capacity = max(capacity, 2)
+        self.protected_capacity = min(max(int(self.capacity * SLRU_PROTECTED_RATIO), 1), self.capacity - 1)
+        self.probation = LRUSegment("probation")
+        self.protected = LRUSegment("protected")
+        self.segments = [self.probation, self.protected]
+
+    def lookup(self, key):
+        node = self.protected.entries.get(key)
+        if node is not None:
+            self.protected.move_to_front(node)
+            return node
+        node = self.probation.entries.get(key)
+        if node is not None:
+            self.probation.unlink(node)
+            self.protected.push_front(node)
+            if len(self.protected) > self.protected_capacity:
+                self.probation.push_front(self.protected.pop_last())
+        return node
+
+    def admit(self, key, value):
+        self.probation.push_front(Node(key, value))
+        if len(self.probation) + len(self.protected) > self.capacity:
+            self.probation.pop_last()
+
+    def restore(self, segment, key, value, frequency=0):
+        if len(self.probation) + len(self.protected) >= self.capacity:
+            return False
+        if self.find(key) is None:
+            protected = segment == "protected" and len(self.protected) < self.protected_capacity
+            (self.protected if protected else self.probation).push_back(Node(key, value))
+        return True
+
+# Count-min sketch shape: rows, counter ceiling (4-bit counters) and how many
+# increments per unit of capacity before every counter is halved
+SKETCH_DEPTH = 4
+SKETCH_MAX_COUNT = 15
+SKETCH_SAMPLE_FACTOR = 10
+HALVE = bytes(i >> 1 for i in range(256))
+
+class FrequencySketch:
+    """
+    Approximate access counts for recently seen keys (admitted or not) in a
+    fixed amount of memory: SKETCH_DEPTH rows of small counters, one byte
+    each, read as the minimum over the rows. Counters are halved after
+    every SKETCH_SAMPLE_FACTOR * capacity increments so old popularity fades.
+    """
+
+    def __init__(self, capacity):
+        self.width = 1 << max(4, capacity.bit_length() + 1)
+        self.mask = self.width - 1
+        self.table = bytearray(self.width * SKETCH_DEPTH)
+        self.sample_size = SKETCH_SAMPLE_FACTOR * max(capacity, 1)
+        self.additions = 0
+
+    def _slots(self, key):
+        # One hash, SKETCH_DEPTH row positions by double hashing (h1 + row * h2)
+        h = hash(key)
+        mask, width = self.mask, self.width
+        h1, h2 = h & mask, (h >> 32) | 1
+        return (h1, width + ((h1 + h2) & mask), 2 * width + ((h1 + 2 * h2) & mask),
+                3 * width + ((h1 + 3 * h2) & mask))
+
+    def increment(self, key):
+        table = self.table
+        for slot in self._slots(key):
+            if table[slot] < SKETCH_MAX_COUNT:
+                table[slot] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.table = bytearray(table.translate(HALVE))
+            self.additions //= 2
+
+    def frequency(self, key):
+        a, b, c, d = self._slots(key)
+        table = self.table
+        return min(table[a], table[b], table[c], table[d])
+
+    def restore(self, key, frequency):
+        """Raises the key's counters to at least `frequency` (warm restarts)."""
+        table = self.table
+        frequency = min(frequency, SKETCH_MAX_COUNT)
+        for slot in self._slots(key):
+            if table[slot] < frequency:
+                table[slot] = frequency
+
+# Share of a W-TinyLFU's capacity used by its admission window
+TINYLFU_WINDOW_RATIO = 0.01
+
+class TinyLFUHotCache(SLRUHotCache):
+    """
+    W-TinyLFU. New keys enter a small LRU window; a key pushed out of the
+    window only joins the main SLRU if the frequency sketch says it has been
+    read more often than the main segment's victim. A one-off scan is
+    recorded in the sketch but never displaces frequently read keys.
+    The window and both main segments hold at least one key each.
+    """
+    name = "w-tinylfu"
+
+    def __init__(self, capacity):
+        window_capacity = max(1, int(capacity * TINYLFU_WINDOW_RATIO))
+        super().__init__(capacity - window_capacity)
+        self.window_capacity = window_capacity
+        self.window = LRUSegment("window")
+        self.segments = [self.window, self.probation, self.protected]
+        self.sketch = FrequencySketch(capacity)
+
+    def lookup(self, key):
+        self.sketch.increment(key)
+        node = self.window.entries.get(key)
+        if node is not None:
+            self.window.move_to_front(node)
+            return node
+        return super().lookup(key)
+
+    def admit(self, key, value):
+        self.window.push_front(Node(key, value))
+        if len(self.window) <= self.window_capacity:
+            return
+        candidate = self.window.pop_last()
+        if len(self.probation) + len(self.protected) < self.capacity:
+            self.probation.push_front(candidate)
+            return
+        victim = self.probation.last() or self.protected.last()
+        if victim is None:
+            return
+        if self.sketch.frequency(candidate.key) > self.sketch.frequency(victim.key):
+            self.remove(victim.key)
+            self.probation.push_front(candidate)
+
+    def frequency(self, key):
+        return self.sketch.frequency(key)
+
+    def restore(self, segment, key, value, frequency=0):
+        self.sketch.restore(key, frequency)
+        if segment == "window" and len(self.window) < self.window_capacity:
+            if self.find(key) is None:
+                self.window.push_back(Node(key, value))
+            return True
+        return super().restore(segment, key, value, frequency)
+
+    def index_size(self):
+        return super().index_size() + sys.getsizeof(self.sketch.table)
+
+HOT_CACHE_POLICIES = {
+    policy.name: policy for policy in (LRUHotCache, SLRUHotCache, TinyLFUHotCache)
+}
+
+def make_hot_cache(name, capacity):
+    if name not in HOT_CACHE_POLICIES:
+        raise ValueError(f"hot cache policy must be one of {tuple(HOT_CACHE_POLICIES)}")
+    return HOT_CACHE_POLICIES[name](capacity)
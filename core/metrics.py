@@ -0,0 +1,120 @@
+"""
+Low-overhead instrumentation: latency histograms, per-command stats, the
+slow log and a lock that measures how long acquirers waited.
+
+Histograms have power-of-two microsecond buckets, so recording a sample is
+a few integer operations and percentiles are accurate to within a factor
+of two. They are updated in place on the event loop; the AOF's histograms
+are updated by its writer in the executor, one batch at a time.
+"""
+import asyncio
+import collections
+import time
+
+# Bucket i counts durations in [2^(i-1), 2^i) microseconds (bucket 0: under 1 µs);
+# the last bucket also takes everything longer
+HISTOGRAM_BUCKETS = 32
+
+class LatencyHistogram:
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0.0  # seconds
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[min(int(seconds * 1e6).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction: float):
+        """Upper bound, in microseconds, of the bucket holding the given quantile (at most the max)."""
+        if not self.count:
+            return 0
+        rank, seen, highest = fraction * self.count, 0, int(self.max * 1e6)
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(1 << i, highest)
+        return highest
+
+    def describe(self):
+        """count=..,p50=..,p99=..,p999=..,max=.. (microseconds), as used by INFO."""
+        return (f"count={self.count},p50={self.percentile(0.5)},p99={self.percentile(0.99)},"
+                f"p999={self.percentile(0.999)},max={int(self.max * 1e6)}")
+
+# Arguments kept per slow log entry, and characters kept per argument
+SLOWLOG_MAX_ARGS = 32
+SLOWLOG_MAX_ARG_LENGTH = 128
+
+class SlowLog:
+    """
+    The most recent commands that ran for at least `threshold_usec`
+    microseconds (0 logs every command, a negative value disables the log).
+    Each entry is [id, unix time, duration in µs, arguments].
+    """
+
+    def __init__(self, threshold_usec: int = 10000, max_len: int = 128):
+        self.threshold_usec = threshold_usec
+        self.entries = collections.deque(maxlen=max_len)
+        self.next_id = 0
+
+    def add(self, args, seconds: float):
+        shown = [arg if len(arg) <= SLOWLOG_MAX_ARG_LENGTH
+                 else f"{arg[:SLOWLOG_MAX_ARG_LENGTH]}... ({len(arg) - SLOWLOG_MAX_ARG_LENGTH} more bytes)"
+                 for arg in args[:SLOWLOG_MAX_ARGS]]
+        if len(args) > SLOWLOG_MAX_ARGS:
+            shown.append(f"... ({len(args) - SLOWLOG_MAX_ARGS} more arguments)")
+        self.entries.appendleft([self.next_id, int(time.time()), int(seconds * 1e6), shown])
+        self.next_id += 1
+
+    def reset(self):
+        self.entries.clear()
+
+class Metrics:
+    """
+    Per-command call counts and latency, plus named histograms for internal
+    operations (lock waits, AOF writes and fsyncs, rewrites, expiry cycles...).
+    """
+
+    def __init__(self):
+        self.commands = {}  # command name -> LatencyHistogram
+        self.failed = collections.Counter()
+        self.histograms = {}
+        self.slowlog = SlowLog()
+
+    def histogram(self, name: str):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = LatencyHistogram()
+        return histogram
+
+    def record_command(self, name: str, args, seconds: float, failed: bool):
+        histogram = self.commands.get(name)
+        if histogram is None:
+            histogram = self.commands[name] = LatencyHistogram()
+        histogram.observe(seconds)
+        if failed:
+            self.failed[name] += 1
+        if 0 <= self.slowlog.threshold_usec <= seconds * 1e6:
+            self.slowlog.add(args, seconds)
+
+    def total_commands(self):
+        return sum(histogram.count for histogram in self.commands.values())
+
+class TimedLock(asyncio.Lock):
+    """An asyncio.Lock that records every acquire()'s wait in a histogram."""
+
+    def __init__(self, histogram: LatencyHistogram):
+        super().__init__()
+        self.histogram = histogram
+
+    async def acquire(self):
+        start = time.perf_counter()
+        await super().acquire()
+        self.histogram.observe(time.perf_counter() - start)
+        return True
@@ -1,16 +1,45 @@
-import time
-
 class Node:
-    def __init__(self, key=None, value=None, ttl=None):
+    """Hot-cache linked list node. Slotted: there is one per hot key."""
+    __slots__ = ("key", "value", "prev", "next")
+
+    def __init__(self, key=None, value=None):
         self.key = key
         self.value = value
-        # expiry is a unix timestamp (current time + ttl seconds)
-        self.expiry = (time.time() + ttl) if ttl else None
         self.prev = None
         self.next = None
 
-    def is_expired(self):
-        """Check if the current time has passed the expiry timestamp."""
-        if self.expiry is None:
-            return False
-        return time.time() > self.expiry
\ No newline at end of file
+class Expiring:
+    """
+    A value with its expiry stored inline. The db holds bare values for
+    persistent keys and an Expiring for volatile ones, so there is no
+    parallel expiries dict, and the entries themselves (ordered by expiry)
+    form the shard's expiry heap. Never mutated in place (snapshot views keep
+    references to old entries); a new TTL means a new object.
+    """
+    __slots__ = ("key", "value", "expiry")
+
+    def __init__(self, key, value, expiry: float):
+        self.key = key
+        self.value = value
+        # expiry is a unix timestamp (current time + ttl seconds)
+        self.expiry = expiry
+
+    def __lt__(self, other):
+        return self.expiry < other.expiry
+
+    def is_expired(self, now: float):
+        """Check if `now` has passed the expiry timestamp."""
+        return now > self.expiry
+
+class SegmentRef:
+    """
+    Where a spilled value lives in the disk tier (see persistence.segment_store):
+    stored in the db in place of the value. Unlike Expiring it may be updated
+    in place, but only to move it to a copy of the same bytes (segment merges).
+    """
+    __slots__ = ("segment", "offset", "length")
+
+    def __init__(self, segment: int, offset: int, length: int):
+        self.segment = segment
+        self.offset = offset
+        self.length = length
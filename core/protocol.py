@@ -0,0 +1,224 @@
+"""
+Wire protocol helpers shared by the server, the follower and the clients.
+
+Requests are RESP arrays of bulk strings (the framing Redis clients speak), with
+a fallback for plain-text "inline" commands terminated by a newline so telnet
+style clients keep working. The parser is incremental: feed it whatever a TCP
+read returned and it yields every complete command in the buffer.
+"""
+
+# Guard rails against clients that never terminate a frame
+MAX_INLINE_LENGTH = 64 * 1024
+MAX_BULK_LENGTH = 512 * 1024 * 1024
+MAX_ARRAY_LENGTH = 1024 * 1024
+
+class ProtocolError(Exception):
+    pass
+
+class SimpleString(str):
+    """A status reply such as OK (encoded as +OK in RESP)."""
+
+class Error(str):
+    """An error reply (encoded as -<message> in RESP)."""
+
+OK = SimpleString("OK")
+
+def _decode(raw):
+    # surrogateescape lets arbitrary bytes round-trip through str values
+    return raw.decode("utf-8", "surrogateescape")
+
+def _encode(text):
+    return text.encode("utf-8", "surrogateescape")
+
+class RequestParser:
+    def __init__(self):
+        self._buffer = bytearray()
+        self._pos = 0
+
+    def feed(self, data):
+        self._buffer += data
+
+    def buffered(self):
+        """Number of bytes received but not yet parsed into a command."""
+        return len(self._buffer) - self._pos
+
+    def __iter__(self):
+        """Yields (args, inline) for every complete command currently buffered."""
+        while True:
+            command = self._parse_one()
+            if command is None:
+                return
+            if command[0]:
+                yield command
+
+    def _compact(self):
+        if self._pos:
+            del self._buffer[:self._pos]
+            self._pos = 0
+
+    def _parse_one(self):
+        buf, pos = self._buffer, self._pos
+        # Skip stray newlines between commands
+        while pos < len(buf) and buf[pos] in (10, 13):
+            pos += 1
+        self._pos = pos
+        if pos >= len(buf):
+            self._compact()
+            return None
+
+        if buf[pos] == 42:  # '*' -> RESP array
+            return self._parse_array(buf, pos)
+        return self._parse_inline(buf, pos)
+
+    def _parse_inline(self, buf, pos):
+        end = buf.find(b"\n", pos)
+        if end < 0:
+            if len(buf) - pos > MAX_INLINE_LENGTH:
+                raise ProtocolError("too big inline request")
+            self._compact()
+            return None
+        self._pos = end + 1
+        return _decode(bytes(buf[pos:end])).split(), True
+
+    def _read_header(self, buf, pos, prefix):
+        end = buf.find(b"\r\n", pos)
+        if end < 0:
+            if len(buf) - pos > MAX_INLINE_LENGTH:
+                raise ProtocolError("too big header")
+            return None, pos
+        if buf[pos] != prefix:
+            raise ProtocolError(f"expected '{chr(prefix)}', got '{chr(buf[pos])}'")
+        try:
+            return int(buf[pos + 1:end]), end + 2
+        except ValueError:
+            raise ProtocolError("invalid length")
+
+    def _parse_array(self, buf, pos):
+        count, cur = self._read_header(buf, pos, 42)
+        if count is None:
+            self._compact()
+            return None
+        if count > MAX_ARRAY_LENGTH:
+            raise ProtocolError("invalid multibulk length")
+
+        args = []
+        for _ in range(count):
+            if cur >= len(buf):
+                self._compact()
+                return None
+            length, start = self._read_header(buf, cur, 36)  # '$'
+            if length is None:
+                self._compact()
+                return None
+            if length < 0 or length > MAX_BULK_LENGTH:
+                raise ProtocolError("invalid bulk length")
+            stop = start + length
+            if stop + 2 > len(buf):
+                self._compact()
+                return None
+            if buf[stop:stop + 2] != b"\r\n":
+                raise ProtocolError("expected CRLF after bulk string")
+            args.append(_decode(bytes(buf[start:stop])))
+            cur = stop + 2
+
+        self._pos = cur
+        return args, False
+
+# Returned by ReplyParser._parse when the buffer does not hold a full reply yet
+_INCOMPLETE = object()
+
+class ReplyParser:
+    """Incremental RESP reply parser used by clients and followers."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._pos = 0
+
+    def feed(self, data):
+        self._buffer += data
+
+    def __iter__(self):
+        """Yields every complete reply currently buffered."""
+        while True:
+            result = self._parse(self._pos)
+            if result is _INCOMPLETE:
+                if self._pos:
+                    del self._buffer[:self._pos]
+                    self._pos = 0
+                return
+            value, self._pos = result
+            yield value
+
+    def _parse(self, pos):
+        buf = self._buffer
+        end = buf.find(b"\r\n", pos)
+        if end < 0:
+            return _INCOMPLETE
+        kind, line, nxt = buf[pos], bytes(buf[pos + 1:end]), end + 2
+
+        if kind == 43:  # '+'
+            return SimpleString(_decode(line)), nxt
+        if kind == 45:  # '-'
+            return Error(_decode(line)), nxt
+        if kind == 58:  # ':'
+            return int(line), nxt
+        if kind == 36:  # '$'
+            length = int(line)
+            if length < 0:
+                return None, nxt
+            if nxt + length + 2 > len(buf):
+                return _INCOMPLETE
+            return _decode(bytes(buf[nxt:nxt + length])), nxt + length + 2
+        if kind == 42:  # '*'
+            count = int(line)
+            if count < 0:
+                return None, nxt
+            items = []
+            for _ in range(count):
+                result = self._parse(nxt)
+                if result is _INCOMPLETE:
+                    return _INCOMPLETE
+                value, nxt = result
+                items.append(value)
+            return items, nxt
+        raise ProtocolError(f"unexpected reply type '{chr(kind)}'")
+
+def encode_command(*args):
+    """Encodes a command as a RESP array of bulk strings."""
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else _encode(str(arg))
+        out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(out)
+
+def encode_reply(value):
+    """Encodes a handler result as a RESP reply."""
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, Error):
+        return b"-" + _encode(value.replace("\r\n", " ")) + b"\r\n"
+    if isinstance(value, SimpleString):
+        return b"+" + _encode(value) + b"\r\n"
+    if isinstance(value, bool):
+        return b":1\r\n" if value else b":0\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, (list, tuple)):
+        return b"*%d\r\n" % len(value) + b"".join(encode_reply(v) for v in value)
+    data = value if isinstance(value, bytes) else _encode(str(value))
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+def _inline_text(value):
+    if value is None:
+        return "(nil)"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, (list, tuple)):
+        return "\n".join(_inline_text(v) for v in value)
+    if isinstance(value, bytes):
+        return _decode(value)
+    return str(value)
+
+def encode_inline_reply(value):
+    """Encodes a handler result in the legacy one-line-per-reply text format."""
+    return _encode(_inline_text(value)) + b"\n"
@@ -0,0 +1,247 @@
+"""
+Key enumeration for SCAN and KEYRANGE.
+
+SCAN cursors are stateless: everything needed to resume is in the cursor
+itself, so abandoned scans cost nothing and scans survive writes. Shards
+are visited in turn, one lock acquisition per step. Inside a shard the
+cursor is either
+
+  - a hash-bucket position (the default): the shard keeps its keys in
+    2^bits buckets by the low bits of their hash (HashBucketIndex), and
+    buckets are visited in reverse-binary order as Redis does. The table
+    doubles as the shard grows, and the reverse-binary order still visits
+    every bucket of the new size after it changes. A step reads whole
+    buckets until it has examined about COUNT keys.
+  - the last key returned, when the shard keeps an ordered index: the next
+    step resumes right after it in O(log n), and a pattern with a literal
+    prefix starts at that prefix.
+
+Either way, a key present for the whole scan is returned at least once.
+Keys added or removed during the scan may or may not be returned.
+"""
+import bisect
+import re
+import sys
+
+# Keys per block of a SortedKeyIndex; blocks split at twice this size
+INDEX_BLOCK_SIZE = 512
+
+# Memory estimate: one pointer per key, plus a list header and some slack per block
+INDEX_SLOT_SIZE = 8
+INDEX_BLOCK_OVERHEAD = 64 + INDEX_SLOT_SIZE * INDEX_BLOCK_SIZE // 4
+
+class SortedKeyIndex:
+    """
+    The keys of one shard in lexicographic order, stored as a list of sorted
+    blocks (plus each block's last key) so adding or removing a key moves
+    at most one block. Lookups and range starts are O(log n).
+    """
+
+    def __init__(self, keys=()):
+        self.blocks = []
+        self.maxes = []
+        keys = sorted(keys)
+        for i in range(0, len(keys), INDEX_BLOCK_SIZE):
+            self.blocks.append(keys[i:i + INDEX_BLOCK_SIZE])
+            self.maxes.append(self.blocks[-1][-1])
+        self.size = len(keys)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, key: str):
+        """Inserts a key the index doesn't hold yet."""
+        self.size += 1
+        if not self.blocks:
+            self.blocks.append([key])
+            self.maxes.append(key)
+            return
+        i = bisect.bisect_left(self.maxes, key)
+        if i == len(self.maxes):
+            i -= 1
+            self.blocks[i].append(key)
+            self.maxes[i] = key
+        else:
+            bisect.insort(self.blocks[i], key)
+        block = self.blocks[i]
+        if len(block) > 2 * INDEX_BLOCK_SIZE:
+            self.blocks[i:i + 1] = [block[:INDEX_BLOCK_SIZE], block[INDEX_BLOCK_SIZE:]]
+            self.maxes[i:i + 1] = [block[INDEX_BLOCK_SIZE - 1], block[-1]]
+
+    def remove(self, key: str):
+        """Removes a key the index holds."""
+        i = bisect.bisect_left(self.maxes, key)
+        block = self.blocks[i]
+        del block[bisect.bisect_left(block, key)]
+        self.size -= 1
+        if block:
+            self.maxes[i] = block[-1]
+        else:
+            del self.blocks[i]
+            del self.maxes[i]
+
+    def keys_from(self, start: str = None, inclusive: bool = True):
+        """Keys >= `start` (> with inclusive=False) in order; don't modify the index while iterating."""
+        if start is None:
+            i = j = 0
+        elif inclusive:
+            i = bisect.bisect_left(self.maxes, start)
+            j = bisect.bisect_left(self.blocks[i], start) if i < len(self.blocks) else 0
+        else:
+            i = bisect.bisect_right(self.maxes, start)
+            j = bisect.bisect_right(self.blocks[i], start) if i < len(self.blocks) else 0
+        for block in self.blocks[i:]:
+            yield from block[j:] if j else block
+            j = 0
+
+    def memory_usage(self):
+        """Approximate bytes used by the index (the keys themselves belong to the db); O(1)."""
+        return (INDEX_SLOT_SIZE * self.size + INDEX_BLOCK_OVERHEAD * len(self.blocks)
+                + sys.getsizeof(self.blocks) + sys.getsizeof(self.maxes))
+
+# Average keys per bucket of a HashBucketIndex before its table doubles
+BUCKET_TARGET_KEYS = 32
+
+# Memory estimate: one pointer per key, plus a list header, its slack and a table slot per bucket
+BUCKET_SLOT_SIZE = 8
+BUCKET_OVERHEAD = 56 + 8 + BUCKET_SLOT_SIZE * BUCKET_TARGET_KEYS // 4
+
+class HashBucketIndex:
+    """
+    The keys of one shard grouped by the low bits of their hash, so a SCAN
+    step reads a few buckets instead of the whole shard. When the table
+    doubles, each bucket keeps the keys of its new upper twin (left as
+    None) until it is split: one bucket per add or remove, or on the spot
+    when a scan reaches it, so no single write rehashes the whole shard.
+    The table never shrinks; scans skip empty buckets cheaply.
+    """
+
+    def __init__(self, keys=()):
+        self.buckets = [[]]
+        self.size = 0
+        self._half = None  # Table size before the last doubling, while buckets are still being split
+        self._split_next = 0
+        for key in keys:
+            self.add(key)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def mask(self):
+        return len(self.buckets) - 1
+
+    def _bucket_of(self, key: str):
+        """The list holding `key`: its bucket, or the lower twin if that isn't split yet."""
+        buckets = self.buckets
+        bucket = buckets[hash(key) & (len(buckets) - 1)]
+        return bucket if bucket is not None else buckets[hash(key) & (self._half - 1)]
+
+    def _split(self, b: int):
+        """Moves the keys of upper twin `b + half` out of bucket `b`."""
+        half, low, high = self._half, [], []
+        for key in self.buckets[b]:
+            (high if hash(key) & half else low).append(key)
+        self.buckets[b], self.buckets[b + half] = low, high
+
+    def _step(self):
+        """Splits the next unsplit bucket, and grows the table once splitting is done."""
+        if self._half is not None:
+            while self._split_next < self._half and self.buckets[self._split_next + self._half] is not None:
+                self._split_next += 1
+            if self._split_next < self._half:
+                self._split(self._split_next)
+                self._split_next += 1
+            if self._split_next >= self._half:
+                self._half = None
+        elif self.size > len(self.buckets) * BUCKET_TARGET_KEYS:
+            self._half, self._split_next = len(self.buckets), 0
+            self.buckets.extend([None] * self._half)
+
+    def add(self, key: str):
+        """Inserts a key the index doesn't hold yet."""
+        self._bucket_of(key).append(key)
+        self.size += 1
+        if self._half is not None or self.size > len(self.buckets) * BUCKET_TARGET_KEYS:
+            self._step()
+
+    def remove(self, key: str):
+        """Removes a key the index holds."""
+        self._bucket_of(key).remove(key)
+        self.size -= 1
+        if self._half is not None:
+            self._step()
+
+    def bucket(self, v: int):
+        """The keys of bucket `v & mask`; don't modify the index while iterating."""
+        b = v & self.mask
+        if self.buckets[b] is None:
+            self._split(b - self._half)
+        elif self._half is not None and b < self._half and self.buckets[b + self._half] is None:
+            self._split(b)
+        return self.buckets[b]
+
+    def memory_usage(self):
+        """Approximate bytes used by the index (the keys themselves belong to the db); O(1)."""
+        return BUCKET_SLOT_SIZE * self.size + BUCKET_OVERHEAD * len(self.buckets)
+
+# --- MATCH patterns ---
+_GLOB_SPECIAL = "*?[\\"
+
+def compile_pattern(pattern: str):
+    """
+    A Redis glob (`*`, `?`, `[abc]`, `[^a-z]`, backslash escapes) as a
+    compiled regex, and the literal prefix every matching key starts with.
+    Raises ValueError for a glob that doesn't compile.
+    """
+    prefix_end = len(pattern)
+    for i, ch in enumerate(pattern):
+        if ch in _GLOB_SPECIAL:
+            prefix_end = i
+            break
+
+    parts, i = [], 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == "\\" and i + 1 < len(pattern):
+            parts.append(re.escape(pattern[i + 1]))
+            i += 2
+            continue
+        if ch == "*":
+            parts.append(".*")
+        elif ch == "?":
+            parts.append(".")
+        elif ch == "[":
+            end = pattern.find("]", i + 2)
+            if end == -1:
+                parts.append(re.escape(ch))
+            else:
+                body = pattern[i + 1:end]
+                negate = body.startswith("^")
+                body = body[1:] if negate else body
+                parts.append("[" + ("^" if negate else "") + body.replace("\\", "\\\\") + "]")
+                i = end
+        else:
+            parts.append(re.escape(ch))
+        i += 1
+    try:
+        return re.compile("".join(parts), re.DOTALL), pattern[:prefix_end]
+    except re.error as e:
+        # A character class such as [z-a]
+        raise ValueError(f"invalid pattern {pattern!r}: {e}") from None
+
+# --- Hash-bucket cursors ---
+CURSOR_BITS = 32
+CURSOR_MASK = (1 << CURSOR_BITS) - 1
+
+def _reverse_bits(v: int):
+    return int(format(v, "032b")[::-1], 2)
+
+def next_bucket_cursor(v: int, mask: int):
+    """
+    The position after bucket `v & mask`: increments the reversed cursor
+    so that buckets are visited high bits first. Returns 0 once the whole
+    table has been covered.
+    """
+    v = (v | (~mask & CURSOR_MASK)) & CURSOR_MASK
+    return _reverse_bits((_reverse_bits(v) + 1) & CURSOR_MASK)
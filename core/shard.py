@@ -0,0 +1,679 @@
+from .node import Expiring, SegmentRef
+from .eviction import NoEviction
+from .hot_cache import LRUHotCache
+from .scan import HashBucketIndex, SortedKeyIndex, next_bucket_cursor
+import asyncio
+import heapq
+import re
+import sys
+import time
+import zlib
+
+# Sentinel returned by Shard.get_locked when a lazy TTL check removed the key
+EXPIRED = object()
+
+# Marks, in a copy-on-write view, a key that did not exist when the view was taken
+ABSENT = object()
+
+# Values up to this length are interned, so repeated short values ("1", "on", ...) share one object
+INTERN_MAX_LENGTH = 32
+
+# One expiry heap slot is a pointer to the key's Expiring entry
+HEAP_ENTRY_SIZE = 8
+
+# zlib level for values compressed in memory (see Shard.compress_threshold)
+COMPRESSION_LEVEL = 6
+
+# Output bytes inflated per step when validating a zlib value (see check_compressed)
+INFLATE_CHUNK_SIZE = 64 * 1024
+
+# INCR operands: signed 64-bit integers, with no spaces, "+" or "_" (which int() would accept)
+INTEGER_PATTERN = re.compile(r"-?[0-9]+")
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+# Buckets a hash-bucket SCAN step may visit per key of its COUNT (empty ones cost next to nothing)
+SCAN_MAX_BUCKETS_PER_KEY = 10
+
+def key_hash(key: str):
+    """Stable across processes (unlike hash()), so every node maps keys the same way."""
+    return zlib.crc32(key.encode("utf-8", "surrogateescape"))
+
+def check_compressed(data: bytes, limit: int):
+    """
+    Checks that `data` is exactly one zlib stream (header, body and adler32
+    trailer) that inflates to at most `limit` bytes, and returns that size.
+    The output is inflated in chunks and dropped, so a decompression bomb
+    costs neither memory nor more than `limit` bytes of work. Raises
+    ValueError otherwise.
+    """
+    inflater = zlib.decompressobj()
+    size, pending = 0, data
+    try:
+        while pending and not inflater.eof:
+            size += len(inflater.decompress(pending, INFLATE_CHUNK_SIZE))
+            if size > limit:
+                raise ValueError(f"inflates to more than {limit} bytes")
+            pending = inflater.unconsumed_tail
+    except zlib.error as e:
+        raise ValueError(str(e))
+    if not inflater.eof:
+        raise ValueError("truncated zlib stream")
+    if inflater.unused_data:
+        raise ValueError("trailing bytes after the zlib stream")
+    return size
+
+def parse_int64(text: str):
+    """The value of a decimal integer string in the signed 64-bit range; ValueError otherwise."""
+    if not INTEGER_PATTERN.fullmatch(text):
+        raise ValueError(text)
+    value = int(text)
+    if not INT64_MIN <= value <= INT64_MAX:
+        raise ValueError(text)
+    return value
+
+def encode_value(value):
+    """
+    Compact in-memory form of a value: canonical integers ("42", "-7", but not
+    "007") are stored as ints and short strings are interned.
+    """
+    if isinstance(value, int):
+        return value
+    value = str(value)
+    if value and len(value) <= 20 and (value[0].isdigit() or value[0] == "-"):
+        try:
+            number = int(value)
+            if str(number) == value:
+                return number
+        except ValueError:
+            pass
+    if len(value) <= INTERN_MAX_LENGTH:
+        return sys.intern(value)
+    return value
+
+def decode_value(value):
+    return value if type(value) is str else str(value)
+
+def entry_size(key, raw):
+    """Bytes held by one db entry's objects (not counting its hash table slot)."""
+    if type(raw) is Expiring:
+        return sys.getsizeof(key) + sys.getsizeof(raw) + sys.getsizeof(raw.value) + HEAP_ENTRY_SIZE
+    return sys.getsizeof(key) + sys.getsizeof(raw)
+
+class OutOfMemoryError(Exception):
+    """A write was refused because the shard is over maxmemory and nothing could be evicted."""
+
+    def __init__(self):
+        super().__init__("ERROR: OOM command not allowed when used memory > 'maxmemory'")
+
+class Watch:
+    """Keys a connection WATCHes; `dirty` is set once any of them is modified."""
+    __slots__ = ("keys", "dirty")
+
+    def __init__(self):
+        self.keys = []
+        self.dirty = False
+
+def unpack(raw, segments=None):
+    """
+    (value, expiry) of a raw db entry; expiry is None for persistent keys.
+    Spilled values are read back; compressed ones stay zlib bytes, which
+    snapshots and the AOF store as such.
+    """
+    value, expiry = (raw.value, raw.expiry) if type(raw) is Expiring else (raw, None)
+    if type(value) is SegmentRef:
+        value = segments.read(value)
+    return (value if type(value) is bytes else decode_value(value)), expiry
+
+class Shard:
+    """
+    One independent slice of the keyspace with its own dict, expiry index,
+    hot tier, lock and stats. Methods ending in _locked expect the caller
+    to hold self.lock.
+
+    `db` maps each key to its encoded value (see encode_value), wrapped in an
+    Expiring when the key has a TTL. Once used_memory() exceeds `maxmemory`
+    (0 = unlimited), make_room_locked() evicts keys chosen by `policy`.
+    Reads are served from `hot` (see core.hot_cache) when the key is in it.
+    With `ordered_index`, the keys are also kept sorted (see core.scan) for
+    SCAN and KEYRANGE. With `segments` (a persistence.segment_store.SegmentStore
+    shared by the shards), large values are spilled to disk and the db keeps
+    a SegmentRef in their place; only the hot tier holds them in memory.
+
+    String values of at least `compress_threshold` characters (0 = never)
+    are stored zlib-compressed, as bytes, when that makes them smaller. They
+    are decompressed on reads that miss the hot tier, which keeps plain
+    values. Writes of compressed values return SETZ records carrying the
+    compressed bytes, so the AOF and followers get them without recompressing.
+
+    With `expire_keys` off (followers), keys whose TTL has passed are hidden
+    from reads but stay in the db until the leader's DEL for them arrives.
+    """
+
+    def __init__(self, index: int, capacity: int, policy=None, maxmemory: int = 0, hot=None, lock=None,
+                 ordered_index: bool = False, segments=None, compress_threshold: int = 0,
+                 expire_keys: bool = True):
+        self.index = index
+        self.capacity = capacity
+        self.policy = policy or NoEviction()
+        # The "Hot" tier in front of the db (an empty one is falsy, hence the None check)
+        self.hot = hot if hot is not None else LRUHotCache(capacity)
+        self.maxmemory = maxmemory
+        self.data_bytes = 0  # Sum of entry_size() over the db
+        self.db = self.policy.new_db()  # The actual database (Stores ALL keys of this shard)
+        self.volatile_keys = 0  # How many db entries are Expiring
+        # Min-heap of the Expiring db entries so due keys are found without
+        # scanning the db. Entries go stale when a key is deleted or its TTL
+        # changes; they are skipped when popped and dropped on compaction.
+        self.expiry_heap = []
+        self.ordered_keys = SortedKeyIndex() if ordered_index else None
+        # Keys by hash bucket for SCAN when there is no ordered index
+        self.bucket_keys = None if ordered_index else HashBucketIndex()
+        self.segments = segments
+        self.compress_threshold = compress_threshold
+        self.expire_keys = expire_keys
+
+        # Copy-on-write view for background snapshots: {key: old raw db entry}
+        # recorded on the first modification of a key while a snapshot is running.
+        self.cow = None
+
+        # WATCHed keys: {key: set of Watch}, marked dirty when the key is modified
+        self.watchers = {}
+
+        self.lock = lock or asyncio.Lock()
+        self.stats = {
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "expired_keys": 0,
+            "evicted_keys": 0,
+            "compressed_values": 0,
+            "compress_input_bytes": 0,
+            "compress_output_bytes": 0,
+            "compress_time": 0.0,
+            "decompressions": 0,
+            "decompress_time": 0.0,
+        }
+
+    # --- Core Logic ---
+    def get_locked(self, key: str, read_through: bool = True):
+        """
+        Lookup through the hot tier. Returns EXPIRED if a lazy TTL check removed
+        the key (None without expire_keys, which leaves it in place). A spilled value missing from the hot tier is read from its
+        segment, or with read_through=False its SegmentRef is returned so the
+        caller can read it off the event loop (see admit_locked).
+        """
+        # 1. Check if key exists in DB
+        raw = self.db.get(key)
+        if raw is None:
+            return None
+
+        # 2. Lazy TTL Check (Crucial for "nil" return on expired keys)
+        if type(raw) is Expiring:
+            if raw.is_expired(time.time()):
+                if not self.expire_keys:
+                    return None
+                self.delete_locked(key)
+                self.stats["expired_keys"] += 1
+                return EXPIRED
+            raw = raw.value
+        self.policy.touched(self, key)
+
+        # 3. Hot Hit Logic
+        node = self.hot.lookup(key)
+        if node is not None:
+            self.stats["cache_hits"] += 1
+            return decode_value(node.value)
+
+        # 4. Hot Miss (Cold Hit - in DB but not in the hot tier); the policy decides on admission
+        self.stats["cache_misses"] += 1
+        if type(raw) is SegmentRef:
+            if not read_through:
+                return raw
+            raw = self.segments.read(raw)
+        if type(raw) is bytes:
+            raw = self._decompress(raw)
+        self.hot.admit(key, raw)
+        return decode_value(raw)
+
+    def admit_locked(self, key: str, ref: SegmentRef, value):
+        """
+        Finishes a read of `ref` done outside the lock: decompresses the value
+        and offers it to the hot tier, unless the key has changed since or a
+        concurrent read already brought it in. Returns the value.
+        """
+        if type(value) is bytes:
+            value = self._decompress(value)
+        raw = self.db.get(key)
+        if (raw is not None and (raw.value if type(raw) is Expiring else raw) is ref
+                and self.hot.find(key) is None):
+            self.hot.admit(key, value)
+        return value
+
+    # --- Warm restarts ---
+    def hot_set_locked(self):
+        """(segment, key, frequency, eviction counter) of every hot key, most valuable first."""
+        policy = self.policy
+        return [(segment, key, frequency, policy.counter(self, key))
+                for segment, key, frequency in self.hot.checkpoint()]
+
+    def warm_locked(self, entries):
+        """
+        Puts checkpointed hot keys (see hot_set_locked) that still exist back
+        in the hot tier, behind the keys live traffic already brought in, and
+        restores their eviction counters. Returns how many were restored and
+        the (entry, SegmentRef) pairs of spilled values, which the caller
+        reads off the event loop and hands to warm_spilled_locked().
+        """
+        now = time.time()
+        restored, spilled = 0, []
+        for entry in entries:
+            segment, key, frequency, counter = entry
+            raw = self.db.get(key)
+            if type(raw) is Expiring:
+                raw = None if raw.is_expired(now) else raw.value
+            if raw is None:
+                continue
+            self.policy.restore_counter(self, key, counter)
+            if type(raw) is SegmentRef:
+                spilled.append((entry, raw))
+                continue
+            if type(raw) is bytes:
+                raw = self._decompress(raw)
+            restored += self.hot.restore(segment, key, raw, frequency)
+        return restored, spilled
+
+    def warm_spilled_locked(self, entry, ref: SegmentRef, value):
+        """Finishes warm_locked() for a value read from its segment, unless the key changed since."""
+        segment, key, frequency, _ = entry
+        raw = self.db.get(key)
+        if raw is None or (raw.value if type(raw) is Expiring else raw) is not ref:
+            return False
+        if type(value) is bytes:
+            value = self._decompress(value)
+        return self.hot.restore(segment, key, value, frequency)
+
+    # --- Compression ---
+    def _compress(self, value: str):
+        """`value` as zlib bytes, or unchanged if compressing doesn't make it smaller."""
+        start = time.perf_counter()
+        raw = value.encode("utf-8", "surrogateescape")
+        data = zlib.compress(raw, COMPRESSION_LEVEL)
+        self.stats["compress_time"] += time.perf_counter() - start
+        if len(data) >= len(raw):
+            return value
+        self.stats["compressed_values"] += 1
+        self.stats["compress_input_bytes"] += len(raw)
+        self.stats["compress_output_bytes"] += len(data)
+        return data
+
+    def _decompress(self, data: bytes):
+        start = time.perf_counter()
+        value = zlib.decompress(data).decode("utf-8", "surrogateescape")
+        self.stats["decompressions"] += 1
+        self.stats["decompress_time"] += time.perf_counter() - start
+        return value
+
+    def _spill(self, key: str, encoded):
+        """What the db stores for a value: the value itself, or its SegmentRef once written to disk."""
+        if type(encoded) in (str, bytes) and len(encoded) >= self.segments.min_value_size:
+            return self.segments.append(key, encoded)
+        return encoded
+
+    def _release(self, raw):
+        value = raw.value if type(raw) is Expiring else raw
+        if type(value) is SegmentRef:
+            self.segments.release(value)
+
+    def put_locked(self, key: str, value, expiry: float = None):
+        """
+        Stores a value with an absolute expiry (or none); used by SET and AOF
+        replay. `value` may be zlib bytes (already compressed). Returns the
+        encoded value: bytes if it is stored compressed.
+        """
+        if self.cow is not None:
+            self._preserve(key)
+        if self.watchers:
+            self._touch_watched(key)
+        if type(value) is bytes:
+            # Compressed by the leader, the AOF or a snapshot
+            plain = None
+            encoded = value if self.compress_threshold else self._decompress(value)
+        else:
+            encoded = plain = encode_value(value)
+            if self.compress_threshold and type(encoded) is str and len(encoded) >= self.compress_threshold:
+                encoded = self._compress(encoded)
+        stored = encoded if self.segments is None else self._spill(key, encoded)
+        old = self.db.get(key)
+        if old is not None:
+            self.data_bytes -= entry_size(key, old)
+            if type(old) is Expiring:
+                self.volatile_keys -= 1
+            if self.segments is not None:
+                self._release(old)
+
+        if expiry:
+            raw = self.db[key] = Expiring(key, stored, expiry)
+            self.volatile_keys += 1
+            self._index_expiry(raw)
+        else:
+            raw = self.db[key] = stored
+        self.data_bytes += entry_size(key, raw)
+
+        if old is None:
+            self.policy.added(self, key)
+            if self.ordered_keys is not None:
+                self.ordered_keys.add(key)
+            else:
+                self.bucket_keys.add(key)
+        else:
+            self.policy.touched(self, key)
+
+        # Update the hot tier if the key is in it
+        if plain is None and self.hot.find(key) is not None:
+            plain = encoded if type(encoded) is not bytes else self._decompress(encoded)
+        if plain is not None:
+            self.hot.update(key, plain)
+        return encoded
+
+    @staticmethod
+    def _set_record(key: str, value, encoded, expiry: float = None):
+        """
+        The AOF and replication record of a write; compressed values are
+        logged as SETZ with their zlib bytes. The expiry is absolute (PXAT,
+        unix milliseconds), so a follower applying the record late or
+        replaying it from the backlog expires the key when the leader does.
+        """
+        record = ("SETZ", key, encoded) if type(encoded) is bytes else ("SET", key, value)
+        return record + ("PXAT", int(expiry * 1000)) if expiry else record
+
+    def set_locked(self, key: str, value, ttl: int = None, expiry: float = None):
+        """Applies a SET with a relative `ttl` or an absolute `expiry` (or neither); returns its record."""
+        if ttl:
+            expiry = time.time() + ttl
+        encoded = self.put_locked(key, value, expiry)
+        return self._set_record(key, value, encoded, expiry)
+
+    def _expiry_of(self, key: str):
+        """The absolute expiry of a key (None if it is persistent or missing)."""
+        raw = self.db.get(key)
+        return raw.expiry if type(raw) is Expiring else None
+
+    def spilled_locked(self, key: str):
+        """The SegmentRef of a key whose value is on disk, else None (even if the hot tier holds it)."""
+        raw = self.db.get(key)
+        value = raw.value if type(raw) is Expiring else raw
+        return value if type(value) is SegmentRef else None
+
+    def cold_read_locked(self, ref: SegmentRef, cold=None):
+        """
+        The stored value of `ref` (zlib bytes if compressed), taken from
+        `cold`: {SegmentRef: value} read off the event loop before the lock
+        was taken (see LRUCache._lock_shards_with_cold). Only a value spilled
+        since, by the caller's own write, is read here.
+        """
+        value = cold.get(ref) if cold else None
+        return self.segments.read(ref) if value is None else value
+
+    def incr_locked(self, key: str, delta: int = 1, cold=None):
+        """
+        Adds `delta` to an integer value (a missing key counts as 0) and
+        returns its AOF record. The key keeps its TTL. Raises ValueError
+        for values that aren't 64-bit integers (see parse_int64) and
+        OverflowError if the result wouldn't be one.
+        """
+        current = self.get_locked(key, read_through=False)
+        if current in (None, EXPIRED):
+            current, expiry = 0, None
+        else:
+            # A hot hit is used as is; otherwise the value was read before the lock was taken
+            if type(current) is SegmentRef:
+                current = self.cold_read_locked(current, cold)
+                if type(current) is bytes:
+                    current = self._decompress(current)
+            current = parse_int64(current)
+            expiry = self._expiry_of(key)
+        new_value = current + delta
+        if not INT64_MIN <= new_value <= INT64_MAX:
+            raise OverflowError(new_value)
+        encoded = self.put_locked(key, new_value, expiry)
+        return self._set_record(key, new_value, encoded, expiry)
+
+    def append_locked(self, key: str, suffix: str, cold=None):
+        """
+        Appends to a value (a missing key counts as empty); the key keeps
+        its TTL. Returns its AOF record and the new length.
+        """
+        current = self.get_locked(key, read_through=False)
+        if type(current) is SegmentRef:
+            current = self.cold_read_locked(current, cold)
+            if type(current) is bytes:
+                current = self._decompress(current)
+        if current in (None, EXPIRED):
+            new_value, expiry = suffix, None
+        else:
+            new_value, expiry = current + suffix, self._expiry_of(key)
+        encoded = self.put_locked(key, new_value, expiry)
+        return self._set_record(key, new_value, encoded, expiry), len(new_value)
+
+    def delete_locked(self, key: str):
+        """Removes a key from the DB and hot tier; returns whether it existed."""
+        if self.cow is not None:
+            self._preserve(key)
+        raw = self.db.pop(key, None)
+        if raw is not None:
+            if self.watchers:
+                self._touch_watched(key)
+            self.data_bytes -= entry_size(key, raw)
+            self.policy.removed(self, key)
+            if self.ordered_keys is not None:
+                self.ordered_keys.remove(key)
+            else:
+                self.bucket_keys.remove(key)
+            if type(raw) is Expiring:
+                self.volatile_keys -= 1
+            if self.segments is not None:
+                self._release(raw)
+        self.hot.remove(key)
+        return raw is not None
+
+    def reset_locked(self):
+        """Empties the shard (a follower about to load a full sync)."""
+        for watches in self.watchers.values():
+            for watch in watches:
+                watch.dirty = True
+        if self.segments is not None:
+            for raw in self.db.values():
+                self._release(raw)
+        self.policy = type(self.policy)()
+        self.db = self.policy.new_db()
+        self.hot = type(self.hot)(self.capacity)
+        self.expiry_heap = []
+        if self.ordered_keys is not None:
+            self.ordered_keys = SortedKeyIndex()
+        else:
+            self.bucket_keys = HashBucketIndex()
+        self.volatile_keys = 0
+        self.data_bytes = 0
+
+    # --- WATCH ---
+    def _touch_watched(self, key: str):
+        watches = self.watchers.get(key)
+        if watches:
+            for watch in watches:
+                watch.dirty = True
+
+    def watch(self, key: str, watch: Watch):
+        self.watchers.setdefault(key, set()).add(watch)
+
+    def unwatch(self, key: str, watch: Watch):
+        watches = self.watchers.get(key)
+        if watches is not None:
+            watches.discard(watch)
+            if not watches:
+                del self.watchers[key]
+
+    # --- maxmemory ---
+    def used_memory(self):
+        """Entries plus the db hash table, expiry heap and eviction bookkeeping, in bytes."""
+        return (self.data_bytes + sys.getsizeof(self.db) + sys.getsizeof(self.expiry_heap)
+                + self.policy.overhead(self)
+                + (self.ordered_keys if self.ordered_keys is not None else self.bucket_keys).memory_usage())
+
+    def make_room_locked(self):
+        """
+        Evicts keys until the shard is back under maxmemory. Returns
+        (evicted_keys, ok); ok is False when the shard is still over the
+        limit because the policy found nothing to evict.
+        """
+        evicted = []
+        while self.maxmemory and self.used_memory() > self.maxmemory:
+            key = self.policy.victim(self)
+            if key is None:
+                break
+            self.delete_locked(key)
+            evicted.append(key)
+        self.stats["evicted_keys"] += len(evicted)
+        return evicted, not self.maxmemory or self.used_memory() <= self.maxmemory
+
+    # --- Expiry Index ---
+    def _index_expiry(self, entry: Expiring):
+        heapq.heappush(self.expiry_heap, entry)
+        # Keep stale entries from outgrowing the live ones (amortised O(1))
+        if len(self.expiry_heap) > 2 * self.volatile_keys + 64:
+            db = self.db
+            self.expiry_heap = [e for e in self.expiry_heap if db.get(e.key) is e]
+            heapq.heapify(self.expiry_heap)
+
+    def pop_expired_locked(self, now: float, limit: int):
+        """
+        Deletes keys whose TTL has passed, looking at no more than `limit`
+        heap entries. Returns (deleted_keys, more_due) where more_due tells
+        the sweeper this shard still has a backlog.
+        """
+        heap, db = self.expiry_heap, self.db
+        deleted = []
+        for _ in range(limit):
+            if not heap or heap[0].expiry >= now:
+                break
+            entry = heapq.heappop(heap)
+            if db.get(entry.key) is not entry:
+                continue  # Stale: the key was deleted or given a new TTL
+            self.delete_locked(entry.key)
+            deleted.append(entry.key)
+        self.stats["expired_keys"] += len(deleted)
+        return deleted, bool(heap) and heap[0].expiry < now
+
+    # --- Enumeration ---
+    def _live(self, key: str, now: float):
+        raw = self.db.get(key)
+        return raw is not None and not (type(raw) is Expiring and raw.is_expired(now))
+
+    def scan_locked(self, position, count: int, match=None, prefix: str = "", now: float = None):
+        """
+        One SCAN step over this shard (see core.scan). `position` is None to
+        start, then whatever the previous step returned. Returns (next
+        position, or None once the shard is done, and the matching live keys).
+        """
+        now = now or time.time()
+        if self.ordered_keys is not None:
+            # Resume after the last key examined; a literal prefix bounds the range
+            if position is None or position < prefix:
+                candidates = self.ordered_keys.keys_from(prefix or None)
+            else:
+                candidates = self.ordered_keys.keys_from(position, inclusive=False)
+            keys, examined = [], 0
+            for key in candidates:
+                if not key.startswith(prefix):
+                    return None, keys
+                if self._live(key, now) and (match is None or match.fullmatch(key)):
+                    keys.append(key)
+                examined += 1
+                if examined >= count:
+                    return key, keys
+            return None, keys
+
+        # Whole hash buckets until about `count` keys have been examined
+        v, keys, examined = position or 0, [], 0
+        for _ in range(count * SCAN_MAX_BUCKETS_PER_KEY):
+            bucket = self.bucket_keys.bucket(v)
+            examined += len(bucket)
+            keys.extend(key for key in bucket
+                        if key.startswith(prefix) and self._live(key, now)
+                        and (match is None or match.fullmatch(key)))
+            v = next_bucket_cursor(v, self.bucket_keys.mask)
+            if not v or examined >= count:
+                break
+        return v or None, keys
+
+    def range_locked(self, start, start_inclusive, end, end_inclusive, limit, now):
+        """Live keys between two bounds (None = unbounded) in order, at most `limit` (None = all)."""
+        keys = []
+        for key in self.ordered_keys.keys_from(start, start_inclusive):
+            if end is not None and (key > end or (key == end and not end_inclusive)):
+                break
+            if self._live(key, now):
+                keys.append(key)
+                if limit is not None and len(keys) >= limit:
+                    break
+        return keys
+
+    # --- Disk tier ---
+    def relocate_locked(self, key: str, segment: int, offset: int, data: bytes):
+        """
+        Moves the key's value out of a segment being merged if that record is
+        still its value. `data` is the record's value, read off the event loop.
+        """
+        raw = self.db.get(key)
+        value = raw.value if type(raw) is Expiring else raw
+        if type(value) is SegmentRef and value.segment == segment and value.offset == offset:
+            self.segments.relocate(key, value, data)
+
+    # --- Introspection ---
+    def memory_usage_locked(self, key: str):
+        """
+        Estimated bytes used by one key: its strings/objects, its share of
+        the db (and hot tier) indexes and, if volatile, its heap entry.
+        Shared objects such as interned strings and small ints are counted
+        in full. Returns None for missing keys.
+        """
+        raw = self.db.get(key)
+        if raw is None:
+            return None
+        size = entry_size(key, raw) + sys.getsizeof(self.db) // len(self.db)
+        if type(raw) is Expiring:
+            size += sys.getsizeof(raw.expiry)
+        node = self.hot.find(key)
+        if node is not None:
+            size += sys.getsizeof(node) + self.hot.index_size() // len(self.hot)
+        return size
+
+    # --- Copy-on-write snapshot view ---
+    def _preserve(self, key: str):
+        if key not in self.cow:
+            self.cow[key] = self.db.get(key, ABSENT)
+
+    def snapshot_keys(self):
+        """Keys that existed when the copy-on-write view was started."""
+        keys = list(self.db)
+        keys.extend(k for k, raw in self.cow.items() if raw is not ABSENT and k not in self.db)
+        return keys
+
+    def snapshot_entries(self, keys, now: float):
+        """
+        (key, value, expiry) as of the start of the view, skipping expired
+        keys, and (index, view) of the entries whose value is spilled: their
+        value is left for the caller to read off the event loop (read_view).
+        """
+        entries, cold = [], []
+        for key in keys:
+            raw = self.cow[key] if key in self.cow else self.db.get(key, ABSENT)
+            if raw is ABSENT:
+                continue
+            value, expiry = (raw.value, raw.expiry) if type(raw) is Expiring else (raw, None)
+            if expiry and expiry <= now:
+                continue
+            if type(value) is SegmentRef:
+                cold.append((len(entries), self.segments.view(value)))
+            elif type(value) is not bytes:
+                value = decode_value(value)
+            entries.append((key, value, expiry))
+        return entries, cold
@@ -1,186 +1,822 @@
-from .node import Node
-import asyncio 
+from .shard import Shard, Watch, EXPIRED, OutOfMemoryError, key_hash, unpack
+from .eviction import make_policy
+from .hot_cache import make_hot_cache
+from .metrics import Metrics, TimedLock
+from .node import SegmentRef
+from .scan import compile_pattern
+import asyncio
+import contextlib
+import heapq
+import itertools
+import mmap
 import time
 from persistence.aof_logger import AOFLogger
+from persistence.manager import SnapshotReader
+from persistence.segment_store import read_view
+
+def format_info(sections, section=None):
+    """Renders {name: callable returning the section body} as INFO text, optionally just one section."""
+    if section is not None and section.lower() != "all":
+        section = section.lower()
+        sections = {section: sections[section]} if section in sections else {}
+    return "\n\n".join(f"# {name.capitalize()}\n{render()}".rstrip() for name, render in sections.items())
+
+# Shard steps (lock acquisitions) one SCAN call may take before returning a cursor
+SCAN_MAX_STEPS = 16
+
+# Segment records re-checked per shard lock acquisition while merging segments
+MERGE_BATCH_SIZE = 1000
+
+# Snapshot entries applied between two yields to the event loop while loading a full sync
+SNAPSHOT_LOAD_BATCH_SIZE = 10000
+
+# Checkpointed hot keys restored between two yields to the event loop during warmup
+WARMUP_BATCH_SIZE = 256
 
 class LRUCache:
-    def __init__(self, capacity: int = 5):
+    def __init__(self, capacity: int = 5, aof: AOFLogger = None, num_shards: int = 16,
+                 maxmemory: int = 0, maxmemory_policy: str = "noeviction",
+                 hot_cache_policy: str = "lru", ordered_index: bool = False, segments=None,
+                 compression_threshold: int = 0, hot_set=None, expire_keys: bool = True):
         self.capacity = capacity
-        self.db = {}       # The actual database (Stores ALL keys)
-        self.cache = {}    # The "Hot" Cache (Points to nodes in the Linked List)
-        self.expiries = {} # Stores expiration timestamps: {key: timestamp}
-        
-        # Linked List for LRU (The Hot Zone)
-        self.head = Node()
-        self.tail = Node()
-        self.head.next = self.tail
-        self.tail.prev = self.head
-        
-        self.lock = asyncio.Lock()
-        self.aof = AOFLogger(filepath="persistence/appendonly.aof")
+        self.num_shards = num_shards
+        self.maxmemory = maxmemory
+        self.maxmemory_policy = maxmemory_policy
+        self.hot_cache_policy = hot_cache_policy
+        self.ordered_index = ordered_index
+        # Disk tier for cold values (persistence.segment_store.SegmentStore), or None
+        self.segments = segments
+        # Values at least this long are kept zlib-compressed (0 = never)
+        self.compression_threshold = compression_threshold
+        # Where the hot tiers' keys are checkpointed for warm restarts
+        # (persistence.hotset.HotSetCheckpoint), or None
+        self.hot_set = hot_set
+        # Followers turn this off: they drop expired keys only when the
+        # leader's DEL arrives, and hide them from reads until then
+        self.expire_keys = expire_keys
+        self.warmup = {"state": "none", "total": 0, "processed": 0, "restored": 0,
+                       "started": None, "duration": 0.0}
+        # Per-command latency (recorded by server.commands), lock waits and other internals
+        self.metrics = Metrics()
+        lock_wait = self.metrics.histogram("lock_wait")
+
+        # Keys hash to independent shards; the hot cache capacity and the
+        # memory limit are split between them (every shard keeps at least
+        # one hot slot).
+        self.shards = []
+        for i in range(num_shards):
+            shard_capacity = max(1, capacity // num_shards + (1 if i < capacity % num_shards else 0))
+            self.shards.append(Shard(i, shard_capacity, policy=make_policy(maxmemory_policy),
+                                     maxmemory=maxmemory // num_shards,
+                                     hot=make_hot_cache(hot_cache_policy, shard_capacity),
+                                     lock=TimedLock(lock_wait), ordered_index=ordered_index,
+                                     segments=segments, compress_threshold=compression_threshold,
+                                     expire_keys=expire_keys))
+        self.aof = aof or AOFLogger(filepath="persistence/appendonly.aof")
+        self.metrics.histograms.update(aof_write=self.aof.write_latency, aof_fsync=self.aof.fsync_latency,
+                                       aof_rewrite=self.aof.rewrite_duration)
+        # Set by the leader (server.replication.ReplicationLeader): every
+        # record logged to the AOF is also fed to the replication stream
+        self.replication = None
+        # Set by the leader (server.tracking.TrackingTable): keys named in
+        # logged records are invalidated in the clients' near caches
+        self.tracking = None
+        # Set by the server (server.clients.ClientRegistry): the open client
+        # connections, for CLIENT LIST / KILL and INFO's Clients section
+        self.clients = None
+        # Only one copy-on-write snapshot (AOF rewrite or full sync) at a time
+        self.snapshot_lock = asyncio.Lock()
 
         self.stats = {
-            "cache_hits": 0,    
-            "cache_misses": 0,  
-            "total_commands": 0,
-            "start_time": time.time()
+            "start_time": time.time(),
+            "expire_cycles": 0,
+            "expire_cycles_over_budget": 0,
+            "hot_set_checkpoints": 0,
+            "hot_set_checkpoint_keys": 0,
         }
         self._replay_aof()
 
+    def _shard(self, key: str):
+        return self.shards[key_hash(key) % self.num_shards]
+
+    @contextlib.asynccontextmanager
+    async def _lock_shards(self, shards):
+        """Acquires several shard locks in ascending index order so bulk commands can't deadlock."""
+        async with contextlib.AsyncExitStack() as stack:
+            for shard in sorted(set(shards), key=lambda s: s.index):
+                await stack.enter_async_context(shard.lock)
+            yield
+
     def _replay_aof(self):
-        """Rebuilds the full database state and TTLs from disk on startup."""
-        logs = self.aof.read_logs()
-        for line in logs:
-            parts = line.split()
-            if not parts: continue
-            cmd = parts[0].upper()
-            
-            if cmd == "SET" and len(parts) >= 3:
-                key, value = parts[1], parts[2]
-                self.db[key] = value
-                
-                # Rebuild TTL if EX was in the log
-                parts_upper = [p.upper() for p in parts]
-                if "EX" in parts_upper:
-                    try:
-                        ex_idx = parts_upper.index("EX")
-                        ttl = int(parts[ex_idx + 1])
-                        self.expiries[key] = time.time() + ttl
-                    except (ValueError, IndexError):
-                        pass
-                        
-            elif cmd == "DEL" and len(parts) >= 2:
-                self.db.pop(parts[1], None)
-                self.expiries.pop(parts[1], None)
+        """
+        Rebuilds the full database state and TTLs from disk on startup:
+        the snapshot preamble, then the records logged after it.
+        """
+        now = time.time()
+        for record in self.aof.replay():
+            shard = self._shard(record[1])
+            if record[0] == "SET" and (record[3] is None or record[3] > now):
+                shard.put_locked(record[1], record[2], record[3])
+            else:
+                # Deleted, or set with an expiry that passed while the server was down
+                shard.delete_locked(record[1])
+        if self.aof.legacy_format:
+            self.aof.upgrade(self.get_all_valid_data())
 
     def get_all_valid_data(self):
-        """Returns the entire database for compaction."""
-        return self.db
+        """Point-in-time list of every live (key, value, expiry) for compaction and snapshots."""
+        now = time.time()
+        entries = []
+        for shard in self.shards:
+            for key, raw in shard.db.items():
+                value, expiry = unpack(raw, shard.segments)
+                if expiry is None or expiry > now:
+                    entries.append((key, value, expiry))
+        return entries
+
+    def begin_snapshot(self, batch_size: int = 10000):
+        """
+        Starts a consistent point-in-time view of the whole keyspace without
+        copying it: from now on each shard saves a key's previous value on its
+        first modification. Returns an async iterator of entry batches; writes
+        keep flowing while the caller consumes it. Callers hold snapshot_lock.
+        """
+        for shard in self.shards:
+            shard.cow = {}
+        if self.segments is not None:
+            self.segments.pause_deletes()
+        return self._snapshot_batches(batch_size)
+
+    async def _snapshot_batches(self, batch_size):
+        try:
+            for shard in self.shards:
+                keys = shard.snapshot_keys()
+                for i in range(0, len(keys), batch_size):
+                    entries, cold = shard.snapshot_entries(keys[i:i + batch_size], time.time())
+                    if cold:
+                        # Spilled values are read off the event loop, one executor hop per batch
+                        values = await asyncio.get_running_loop().run_in_executor(
+                            None, lambda: [read_view(view) for _, view in cold])
+                        for (j, _), value in zip(cold, values):
+                            key, _, expiry = entries[j]
+                            entries[j] = (key, value, expiry)
+                    yield entries
+                # This shard is fully written; stop tracking its old values
+                shard.cow = None
+        finally:
+            for shard in self.shards:
+                shard.cow = None
+            if self.segments is not None:
+                self.segments.resume_deletes()
 
-    # --- LRU Linked List Helpers ---
-    def _add_node(self, node):
-        node.prev = self.head
-        node.next = self.head.next
-        self.head.next.prev = node
-        self.head.next = node
+    async def load_snapshot_file(self, path):
+        """
+        Replaces the whole dataset with a snapshot file (a full sync received
+        from the leader); the file then becomes this node's AOF. The file is
+        verified first (off the event loop), so a damaged one raises
+        SnapshotError with the dataset untouched. Its entries are then
+        streamed from the mapping SNAPSHOT_LOAD_BATCH_SIZE at a time, each
+        batch under the locks of its shards only, yielding in between.
+        """
+        loop = asyncio.get_running_loop()
+        count = 0
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                await loop.run_in_executor(None, SnapshotReader(mm).verify)
+                async with self.snapshot_lock:
+                    async with self._lock_shards(self.shards):
+                        for shard in self.shards:
+                            shard.reset_locked()
+                    entries = iter(SnapshotReader(mm))
+                    while batch := list(itertools.islice(entries, SNAPSHOT_LOAD_BATCH_SIZE)):
+                        by_shard = {}
+                        for entry in batch:
+                            by_shard.setdefault(self._shard(entry[0]), []).append(entry)
+                        for shard, shard_entries in by_shard.items():
+                            async with shard.lock:
+                                for key, value, expiry in shard_entries:
+                                    shard.put_locked(key, value, expiry)
+                        count += len(batch)
+                        await asyncio.sleep(0)
+                    await self.aof.adopt_file(path)
+        return count
 
-    def _remove_node(self, node):
-        p, n = node.prev, node.next
-        p.next, n.prev = n, p
+    def _log(self, records):
+        """
+        Queues records for the AOF group commit and the replication stream,
+        and invalidates the keys they name for tracking clients. Called with
+        the shard lock(s) held so all of them see writes in apply order.
+        """
+        if self.replication is not None:
+            self.replication.feed(records)
+        if self.tracking is not None:
+            self.tracking.invalidate(records)
+        return self.aof.append_many(records)
 
     # --- Core Logic ---
     async def get(self, key: str):
-        async with self.lock:
-            self.stats["total_commands"] += 1
-            
-            # 1. Check if key exists in DB
-            if key not in self.db:
-                return None
-            
-            # 2. Lazy TTL Check (Crucial for "nil" return on expired keys)
-            if key in self.expiries and time.time() > self.expiries[key]:
-                # Release lock to call delete safely or handle deletion internally
-                # To keep it simple and safe within the same lock:
-                self.db.pop(key, None)
-                self.expiries.pop(key, None)
-                if key in self.cache:
-                    node = self.cache.pop(key)
-                    self._remove_node(node)
-                await self.aof.log_command("DEL", key)
-                return None
-
-            # 3. Cache Hit Logic
-            if key in self.cache:
-                self.stats["cache_hits"] += 1
-                self._remove_node(self.cache[key])
-                self._add_node(self.cache[key])
-                return self.cache[key].value
-            
-            # 4. Cache Miss (Cold Hit - in DB but not Cache)
-            self.stats["cache_misses"] += 1
-            value = self.db[key]
-            
-            # Promote to Hot Cache
-            new_node = Node(key, value)
-            self.cache[key] = new_node
-            self._add_node(new_node)
-            
-            # Evict from Cache only if over capacity
-            if len(self.cache) > self.capacity:
-                lru_node = self.tail.prev
-                self._remove_node(lru_node)
-                del self.cache[lru_node.key]
-            
-            return value
-
-    async def set(self, key: str, value, ttl: int = None):
-        async with self.lock:
-            self.stats["total_commands"] += 1
-            self.db[key] = str(value)
-            
-            if ttl:
-                self.expiries[key] = time.time() + ttl
-            else:
-                self.expiries.pop(key, None)
-
-            # Update Hot Cache if present
-            if key in self.cache:
-                self.cache[key].value = str(value)
-                self._remove_node(self.cache[key])
-                self._add_node(self.cache[key])
-            
-            # Log to AOF with TTL if provided
-            if ttl:
-                await self.aof.log_command("SET", key, value, "EX", ttl)
-            else:
-                await self.aof.log_command("SET", key, value)
-            return True
+        durable = view = None
+        shard = self._shard(key)
+        async with shard.lock:
+            value = shard.get_locked(key, read_through=False)
+            if value is EXPIRED:
+                durable = self._log([("DEL", key)])
+                value = None
+            elif type(value) is SegmentRef:
+                view = self.segments.view(value)
+        # Wait for the lazy-expiry DEL outside the lock so other writers can join the batch
+        if durable:
+            await self.aof.wait_durable(durable)
+        if view is not None:
+            ref = value
+            value = await asyncio.get_running_loop().run_in_executor(None, read_view, view)
+            async with shard.lock:
+                value = shard.admit_locked(key, ref, value)
+        return value
+
+    # --- maxmemory ---
+    @staticmethod
+    def _make_room_locked(shards):
+        """Runs eviction on every shard a write touches; returns (evicted_keys, ok)."""
+        evicted, ok = [], True
+        for shard in shards:
+            shard_evicted, shard_ok = shard.make_room_locked()
+            evicted.extend(shard_evicted)
+            ok = ok and shard_ok
+        return evicted, ok
+
+    async def _finish_write(self, durable, ok):
+        """
+        Runs after the shard locks are released: waits for the AOF batch
+        and refuses the write if there was no room.
+        """
+        if durable:
+            await self.aof.wait_durable(durable)
+        if not ok:
+            raise OutOfMemoryError()
+
+    async def set(self, key: str, value, ttl: int = None, expiry: float = None):
+        """Stores a value with a TTL in seconds, or an absolute expiry (unix time), or neither."""
+        shard = self._shard(key)
+        async with shard.lock:
+            evicted, ok = self._make_room_locked([shard])
+            records = [("DEL", k) for k in evicted]
+            if ok:
+                records.append(shard.set_locked(key, value, ttl, expiry))
+            # Queue for the AOF group commit (and replication) with TTL if provided
+            durable = self._log(records) if records else None
+        await self._finish_write(durable, ok)
+        return True
 
     async def delete(self, key: str):
-        async with self.lock:
-            in_db = key in self.db
-            self.db.pop(key, None)
-            self.expiries.pop(key, None)
-            if key in self.cache:
-                node = self.cache.pop(key)
-                self._remove_node(node)
-            
-            if in_db:
-                await self.aof.log_command("DEL", key)
-                return True
+        shard = self._shard(key)
+        async with shard.lock:
+            if not shard.delete_locked(key):
+                return False
+            durable = self._log([("DEL", key)])
+        await self.aof.wait_durable(durable)
+        return True
+
+    # --- Bulk Operations (one lock pass, one AOF batch) ---
+    async def mget(self, keys):
+        durable = None
+        routed = [(key, self._shard(key)) for key in keys]
+        async with self._lock_shards(shard for _, shard in routed):
+            values, expired, cold = [], [], []
+            for i, (key, shard) in enumerate(routed):
+                value = shard.get_locked(key, read_through=False)
+                if value is EXPIRED:
+                    expired.append(("DEL", key))
+                    value = None
+                elif type(value) is SegmentRef:
+                    cold.append((i, value, self.segments.view(value)))
+                values.append(value)
+            if expired:
+                durable = self._log(expired)
+        if durable:
+            await self.aof.wait_durable(durable)
+        if cold:
+            # Every spilled value is read in one executor hop, then offered to the hot tier
+            read = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: [read_view(view) for _, _, view in cold])
+            async with self._lock_shards(routed[i][1] for i, _, _ in cold):
+                for (i, ref, _), value in zip(cold, read):
+                    key, shard = routed[i]
+                    values[i] = shard.admit_locked(key, ref, value)
+        return values
+
+    async def mset(self, pairs, ttl: int = None):
+        """
+        Sets every (key, value) pair, optionally all with the same TTL (logged
+        as each key's absolute expiry).
+        All or nothing: if any shard involved is out of memory, nothing is set.
+        """
+        routed = [(key, value, self._shard(key)) for key, value in pairs]
+        shards = {shard for _, _, shard in routed}
+        async with self._lock_shards(shards):
+            evicted, ok = self._make_room_locked(shards)
+            records = [("DEL", k) for k in evicted]
+            if ok:
+                records.extend(shard.set_locked(key, value, ttl) for key, value, shard in routed)
+            durable = self._log(records) if records else None
+        await self._finish_write(durable, ok)
+        return True
+
+    async def mdelete(self, keys):
+        """Deletes every key and returns how many existed."""
+        routed = [(key, self._shard(key)) for key in keys]
+        async with self._lock_shards(shard for _, shard in routed):
+            records = [("DEL", key) for key, shard in routed if shard.delete_locked(key)]
+            if not records:
+                return 0
+            durable = self._log(records)
+        await self.aof.wait_durable(durable)
+        return len(records)
+
+    async def increment(self, key: str, delta: int = 1):
+        # Read-modify-write under the shard lock on the int-encoded value
+        shard = self._shard(key)
+        async with self._lock_shards_with_cold([key]) as cold:
+            evicted, ok = self._make_room_locked([shard])
+            records = [("DEL", k) for k in evicted]
+            result = None
+            if ok:
+                try:
+                    records.append(shard.incr_locked(key, delta, cold))
+                    result = records[-1][2]
+                except ValueError:
+                    result = "ERROR: Value is not an integer"
+                except OverflowError:
+                    result = "ERROR: Increment or decrement would overflow"
+            durable = self._log(records) if records else None
+        await self._finish_write(durable, ok)
+        return result
+
+    async def append(self, key: str, suffix: str):
+        """Appends to the value of `key` and returns the new length."""
+        shard = self._shard(key)
+        async with self._lock_shards_with_cold([key]) as cold:
+            evicted, ok = self._make_room_locked([shard])
+            records = [("DEL", k) for k in evicted]
+            length = None
+            if ok:
+                record, length = shard.append_locked(key, suffix, cold)
+                records.append(record)
+            durable = self._log(records) if records else None
+        await self._finish_write(durable, ok)
+        return length
+
+    # --- Transactions ---
+    @contextlib.asynccontextmanager
+    async def transaction(self, keys):
+        """
+        Locks the shards of `keys` and yields a Transaction that runs commands
+        with those locks held. Its writes are logged as one MULTI ... EXEC
+        unit in the AOF and the replication stream when the block exits, and
+        the caller resumes once that unit is durable.
+        """
+        tx = Transaction(self)
+        async with self._lock_shards_with_cold(keys) as tx.cold:
+            try:
+                yield tx
+            finally:
+                records = tx.records
+                if len(records) > 1:
+                    records = [("MULTI",)] + records + [("EXEC",)]
+                durable = self._log(records) if records else None
+        if durable:
+            await self.aof.wait_durable(durable)
+
+    @contextlib.asynccontextmanager
+    async def _lock_shards_with_cold(self, keys):
+        """
+        Locks the shards of `keys` like _lock_shards and yields {SegmentRef:
+        value} holding the spilled values of those keys, read beforehand in
+        one executor hop with the locks released. If a key was spilled again
+        in the meantime, its new value is read the same way and the locks
+        are retaken.
+        """
+        routed = [(key, self._shard(key)) for key in keys]
+        cold = {}
+        while True:
+            async with self._lock_shards(shard for _, shard in routed):
+                views = {}
+                if self.segments is not None:
+                    for key, shard in routed:
+                        ref = shard.spilled_locked(key)
+                        if ref is not None and ref not in cold:
+                            views[ref] = self.segments.view(ref)
+                if not views:
+                    yield cold
+                    return
+            values = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: [read_view(view) for view in views.values()])
+            cold.update(zip(views, values))
+
+    def watch(self, watch: Watch, keys):
+        """Marks `watch` dirty as soon as any of `keys` is modified (WATCH)."""
+        for key in keys:
+            self._shard(key).watch(key, watch)
+            watch.keys.append(key)
+
+    def unwatch(self, watch: Watch):
+        for key in watch.keys:
+            self._shard(key).unwatch(key, watch)
+        watch.keys.clear()
+
+    async def memory_usage(self, key: str):
+        """Estimated bytes held for `key` (None if it doesn't exist)."""
+        shard = self._shard(key)
+        async with shard.lock:
+            return shard.memory_usage_locked(key)
+
+    # --- Enumeration ---
+    def _parse_cursor(self, cursor: str):
+        """(shard index, position in that shard) of a SCAN cursor; raises ValueError if malformed."""
+        if ":" in cursor:
+            # "<shard>:<last key>" (ordered index)
+            shard, _, key = cursor.partition(":")
+            shard = int(shard)
+            if not self.ordered_index:
+                raise ValueError(cursor)
+            position = key
+        else:
+            # shard + num_shards * hash-bucket position (a bare shard number starts that shard)
+            value = int(cursor)
+            if value < 0:
+                raise ValueError(cursor)
+            shard, position = value % self.num_shards, value // self.num_shards or None
+            if position is not None and self.ordered_index:
+                raise ValueError(cursor)
+        if not 0 <= shard < self.num_shards:
+            raise ValueError(cursor)
+        return shard, position
+
+    def _format_cursor(self, shard: int, position):
+        if position is None:
+            return str(shard)
+        if isinstance(position, str):
+            return f"{shard}:{position}"
+        return str(shard + self.num_shards * position)
+
+    async def scan(self, cursor: str = "0", pattern: str = None, count: int = 10):
+        """
+        One SCAN call: up to about `count` keys matching the glob `pattern`,
+        and the cursor to continue from ("0" starts and ends a scan). Holds
+        one shard lock at a time and never more than SCAN_MAX_STEPS times.
+        Raises ValueError for a malformed cursor.
+        """
+        shard_index, position = self._parse_cursor(cursor)
+        match, prefix = compile_pattern(pattern) if pattern else (None, "")
+        now = time.time()
+        keys = []
+        for _ in range(SCAN_MAX_STEPS):
+            shard = self.shards[shard_index]
+            async with shard.lock:
+                position, found = shard.scan_locked(position, max(count - len(keys), 1), match, prefix, now)
+            keys.extend(found)
+            if position is None:
+                shard_index += 1
+                if shard_index == self.num_shards:
+                    return "0", keys
+            if len(keys) >= count:
+                break
+        return self._format_cursor(shard_index, position), keys
+
+    async def key_range(self, start=None, start_inclusive=True, end=None, end_inclusive=False, limit=None):
+        """
+        Keys between `start` and `end` (None = unbounded) in lexicographic
+        order, at most `limit` of them. Needs the ordered index; each shard
+        is read under its own lock.
+        """
+        if not self.ordered_index:
+            raise ValueError("Ordered index is disabled (start the server with --ordered-index)")
+        now = time.time()
+        per_shard = []
+        for shard in self.shards:
+            async with shard.lock:
+                per_shard.append(shard.range_locked(start, start_inclusive, end, end_inclusive, limit, now))
+        return list(itertools.islice(heapq.merge(*per_shard), limit))
+
+    async def merge_segments(self, interval=1):
+        """
+        Background task for the disk tier: every `interval` seconds, sealed
+        segments that are mostly garbage have their live values copied into
+        the active segment and are deleted. Records are re-checked under the
+        owning shard's lock, MERGE_BATCH_SIZE at a time, so writes keep
+        flowing; merges and snapshots exclude each other (snapshot_lock).
+        """
+        segments = self.segments
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            if not segments.merge_candidates():
+                continue
+            async with self.snapshot_lock:
+                for segment in segments.merge_candidates():
+                    records = segments.records(segment)
+                    while True:
+                        # Records, values included, are read in the executor with no lock held
+                        batch = await loop.run_in_executor(
+                            None, lambda: list(itertools.islice(records, MERGE_BATCH_SIZE)))
+                        if not batch:
+                            break
+                        by_shard = {}
+                        for record in batch:
+                            by_shard.setdefault(self._shard(record[0]), []).append(record)
+                        for shard, records_of_shard in by_shard.items():
+                            async with shard.lock:
+                                for key, offset, data in records_of_shard:
+                                    shard.relocate_locked(key, segment.id, offset, data)
+                        await asyncio.sleep(0)
+                    segments.retire(segment)
+                    print(f"[Segments] Merged segment {segment.id} ({segment.size} bytes)")
+
+    async def checkpoint_hot_set(self):
+        """
+        Saves every shard's hot keys, in priority order, to the hot-set
+        checkpoint and returns how many were saved. Skipped (None) while a
+        warmup is running: the tiers are still partly cold and the previous
+        checkpoint is the better one.
+        """
+        if self.hot_set is None or self.warmup["state"] == "running":
+            return None
+        entries = []
+        for shard in self.shards:
+            async with shard.lock:
+                entries.extend(shard.hot_set_locked())
+        await asyncio.get_running_loop().run_in_executor(None, self.hot_set.save, entries)
+        self.stats["hot_set_checkpoints"] += 1
+        self.stats["hot_set_checkpoint_keys"] = len(entries)
+        return len(entries)
+
+    async def checkpoint_hot_set_periodically(self, interval=60):
+        """Background task: checkpoints the hot set every `interval` seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.checkpoint_hot_set()
+            except OSError as e:
+                print(f"[Store] Hot-set checkpoint failed: {e}")
+
+    async def warm_up(self):
+        """
+        Background task run once at startup: puts the keys of the hot-set
+        checkpoint that still exist back into the hot tiers, most valuable
+        first, WARMUP_BATCH_SIZE at a time so clients are served meanwhile.
+        Spilled values are read off the event loop as for GET. Progress is
+        reported by INFO (warmup_*).
+        """
+        loop = asyncio.get_running_loop()
+        warmup = self.warmup
+        entries = await loop.run_in_executor(None, self.hot_set.load)
+        # A warmup cancelled by shutdown stays "running", so no checkpoint replaces the old one
+        warmup.update(state="running", total=len(entries), started=time.time())
+        for start in range(0, len(entries), WARMUP_BATCH_SIZE):
+            by_shard = {}
+            for entry in entries[start:start + WARMUP_BATCH_SIZE]:
+                by_shard.setdefault(self._shard(entry[1]), []).append(entry)
+            for shard, batch in by_shard.items():
+                async with shard.lock:
+                    restored, spilled = shard.warm_locked(batch)
+                    views = [(entry, ref, self.segments.view(ref)) for entry, ref in spilled]
+                warmup["restored"] += restored
+                for entry, ref, view in views:
+                    value = await loop.run_in_executor(None, read_view, view)
+                    async with shard.lock:
+                        warmup["restored"] += shard.warm_spilled_locked(entry, ref, value)
+            warmup["processed"] = min(start + WARMUP_BATCH_SIZE, len(entries))
+            await asyncio.sleep(0)
+        warmup["state"] = "done"
+        warmup["duration"] = time.time() - warmup["started"]
+        if entries:
+            print(f"[Store] Hot tier warmed up with {warmup['restored']} of {len(entries)} "
+                  f"checkpointed keys in {warmup['duration']:.2f}s")
+
+    async def cleanup_expired_keys(self, hz=10, time_budget=0.25, slice_size=200):
+        """
+        Background task for active expiry. `hz` times a second it pops due
+        keys off each shard's expiry heap, `slice_size` at a time per shard,
+        yielding to the event loop between slices. A cycle stops after
+        `time_budget` of its interval; if keys are still due it starts the
+        next cycle right away instead of sleeping, so a backlog of expired
+        keys is drained quickly without ever stalling clients.
+        """
+        interval = 1 / hz
+        backlog = False
+        cycle_duration = self.metrics.histogram("expire_cycle")
+        while True:
+            await asyncio.sleep(0 if backlog else interval)
+            self.stats["expire_cycles"] += 1
+            started = time.perf_counter()
+            deadline = started + interval * time_budget
+            pending, expired = set(), 0
+
+            backlog = True
+            while backlog and time.perf_counter() < deadline:
+                backlog = False
+                for shard in self.shards:
+                    async with shard.lock:
+                        keys, more_due = shard.pop_expired_locked(time.time(), slice_size)
+                        if keys:
+                            # DELs are queued while the shard lock is held so they stay
+                            # ordered with later writes; they all join one group commit
+                            pending.add(self._log([("DEL", key) for key in keys]))
+                    expired += len(keys)
+                    backlog = backlog or more_due
+                    if keys:
+                        await asyncio.sleep(0)
+
+            cycle_duration.observe(time.perf_counter() - started)
+            if backlog:
+                self.stats["expire_cycles_over_budget"] += 1
+            if expired:
+                print(f"[TTL] Expired and removed {expired} keys from file")
+            if pending:
+                await asyncio.gather(*pending)
+
+    def totals(self):
+        """Key, hit, expiry, eviction and memory counters summed over the shards."""
+        totals = {"keys_in_db": 0, "keys_in_hot_cache": 0, "cache_hits": 0, "cache_misses": 0,
+                  "keys_with_ttl": 0, "expired_keys": 0, "evicted_keys": 0, "used_memory": 0}
+        compression = ("compressed_values", "compress_input_bytes", "compress_output_bytes", "compress_time",
+                       "decompressions", "decompress_time")
+        totals.update(dict.fromkeys(compression, 0))
+        for shard in self.shards:
+            totals["keys_in_db"] += len(shard.db)
+            totals["keys_in_hot_cache"] += len(shard.hot)
+            totals["cache_hits"] += shard.stats["cache_hits"]
+            totals["cache_misses"] += shard.stats["cache_misses"]
+            totals["keys_with_ttl"] += shard.volatile_keys
+            totals["expired_keys"] += shard.stats["expired_keys"]
+            totals["evicted_keys"] += shard.stats["evicted_keys"]
+            totals["used_memory"] += shard.used_memory()
+            for name in compression:
+                totals[name] += shard.stats[name]
+        return totals
+
+    def get_info(self, section: str = None):
+        """
+        INFO text: "# Name" section headers, each followed by "field: value"
+        lines. `section` selects one section by name; None or "all" returns all.
+        """
+        totals = self.totals()
+        lookups = totals["cache_hits"] + totals["cache_misses"]
+        hit_ratio = totals["cache_hits"] / lookups if lookups else 0.0
+        compressed = totals["compress_output_bytes"]
+        compression_ratio = totals["compress_input_bytes"] / compressed if compressed else 1.0
+        warmup = self.warmup
+        warmup_progress = 100.0 * warmup["processed"] / warmup["total"] if warmup["total"] else 100.0
+        warmup_seconds = (warmup["duration"] if warmup["state"] != "running"
+                          else time.time() - warmup["started"])
+        metrics = self.metrics
+        sections = {
+            "server": lambda: (
+                f"uptime_in_seconds: {int(time.time() - self.stats['start_time'])}\n"
+                f"shards: {self.num_shards}\n"
+                f"hot_cache_policy: {self.hot_cache_policy}\n"
+                f"ordered_index: {int(self.ordered_index)}\n"
+                f"tiered_storage: {int(self.segments is not None)}"
+            ),
+            "keyspace": lambda: (
+                f"keys_in_db: {totals['keys_in_db']}\n"
+                f"keys_in_hot_cache: {totals['keys_in_hot_cache']}\n"
+                f"keys_with_ttl: {totals['keys_with_ttl']}"
+            ),
+            "stats": lambda: (
+                f"total_commands_processed: {metrics.total_commands()}\n"
+                f"hits: {totals['cache_hits']}\n"
+                f"misses: {totals['cache_misses']}\n"
+                f"hot_cache_hit_ratio: {hit_ratio:.4f}\n"
+                f"expired_keys: {totals['expired_keys']}\n"
+                f"expire_cycles: {self.stats['expire_cycles']}\n"
+                f"expire_cycles_over_budget: {self.stats['expire_cycles_over_budget']}\n"
+                f"evicted_keys: {totals['evicted_keys']}\n"
+                f"slowlog_len: {len(metrics.slowlog.entries)}"
+            ),
+            "memory": lambda: (
+                f"used_memory: {totals['used_memory']}\n"
+                f"maxmemory: {self.maxmemory}\n"
+                f"maxmemory_policy: {self.maxmemory_policy}\n"
+                f"compression_threshold: {self.compression_threshold}\n"
+                f"compressed_values: {totals['compressed_values']}\n"
+                f"compress_input_bytes: {totals['compress_input_bytes']}\n"
+                f"compress_output_bytes: {totals['compress_output_bytes']}\n"
+                f"compression_ratio: {compression_ratio:.2f}\n"
+                f"compress_cpu_usec: {int(totals['compress_time'] * 1e6)}\n"
+                f"decompressions: {totals['decompressions']}\n"
+                f"decompress_cpu_usec: {int(totals['decompress_time'] * 1e6)}"
+                + "".join(f"\n{name}: {value}" for name, value in
+                          (self.segments.totals().items() if self.segments is not None else ()))
+            ),
+            "persistence": lambda: (
+                f"aof_current_size: {self.aof.current_size}\n"
+                f"aof_base_size: {self.aof.base_size}\n"
+                f"aof_rewrites: {self.aof.stats['rewrites']}\n"
+                f"aof_rewrite_in_progress: {int(self.aof.rewrite_in_progress)}\n"
+                f"aof_fsyncs: {self.aof.stats['fsyncs']}\n"
+                f"hot_set_checkpoints: {self.stats['hot_set_checkpoints']}\n"
+                f"hot_set_checkpoint_keys: {self.stats['hot_set_checkpoint_keys']}\n"
+                f"warmup_in_progress: {int(warmup['state'] == 'running')}\n"
+                f"warmup_keys_total: {warmup['total']}\n"
+                f"warmup_keys_processed: {warmup['processed']}\n"
+                f"warmup_keys_restored: {warmup['restored']}\n"
+                f"warmup_progress: {warmup_progress:.1f}\n"
+                f"warmup_seconds: {warmup_seconds:.3f}"
+            ),
+            "commandstats": lambda: "\n".join(
+                f"cmdstat_{name.lower()}: calls={h.count},usec={int(h.total * 1e6)},"
+                f"usec_per_call={h.total * 1e6 / h.count:.2f},failed_calls={metrics.failed[name]}"
+                for name, h in sorted(metrics.commands.items())),
+            "latencystats": lambda: "\n".join(
+                [f"latency_percentiles_usec_{name.lower()}: {h.describe()}"
+                 for name, h in sorted(metrics.commands.items())]
+                + [f"{name}_usec: {h.describe()}" for name, h in sorted(metrics.histograms.items())]),
+        }
+        if self.replication is not None:
+            sections["replication"] = self.replication.get_info
+        if self.clients is not None:
+            sections["clients"] = self.clients.get_info
+        if self.tracking is not None:
+            sections["tracking"] = self.tracking.get_info
+        return format_info(sections, section)
+
+class Transaction:
+    """
+    The store as seen from inside LRUCache.transaction(): the same async
+    methods as LRUCache, but they run with the shard locks already held and
+    never suspend, so a batch of commands executes as one critical section.
+    Records are collected instead of logged; keys must belong to the shards
+    the transaction locked.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.records = []
+        # Spilled values of the transaction's keys, read before its locks were taken
+        self.cold = {}
+
+    def _make_room(self, shards):
+        evicted, ok = self.store._make_room_locked(shards)
+        self.records.extend(("DEL", k) for k in evicted)
+        if not ok:
+            raise OutOfMemoryError()
+
+    async def get(self, key: str):
+        shard = self.store._shard(key)
+        value = shard.get_locked(key, read_through=False)
+        if value is EXPIRED:
+            self.records.append(("DEL", key))
+            return None
+        if type(value) is SegmentRef:
+            value = shard.admit_locked(key, value, shard.cold_read_locked(value, self.cold))
+        return value
+
+    async def mget(self, keys):
+        return [await self.get(key) for key in keys]
+
+    async def set(self, key: str, value, ttl: int = None, expiry: float = None):
+        shard = self.store._shard(key)
+        self._make_room([shard])
+        self.records.append(shard.set_locked(key, value, ttl, expiry))
+        return True
+
+    async def mset(self, pairs, ttl: int = None):
+        routed = [(key, value, self.store._shard(key)) for key, value in pairs]
+        self._make_room({shard for _, _, shard in routed})
+        self.records.extend(shard.set_locked(key, value, ttl) for key, value, shard in routed)
+        return True
+
+    async def delete(self, key: str):
+        if not self.store._shard(key).delete_locked(key):
             return False
+        self.records.append(("DEL", key))
+        return True
+
+    async def mdelete(self, keys):
+        return sum([await self.delete(key) for key in keys])
 
-    async def increment(self, key: str):
-        # We call get() which already handles Lazy TTL
-        val = await self.get(key)
+    async def increment(self, key: str, delta: int = 1):
+        shard = self.store._shard(key)
+        self._make_room([shard])
         try:
-            new_val = int(val or 0) + 1
-            await self.set(key, new_val)
-            return new_val
+            record = shard.incr_locked(key, delta, self.cold)
         except ValueError:
             return "ERROR: Value is not an integer"
+        except OverflowError:
+            return "ERROR: Increment or decrement would overflow"
+        self.records.append(record)
+        return record[2]
 
-    async def cleanup_expired_keys(self):
-        """Background task to sweep the database for expired TTLs."""
-        while True:
-            await asyncio.sleep(5)
-            async with self.lock:
-                now = time.time()
-                keys_to_del = [k for k, exp in self.expiries.items() if now > exp]
-                
-                for key in keys_to_del:
-                    self.db.pop(key, None)
-                    self.expiries.pop(key, None)
-                    if key in self.cache:
-                        node = self.cache.pop(key)
-                        self._remove_node(node)
-                    await self.aof.log_command("DEL", key)
-                    print(f"[TTL] Expired and removed from file: {key}")
-
-    def get_info(self):
-        return (
-            f"keys_in_db: {len(self.db)}\n"
-            f"keys_in_hot_cache: {len(self.cache)}\n"
-            f"hits: {self.stats['cache_hits']}\n"
-            f"misses: {self.stats['cache_misses']}"
-        )
\ No newline at end of file
+    async def append(self, key: str, suffix: str):
+        shard = self.store._shard(key)
+        self._make_room([shard])
+        record, length = shard.append_locked(key, suffix, self.cold)
+        self.records.append(record)
+        return length
+
+    async def memory_usage(self, key: str):
+        return self.store._shard(key).memory_usage_locked(key)
+
+    def get_info(self, section: str = None):
+        return self.store.get_info(section)
@@ -0,0 +1,136 @@
+import struct
+import time
+import zlib
+
+from persistence.manager import _encode, _decode
+
+# Binary AOF log layout (all integers little-endian), after the optional snapshot preamble:
+#   record : type u8 | payload_len u32 | crc32 u32 (of type, payload_len and payload) | payload
+#   HEADER : LOG_MAGIC (7) | version u16       first record of every log section
+#   SET    : expiry_ms i64 (0 = none) | key_len u32 | key | value
+#   SETZ   : as SET, with the value zlib-compressed
+#   DEL    : key
+#   MULTI, EXEC : empty; the records between them were written as one transaction
+LOG_MAGIC = b"PYKVAOF"
+LOG_VERSION = 1
+RECORD = struct.Struct("<BII")
+LOG_HEADER = struct.Struct("<7sH")
+SET_PREFIX = struct.Struct("<qI")
+TYPE_HEADER = 0x01
+TYPE_SET = 0x10
+TYPE_DEL = 0x11
+TYPE_MULTI = 0x12
+TYPE_EXEC = 0x13
+TYPE_SET_COMPRESSED = 0x14
+TYPE_NAMES = {TYPE_DEL: "DEL", TYPE_MULTI: "MULTI", TYPE_EXEC: "EXEC"}
+
+class AOFCorruptionError(Exception):
+    """A record before the end of the log failed its checksum or could not be decoded."""
+
+def _frame(kind, payload):
+    prefix = struct.pack("<BI", kind, len(payload))
+    crc = zlib.crc32(payload, zlib.crc32(prefix))
+    return prefix + struct.pack("<I", crc) + payload
+
+def encode_header():
+    return _frame(TYPE_HEADER, LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION))
+
+def encode_record(args):
+    """
+    One store record (a SET, SETZ, DEL, MULTI or EXEC tuple as produced by
+    the shards) as a binary log record. The shards give expiries as
+    `PXAT <unix ms>`, stored as they are; a relative `EX seconds` is turned
+    into an absolute expiry, so replay doesn't restart the TTL. SETZ values
+    are zlib bytes and are written as they are.
+    """
+    name = str(args[0]).upper()
+    if name in ("SET", "SETZ"):
+        key = _encode(str(args[1]))
+        value = args[2] if name == "SETZ" else _encode(str(args[2]))
+        expiry_ms = 0
+        if len(args) >= 5:
+            option = str(args[3]).upper()
+            if option == "PXAT":
+                expiry_ms = int(args[4])
+            elif option == "EX":
+                expiry_ms = int((time.time() + int(args[4])) * 1000)
+        kind = TYPE_SET_COMPRESSED if name == "SETZ" else TYPE_SET
+        return _frame(kind, SET_PREFIX.pack(expiry_ms, len(key)) + key + value)
+    if name == "DEL":
+        return _frame(TYPE_DEL, _encode(str(args[1])))
+    if name == "MULTI":
+        return _frame(TYPE_MULTI, b"")
+    if name == "EXEC":
+        return _frame(TYPE_EXEC, b"")
+    raise ValueError(f"{name} can't be written to the AOF")
+
+def is_log_header(buf, offset=0):
+    """True if a binary log section (a valid HEADER record) starts at `offset`."""
+    end = offset + RECORD.size + LOG_HEADER.size
+    if len(buf) < end or buf[offset] != TYPE_HEADER:
+        return False
+    return bytes(buf[offset + RECORD.size:offset + RECORD.size + len(LOG_MAGIC)]) == LOG_MAGIC
+
+class LogReader:
+    """
+    Streams the records of a binary log section held in any buffer (an mmap
+    for files) starting at `offset`, one at a time, so replaying a log of
+    any size takes constant memory. Yields ("SET", key, value, expiry or
+    None), ("DEL", key), ("MULTI",) and ("EXEC",); the value of a SETZ
+    record is yielded as its zlib bytes.
+
+    Replay stops at a torn tail: an incomplete last record, or a last record
+    whose checksum fails (a partially written page). Once iteration
+    finishes, `end` is the offset just past the last good record and
+    `torn` tells whether anything after it was ignored. A bad checksum
+    anywhere else raises AOFCorruptionError. `record_start` is the offset
+    of the record just yielded.
+    """
+
+    def __init__(self, buf, offset=0):
+        self.buf = buf
+        self.offset = offset
+        self.end = offset
+        self.torn = False
+        self.record_start = offset
+        self.count = 0
+
+    def __iter__(self):
+        buf, pos, size = self.buf, self.offset, len(self.buf)
+        while pos < size:
+            if pos + RECORD.size > size:
+                self.torn = True
+                break
+            kind, length, crc = RECORD.unpack_from(buf, pos)
+            body = pos + RECORD.size
+            if body + length > size:
+                self.torn = True
+                break
+            payload = buf[body:body + length]
+            if zlib.crc32(payload, zlib.crc32(buf[pos:pos + 5])) != crc:
+                if body + length == size:
+                    self.torn = True
+                    break
+                raise AOFCorruptionError(f"checksum mismatch in the record at offset {pos}")
+
+            self.record_start, pos = pos, body + length
+            if kind in (TYPE_SET, TYPE_SET_COMPRESSED):
+                expiry_ms, key_len = SET_PREFIX.unpack_from(payload)
+                key_end = SET_PREFIX.size + key_len
+                value = payload[key_end:]
+                record = ("SET", _decode(payload[SET_PREFIX.size:key_end]),
+                          value if kind == TYPE_SET_COMPRESSED else _decode(value),
+                          expiry_ms / 1000 if expiry_ms else None)
+            elif kind in TYPE_NAMES:
+                record = (TYPE_NAMES[kind], _decode(payload)) if kind == TYPE_DEL else (TYPE_NAMES[kind],)
+            elif kind == TYPE_HEADER:
+                _, version = LOG_HEADER.unpack_from(payload)
+                if version > LOG_VERSION:
+                    raise AOFCorruptionError(f"unsupported AOF log version {version}")
+                self.end = pos
+                continue
+            else:
+                raise AOFCorruptionError(f"unknown record type {kind} at offset {self.record_start}")
+            self.end = pos
+            self.count += 1
+            yield record
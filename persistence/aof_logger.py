@@ -1,75 +1,457 @@
 import os
-import aiofiles
+import asyncio
+import contextlib
+import contextvars
+import mmap
 import time
+from core.metrics import LatencyHistogram
+from persistence.manager import SnapshotWriter, is_snapshot, SnapshotReader, write_snapshot, _decode
+from persistence.aof_format import LogReader, encode_header, encode_record, is_log_header
+
+# Redis-style durability policies for the append-only file
+FSYNC_POLICIES = ("always", "everysec", "no")
+
+# Buffered writes are copied into the rewritten file in chunks of this size
+# outside the I/O lock; only the final remainder is copied while holding it.
+REWRITE_FLUSH_THRESHOLD = 1024 * 1024
+
+# Futures collected by deferred_durability() for the current task
+_deferred_commits = contextvars.ContextVar("aof_deferred_commits", default=None)
 
 class AOFLogger:
-    def __init__(self, filepath="persistence/appendonly.aof"):
+    def __init__(self, filepath="persistence/appendonly.aof", fsync_policy="everysec",
+                 max_batch_size=512, max_batch_delay=0.0,
+                 rewrite_percentage=100, rewrite_min_size=64 * 1024 * 1024):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"fsync_policy must be one of {FSYNC_POLICIES}")
         self.filepath = filepath
+        self.fsync_policy = fsync_policy
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        # Automatic rewrite once the file has grown by this percentage since
+        # the last rewrite and is at least rewrite_min_size bytes (0 disables).
+        self.rewrite_percentage = rewrite_percentage
+        self.rewrite_min_size = rewrite_min_size
+
+        # Group commit state: each batch is [lines, future, captured] and every
+        # command appended to a batch shares that batch's durability future.
+        # `captured` batches were queued during a rewrite and are also copied
+        # into the rewrite buffer once written.
+        self._batches = []
+        self._wakeup = None
+        self._writer_task = None
+        self._io_lock = None
+        self._file = None
+        self._dirty = False
+        self._closing = False
+        self._last_fsync = time.time()
+
+        # Background rewrite state
+        self._rewrite_buffer = None
+        self.rewrite_in_progress = False
+        # The task started by start_compaction() (BGREWRITEAOF) until it finishes
+        self.rewrite_task = None
+        # Set by replay(): the file holds text commands written by an older version
+        self.legacy_format = False
+
+        self.stats = {"batches_written": 0, "commands_written": 0, "fsyncs": 0, "rewrites": 0}
+        # Time spent in write + flush and in fsync per batch, and per completed rewrite
+        self.write_latency = LatencyHistogram()
+        self.fsync_latency = LatencyHistogram()
+        self.rewrite_duration = LatencyHistogram()
         # Ensure the persistence directory exists
         os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+        self.current_size = os.path.getsize(self.filepath) if os.path.exists(self.filepath) else 0
+        self.base_size = self.current_size
+        # The file has no log section yet: the writer starts one before its first record
+        self._needs_header = self.current_size == 0
+
+    def append(self, *args):
+        """
+        Queues one command for the next group commit and returns the future
+        that resolves once its batch has been written (and fsynced under the
+        'always' policy). Cheap enough to call while holding the store lock;
+        await the returned future after releasing it.
+        """
+        return self.append_many((args,))
+
+    def append_many(self, records):
+        """
+        Queues several commands as one unit: they always land in the same
+        batch (and therefore the same write), sharing one durability future.
+        """
+        self._ensure_writer()
+        lines = [encode_record(args) for args in records]
+
+        capture = self._rewrite_buffer is not None
+        if (not self._batches or self._batches[-1][2] != capture
+                or len(self._batches[-1][0]) + len(lines) > self.max_batch_size):
+            future = asyncio.get_running_loop().create_future()
+            self._batches.append([[], future, capture])
+        batch_lines, future, _ = self._batches[-1]
+        batch_lines.extend(lines)
+        self._wakeup.set()
+        return future
 
     async def log_command(self, *args):
         """
-        Accepts multiple arguments, joins them into a string, 
-        and appends to the log file asynchronously.
+        Logs one command (its arguments, e.g. "SET", key, value) as a binary
+        CRC'd record (see persistence.aof_format) and waits until the batch
+        it was committed with is durable.
         """
-        command_str = " ".join(map(str, args))
-        
-        async with aiofiles.open(self.filepath, mode='a') as f:
-            await f.write(f"{command_str}\n")
-            # Ensure the data is physically pushed to the disk
-            await f.flush()
+        await self.append(*args)
+
+    async def wait_durable(self, future):
+        """
+        Waits for a batch future returned by append(). Inside a
+        deferred_durability() block the wait is postponed to the end of the
+        block, so a pipeline of writes shares one group commit.
+        """
+        deferred = _deferred_commits.get()
+        if deferred is None:
+            await future
+        else:
+            deferred.add(future)
+
+    @contextlib.asynccontextmanager
+    async def deferred_durability(self):
+        pending = set()
+        token = _deferred_commits.set(pending)
+        try:
+            yield
+        finally:
+            _deferred_commits.reset(token)
+            if pending:
+                await asyncio.gather(*pending)
+
+    def _ensure_writer(self):
+        if self._writer_task is None or self._writer_task.done():
+            self._wakeup = asyncio.Event()
+            self._io_lock = asyncio.Lock()
+            self._writer_task = asyncio.get_running_loop().create_task(self._writer_loop())
+
+    async def _writer_loop(self):
+        """Long-lived task that drains queued batches into the open file handle."""
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._batches:
+                if self._closing:
+                    break
+                try:
+                    # Under 'everysec' wake up at least once a second to fsync
+                    timeout = 1.0 if (self.fsync_policy == "everysec" and self._dirty) else None
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+            if self._batches and self.max_batch_delay and len(self._batches[0][0]) < self.max_batch_size:
+                # Give concurrent writers a moment to join this batch
+                await asyncio.sleep(self.max_batch_delay)
+
+            self._wakeup.clear()
+            batch = self._batches.pop(0) if self._batches else None
+            do_fsync = self.fsync_policy == "always" or (
+                self.fsync_policy == "everysec" and time.time() - self._last_fsync >= 1.0
+            )
+
+            try:
+                async with self._io_lock:
+                    data = b"".join(batch[0]) if batch else b""
+                    await loop.run_in_executor(None, self._write_batch, data, do_fsync)
+                    if batch and batch[2] and self._rewrite_buffer is not None:
+                        self._rewrite_buffer.append(data)
+            except Exception as e:
+                print(f"[AOF] Write failed: {e}")
+                if batch and not batch[1].done():
+                    batch[1].set_exception(e)
+                continue
+
+            if batch:
+                self.stats["batches_written"] += 1
+                self.stats["commands_written"] += len(batch[0])
+                if not batch[1].done():
+                    batch[1].set_result(None)
+
+    def _write_batch(self, data, do_fsync):
+        """Runs in the executor: one write + flush (+ optional fsync) per batch."""
+        if self._file is None:
+            self._file = open(self.filepath, "ab")
+            if self._needs_header:
+                self._file.write(encode_header())
+                self._needs_header = False
+        if data:
+            start = time.perf_counter()
+            self._file.write(data)
+            self._file.flush()
+            self.write_latency.observe(time.perf_counter() - start)
+            self._dirty = True
+            self.current_size = os.fstat(self._file.fileno()).st_size
+        if do_fsync and self._dirty:
+            start = time.perf_counter()
+            os.fsync(self._file.fileno())
+            self.fsync_latency.observe(time.perf_counter() - start)
+            self._dirty = False
+            self._last_fsync = time.time()
+            self.stats["fsyncs"] += 1
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+            self._dirty = False
+
+    async def close(self):
+        """Flushes every queued batch, fsyncs and stops the writer task."""
+        if self._writer_task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        await asyncio.gather(self._writer_task, return_exceptions=True)
+        self._writer_task = None
+        self._closing = False
+        await asyncio.get_running_loop().run_in_executor(None, self._close_file)
+
+    async def adopt_file(self, path):
+        """
+        Atomically makes `path` the AOF (a follower installing a full sync).
+        The caller must stop new appends first; queued batches are flushed
+        to the old file before the swap.
+        """
+        loop = asyncio.get_running_loop()
+        self._ensure_writer()
+        pending = [batch[1] for batch in self._batches]
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        async with self._io_lock:
+            os.replace(path, self.filepath)
+            await loop.run_in_executor(None, self._close_file)
+            self.current_size = self.base_size = os.path.getsize(self.filepath)
+            self._needs_header = True
+
+    def should_rewrite(self):
+        """True once the file has outgrown the automatic rewrite thresholds."""
+        if self.rewrite_in_progress or not self.rewrite_percentage:
+            return False
+        if self.current_size < self.rewrite_min_size:
+            return False
+        base = self.base_size or 1
+        return (self.current_size - base) * 100 / base >= self.rewrite_percentage
+
+    def start_compaction(self, data_store):
+        """Runs trigger_compaction() as a background task; a failure is logged when it finishes."""
+        task = self.rewrite_task = asyncio.create_task(self.trigger_compaction(data_store))
+        task.add_done_callback(self._compaction_done)
+        return task
+
+    def _compaction_done(self, task):
+        if self.rewrite_task is task:
+            self.rewrite_task = None
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[AOF] Background rewrite failed: {task.exception()!r}")
 
     async def trigger_compaction(self, data_store):
         """
-        Rewrites the AOF file using the current valid database state.
-        Only saves keys that haven't expired and preserves remaining TTL.
+        Rewrites the AOF in the background as a binary snapshot preamble of the
+        database (expired keys skipped, absolute expiries preserved).
+
+        The snapshot is a copy-on-write view taken at one instant, so clients
+        keep writing while it is encoded batch by batch in the executor.
+        Commands logged from that instant on still go to the old file and are
+        also buffered; the buffer is appended to the new file right before the
+        atomic swap, so no write is lost.
         """
+        if self.rewrite_in_progress:
+            print("[AOF] Compaction skipped: a rewrite is already in progress.")
+            return False
+
+        self.rewrite_in_progress = True
+        try:
+            # Waits for a full sync to a follower, which uses the same snapshot view
+            async with data_store.snapshot_lock:
+                return await self._rewrite(data_store)
+        finally:
+            self.rewrite_in_progress = False
+
+    async def _rewrite(self, data_store):
         temp_filepath = f"{self.filepath}.tmp"
-        
-        # Access the full database and the expiries dictionary from store.py
-        current_data = data_store.db
-        expiries = data_store.expiries
-        now = time.time()
+        loop = asyncio.get_running_loop()
+        self._ensure_writer()
+
+        # Buffering and the snapshot view start together, with no await in between
+        self._rewrite_buffer = []
+        batches = data_store.begin_snapshot()
+        started = time.time()
 
+        f = None
         try:
-            async with aiofiles.open(temp_filepath, mode='w') as f:
-                for key, value in current_data.items():
-                    # Check if the key has an associated expiry
-                    if key in expiries:
-                        remaining_ttl = int(expiries[key] - now)
-                        
-                        # Only write to the new log if it hasn't expired yet
-                        if remaining_ttl > 0:
-                            await f.write(f"SET {key} {value} EX {remaining_ttl}\n")
-                    else:
-                        # No TTL associated, write standard SET command
-                        await f.write(f"SET {key} {value}\n")
-                
-                await f.flush()
-            
-            # Atomic swap: replaces the bloated log with the clean one
-            os.replace(temp_filepath, self.filepath)
-            print(f"[AOF] Compaction successful. Optimized storage for {len(current_data)} keys.")
+            f = open(temp_filepath, "wb")
+            snapshot = SnapshotWriter(f)
+            async for entries in batches:
+                await loop.run_in_executor(None, snapshot.write_entries, entries)
+            await loop.run_in_executor(None, snapshot.finish)
+            f.write(encode_header())
+
+            # Catch up on buffered writes while the writer keeps going...
+            while sum(map(len, self._rewrite_buffer)) >= REWRITE_FLUSH_THRESHOLD:
+                data, self._rewrite_buffer = self._rewrite_buffer, []
+                await loop.run_in_executor(None, self._write_rewrite_tail, f, data)
+
+            # ...then pause it for the remainder, the fsync and the swap.
+            # The writer's long-lived handle is closed so the next batch opens the new file.
+            async with self._io_lock:
+                data, self._rewrite_buffer = self._rewrite_buffer, None
+                await loop.run_in_executor(None, self._finish_rewrite, f, data)
+                f = None
+                os.replace(temp_filepath, self.filepath)
+                await loop.run_in_executor(None, self._close_file)
+                self.current_size = self.base_size = os.path.getsize(self.filepath)
+                self._needs_header = False
+
+            self.stats["rewrites"] += 1
+            self.rewrite_duration.observe(time.time() - started)
+            print(f"[AOF] Compaction successful. Optimized storage for {snapshot.count} keys "
+                  f"in {time.time() - started:.2f}s.")
+            return True
 
         except Exception as e:
             print(f"[AOF] Compaction failed: {e}")
+            if f is not None:
+                f.close()
             if os.path.exists(temp_filepath):
                 os.remove(temp_filepath)
+            return False
+        finally:
+            self._rewrite_buffer = None
+            await batches.aclose()
+
+    @staticmethod
+    def _write_rewrite_tail(f, data):
+        f.write(b"".join(data))
+
+    def _finish_rewrite(self, f, data):
+        self._write_rewrite_tail(f, data)
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
 
-    def read_logs(self):
+    def replay(self):
         """
-        Synchronous read used during server startup to rebuild memory state.
+        Streams the dataset stored in the file for startup recovery: the
+        snapshot preamble's entries, then the logged records, as ("SET", key,
+        value, expiry or None) and ("DEL", key). Records of a transaction are
+        only yielded once its EXEC has been read. Memory use doesn't depend
+        on the file size: the file is mmapped and decoded one record at a time.
+
+        A torn tail (an incomplete or partially written last record, and an
+        unfinished transaction before it) is truncated away. Damage anywhere
+        else raises SnapshotError or AOFCorruptionError.
         """
-        if not os.path.exists(self.filepath):
+        if not os.path.exists(self.filepath) or os.path.getsize(self.filepath) == 0:
             print(f"[AOF] No existing log file found at {self.filepath}")
-            return []
-        
-        try:
-            with open(self.filepath, "r") as f:
-                lines = [line.strip() for line in f.readlines() if line.strip()]
-                print(f"[AOF] Recovery: Loaded {len(lines)} commands from disk.")
-                return lines
-        except Exception as e:
-            print(f"[AOF] Critical error reading logs: {e}")
-            return []
\ No newline at end of file
+            self._needs_header = True
+            return
+
+        truncate_at = None
+        with open(self.filepath, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mm, "madvise"):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                size, offset = len(mm), 0
+                if is_snapshot(mm):
+                    reader = SnapshotReader(mm)
+                    for key, value, expiry in reader:
+                        yield ("SET", key, value, expiry)
+                    print(f"[AOF] Recovery: Loaded snapshot with {reader.count} keys.")
+                    offset = reader.end
+
+                if offset == size:
+                    self._needs_header = True
+                elif is_log_header(mm, offset):
+                    truncate_at = yield from self._replay_log(mm, offset)
+                else:
+                    yield from self._replay_text(mm, offset)
+                    self.legacy_format = True
+
+        if truncate_at is not None:
+            print(f"[AOF] Recovery: Truncating {size - truncate_at} bytes of torn tail at offset {truncate_at}.")
+            os.truncate(self.filepath, truncate_at)
+            self.current_size = truncate_at
+
+    def _replay_log(self, mm, offset):
+        """Yields the binary log's records; returns the offset to truncate at, if any."""
+        reader = LogReader(mm, offset)
+        transaction, transaction_start = None, None
+        for record in reader:
+            if record[0] == "MULTI":
+                transaction, transaction_start = [], reader.record_start
+            elif record[0] == "EXEC":
+                yield from transaction or ()
+                transaction = None
+            elif transaction is not None:
+                transaction.append(record)
+            else:
+                yield record
+        print(f"[AOF] Recovery: Loaded {reader.count} records from disk.")
+        if transaction is not None:
+            # A MULTI block cut short by a crash is dropped, like the torn bytes after it
+            return transaction_start
+        return reader.end if reader.torn else None
+
+    def _replay_text(self, mm, offset):
+        """
+        Yields the records of a text log written by older versions
+        ("SET key value [EX seconds]", "DEL key", MULTI / EXEC, one per line).
+        Their EX is relative, so it is counted from now.
+        """
+        transaction, count, pos, size = None, 0, offset, len(mm)
+        while pos < size:
+            end = mm.find(b"\n", pos)
+            end = size if end == -1 else end
+            parts = _decode(mm[pos:end]).split()
+            pos = end + 1
+            if not parts:
+                continue
+            count += 1
+            cmd = parts[0].upper()
+            if cmd == "MULTI":
+                transaction = []
+                continue
+            if cmd == "EXEC":
+                yield from transaction or ()
+                transaction = None
+                continue
+            if cmd == "SET" and len(parts) >= 3:
+                rest, expiry = parts[2:], None
+                if len(rest) >= 3 and rest[-2].upper() == "EX" and rest[-1].isdigit():
+                    expiry, rest = time.time() + int(rest[-1]), rest[:-2]
+                record = ("SET", parts[1], " ".join(rest), expiry)
+            elif cmd == "DEL" and len(parts) >= 2:
+                record = ("DEL", parts[1])
+            else:
+                continue
+            if transaction is not None:
+                transaction.append(record)
+            else:
+                yield record
+        print(f"[AOF] Recovery: Loaded {count} text commands from disk.")
+
+    def upgrade(self, entries):
+        """
+        Replaces a legacy text AOF with a binary one holding `entries`
+        (key, value, expiry) as its snapshot. Runs synchronously at startup,
+        before any writes.
+        """
+        temp_filepath = f"{self.filepath}.tmp"
+        with open(temp_filepath, "wb") as f:
+            count = write_snapshot(f, entries)
+            f.write(encode_header())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_filepath, self.filepath)
+        self.legacy_format = False
+        self._needs_header = False
+        self.current_size = self.base_size = os.path.getsize(self.filepath)
+        print(f"[AOF] Converted the text AOF to the binary format ({count} keys).")
@@ -0,0 +1,97 @@
+"""
+Hot-set checkpoints: the keys the shards' hot tiers held, most valuable
+first, with the hot-tier segment and access frequency of each (and its
+allkeys-lfu counter), so a restarted node can prewarm its hot tiers
+instead of starting cold. Values are not stored; warmup takes them from
+the dataset the AOF rebuilt.
+
+Binary layout (all integers little-endian):
+  header : MAGIC (8) | version u16 | reserved u16 | created_at f64
+  entry  : segment u8 | frequency u8 | counter u8 | key_len u32 | key
+  footer : 0xFF | entry_count u64 | crc32 u32 (of every byte before the crc)
+
+A checkpoint is only a hint: a missing or damaged one is ignored.
+"""
+import os
+import struct
+import time
+import zlib
+
+MAGIC = b"PYKVHOTS"
+VERSION = 1
+HEADER = struct.Struct("<8sHHd")
+ENTRY = struct.Struct("<BBBI")
+FOOTER = struct.Struct("<BQ")
+CRC = struct.Struct("<I")
+TYPE_EOF = 0xFF
+
+# Hot-tier segment names (see core.hot_cache.LRUSegment), by their code in the file
+SEGMENTS = ("main", "window", "probation", "protected")
+SEGMENT_CODES = {name: code for code, name in enumerate(SEGMENTS)}
+
+def encode_checkpoint(entries):
+    """`entries` are (segment name, key, frequency, counter) tuples."""
+    out = bytearray(HEADER.pack(MAGIC, VERSION, 0, time.time()))
+    count = 0
+    for segment, key, frequency, counter in entries:
+        k = key.encode("utf-8", "surrogateescape")
+        out += ENTRY.pack(SEGMENT_CODES.get(segment, 0), min(frequency, 255), min(counter, 255), len(k))
+        out += k
+        count += 1
+    out += FOOTER.pack(TYPE_EOF, count)
+    out += CRC.pack(zlib.crc32(out))
+    return out
+
+def decode_checkpoint(data):
+    """The (segment name, key, frequency, counter) entries of a checkpoint; ValueError if damaged."""
+    if len(data) < HEADER.size + FOOTER.size + CRC.size or data[:len(MAGIC)] != MAGIC:
+        raise ValueError("not a hot-set checkpoint")
+    (crc,) = CRC.unpack_from(data, len(data) - CRC.size)
+    if zlib.crc32(memoryview(data)[:len(data) - CRC.size]) != crc:
+        raise ValueError("checksum mismatch")
+    version = HEADER.unpack_from(data)[1]
+    if version != VERSION:
+        raise ValueError(f"unsupported version {version}")
+    entries = []
+    pos, end = HEADER.size, len(data) - CRC.size - FOOTER.size
+    while pos < end:
+        segment, frequency, counter, key_len = ENTRY.unpack_from(data, pos)
+        pos += ENTRY.size
+        key = str(data[pos:pos + key_len], "utf-8", "surrogateescape")
+        pos += key_len
+        entries.append((SEGMENTS[segment] if segment < len(SEGMENTS) else "main", key, frequency, counter))
+    kind, count = FOOTER.unpack_from(data, end)
+    if pos != end or kind != TYPE_EOF or count != len(entries):
+        raise ValueError("entry count mismatch")
+    return entries
+
+class HotSetCheckpoint:
+    def __init__(self, filepath):
+        self.filepath = filepath
+
+    def save(self, entries):
+        """Written to a temp file, fsynced and atomically renamed over the previous checkpoint."""
+        data = encode_checkpoint(entries)
+        temp_filepath = f"{self.filepath}.tmp"
+        try:
+            with open(temp_filepath, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_filepath, self.filepath)
+        except Exception:
+            if os.path.exists(temp_filepath):
+                os.remove(temp_filepath)
+            raise
+
+    def load(self):
+        """The checkpointed entries, or [] when there is no usable checkpoint."""
+        if not os.path.exists(self.filepath):
+            return []
+        with open(self.filepath, "rb") as f:
+            data = f.read()
+        try:
+            return decode_checkpoint(data)
+        except (ValueError, struct.error) as e:
+            print(f"[Persistence] Ignoring hot-set checkpoint {self.filepath}: {e}")
+            return []
@@ -1,31 +1,180 @@
-import json
-import os
+import struct
+import time
+import zlib
 
-class PersistenceManager:
-    def __init__(self, filepath="persistence/storage.json"):
-        self.filepath = filepath
+# Binary snapshot layout (all integers little-endian):
+#   header : MAGIC (8) | version u16 | reserved u16 | created_at f64
+#   entry  : type u8 | key_len u32 | val_len u32 | expiry_ms i64 (0 = none) | key | value
+#            type 0x01: value as UTF-8; 0x02: value zlib-compressed (kept compressed when loaded)
+#   footer : 0xFF | entry_count u64 | crc32 u32 (of every byte before the crc)
+MAGIC = b"PYKVSNAP"
+VERSION = 1
+HEADER = struct.Struct("<8sHHd")
+ENTRY = struct.Struct("<BIIq")
+FOOTER = struct.Struct("<BQ")
+CRC = struct.Struct("<I")
+TYPE_ENTRY = 0x01
+TYPE_ENTRY_COMPRESSED = 0x02
+TYPE_EOF = 0xFF
 
-    def save_snapshot(self, data):
+# Entries are encoded into this much memory before each write
+WRITE_CHUNK_SIZE = 1024 * 1024
+
+class SnapshotError(Exception):
+    pass
+
+def _encode(text):
+    return text.encode("utf-8", "surrogateescape")
+
+def _decode(raw):
+    return str(raw, "utf-8", "surrogateescape")
+
+def is_snapshot(buf, offset=0):
+    return bytes(buf[offset:offset + len(MAGIC)]) == MAGIC
+
+class SnapshotWriter:
+    """
+    Incrementally encodes a snapshot into an open binary file, so callers can
+    feed entries in batches (e.g. one executor hop per batch) and finish later.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+        self._crc = 0
+        self._chunk = bytearray(HEADER.pack(MAGIC, VERSION, 0, time.time()))
+
+    def write_entries(self, entries):
         """
-        Implementation of a full memory dump to disk.
+        `entries` are (key, value, expiry) with expiry an absolute unix
+        timestamp or None; a bytes value is a zlib-compressed one.
         """
-        try:
-            with open(self.filepath, 'w') as f:
-                json.dump(data, f)
-            print(f"[Persistence] Snapshot saved to {self.filepath}")
-        except Exception as e:
-            print(f"[Error] Failed to save snapshot: {e}")
-
-    def load_snapshot(self):
+        chunk = self._chunk
+        for key, value, expiry in entries:
+            k = _encode(key)
+            if type(value) is bytes:
+                kind, v = TYPE_ENTRY_COMPRESSED, value
+            else:
+                kind, v = TYPE_ENTRY, _encode(str(value))
+            expiry_ms = int(expiry * 1000) if expiry else 0
+            chunk += ENTRY.pack(kind, len(k), len(v), expiry_ms)
+            chunk += k
+            chunk += v
+            self.count += 1
+            if len(chunk) >= WRITE_CHUNK_SIZE:
+                self._flush()
+                chunk = self._chunk
+
+    def _flush(self):
+        self._crc = zlib.crc32(self._chunk, self._crc)
+        self.f.write(self._chunk)
+        self._chunk = bytearray()
+
+    def finish(self):
+        """Writes the footer and checksum; returns the number of entries written."""
+        self._chunk += FOOTER.pack(TYPE_EOF, self.count)
+        self._flush()
+        self.f.write(CRC.pack(self._crc))
+        return self.count
+
+def write_snapshot(f, entries):
+    """
+    Streams (key, value, expiry) entries to an open binary file. `expiry` is
+    an absolute unix timestamp or None. Returns the number of entries written.
+    """
+    writer = SnapshotWriter(f)
+    writer.write_entries(entries)
+    return writer.finish()
+
+class SnapshotReader:
+    """
+    Iterates the entries of a snapshot held in any buffer (bytes, mmap)
+    starting at `offset`; compressed values are yielded as zlib bytes. Once iteration finishes, `end` is the offset of
+    the first byte after the snapshot and the checksum has been verified.
+    """
+
+    def __init__(self, buf, offset=0):
+        self.buf = buf
+        self.offset = offset
+        self.end = None
+        self.count = 0
+
+    def __iter__(self):
+        buf, start = self.buf, self.offset
+        if not is_snapshot(buf, start):
+            raise SnapshotError("missing snapshot header")
+        magic, version, _, _ = HEADER.unpack_from(buf, start)
+        if version != VERSION:
+            raise SnapshotError(f"unsupported snapshot version {version}")
+
+        pos, size, now_ms = start + HEADER.size, len(buf), time.time() * 1000
+        while True:
+            if pos >= size:
+                raise SnapshotError("truncated snapshot")
+            if buf[pos] == TYPE_EOF:
+                break
+            kind, key_len, val_len, expiry_ms = ENTRY.unpack_from(buf, pos)
+            if kind not in (TYPE_ENTRY, TYPE_ENTRY_COMPRESSED):
+                raise SnapshotError(f"unknown record type {kind}")
+            pos += ENTRY.size
+            if pos + key_len + val_len > size:
+                raise SnapshotError("truncated snapshot")
+            key = _decode(buf[pos:pos + key_len])
+            pos += key_len
+            value = buf[pos:pos + val_len]
+            value = bytes(value) if kind == TYPE_ENTRY_COMPRESSED else _decode(value)
+            pos += val_len
+            self.count += 1
+            # Keys that expired while the server was down are skipped
+            if expiry_ms and expiry_ms <= now_ms:
+                continue
+            yield key, value, (expiry_ms / 1000 if expiry_ms else None)
+
+        if pos + FOOTER.size + CRC.size > size:
+            raise SnapshotError("truncated snapshot footer")
+        _, count = FOOTER.unpack_from(buf, pos)
+        pos += FOOTER.size
+        (expected,) = CRC.unpack_from(buf, pos)
+        if count != self.count or expected != self._crc(start, pos):
+            raise SnapshotError("snapshot checksum mismatch")
+        self.end = pos + CRC.size
+
+    def verify(self):
         """
-        Implementation of data recovery on startup.
+        Checks the framing, entry count and checksum without decoding any
+        entry, so a damaged snapshot can be refused before anything is
+        loaded from it. Returns the number of entries; raises SnapshotError.
         """
-        if not os.path.exists(self.filepath):
-            return {}
-        
-        try:
-            with open(self.filepath, 'r') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"[Error] Failed to load data: {e}")
-            return {}
\ No newline at end of file
+        buf, start = self.buf, self.offset
+        if not is_snapshot(buf, start):
+            raise SnapshotError("missing snapshot header")
+        version = HEADER.unpack_from(buf, start)[1]
+        if version != VERSION:
+            raise SnapshotError(f"unsupported snapshot version {version}")
+        pos, size, count = start + HEADER.size, len(buf), 0
+        while True:
+            if pos >= size:
+                raise SnapshotError("truncated snapshot")
+            if buf[pos] == TYPE_EOF:
+                break
+            if pos + ENTRY.size > size:
+                raise SnapshotError("truncated snapshot")
+            kind, key_len, val_len, _ = ENTRY.unpack_from(buf, pos)
+            if kind not in (TYPE_ENTRY, TYPE_ENTRY_COMPRESSED):
+                raise SnapshotError(f"unknown record type {kind}")
+            pos += ENTRY.size + key_len + val_len
+            count += 1
+        if pos + FOOTER.size + CRC.size > size:
+            raise SnapshotError("truncated snapshot footer")
+        _, expected_count = FOOTER.unpack_from(buf, pos)
+        (expected,) = CRC.unpack_from(buf, pos + FOOTER.size)
+        if count != expected_count or expected != self._crc(start, pos + FOOTER.size):
+            raise SnapshotError("snapshot checksum mismatch")
+        return count
+
+    def _crc(self, start, stop):
+        crc, view = 0, memoryview(self.buf)
+        for chunk_start in range(start, stop, WRITE_CHUNK_SIZE):
+            crc = zlib.crc32(view[chunk_start:min(stop, chunk_start + WRITE_CHUNK_SIZE)], crc)
+        view.release()
+        return crc
@@ -0,0 +1,209 @@
+"""
+Disk tier for values (--tiered-dir).
+
+With tiered storage the shards keep keys, TTLs and hot values in memory, but
+any other value of at least `min_value_size` bytes is appended to a segment
+file and the db holds a SegmentRef to it instead. Segments are append-only
+and read through mmap; the active one is written through a buffered file
+and flushed only when a read needs bytes still in its buffer.
+
+Overwriting or deleting a key turns its old record into garbage. Sealed
+segments with enough garbage are merged: the store copies their live values
+into the active segment and deletes the file (LRUCache.merge_segments).
+
+The AOF stays the source of truth. Segments only stand in for memory, so
+they are never fsynced and are recreated from scratch at every startup, as
+the AOF replay spills values again.
+"""
+import os
+import mmap
+import struct
+
+from core.node import SegmentRef
+from persistence.manager import _encode, _decode
+
+# Segment record: key_len u32 | value_len u32 | key | value (the key lets merges find the owner).
+# A value is a flag byte (VALUE_COMPRESSED for zlib bytes) then its bytes; a SegmentRef spans both.
+RECORD = struct.Struct("<II")
+VALUE_PLAIN = 0
+VALUE_COMPRESSED = 1
+
+SEGMENT_PREFIX = "segment."
+SEGMENT_SUFFIX = ".dat"
+
+class Segment:
+    """One segment file; `live` and `values` count value bytes still referenced / ever written."""
+
+    def __init__(self, segment_id, path):
+        self.id = segment_id
+        self.path = path
+        self.file = open(path, "w+b")
+        self.size = 0
+        self.flushed = 0
+        self.values = 0
+        self.live = 0
+        self.sealed = False
+        self.mm = None
+
+    def garbage_ratio(self):
+        return 1 - self.live / self.values if self.values else 0.0
+
+def read_view(view):
+    """
+    The value held by a view returned by SegmentStore.view() (zlib bytes if
+    it was stored compressed); safe to call from any thread.
+    """
+    mm, start, end = view
+    if mm[start] == VALUE_COMPRESSED:
+        return mm[start + 1:end]
+    return _decode(mm[start + 1:end])
+
+class SegmentStore:
+    def __init__(self, directory, max_segment_size=64 * 1024 * 1024, min_value_size=64, merge_ratio=0.5):
+        self.directory = directory
+        self.max_segment_size = max_segment_size
+        self.min_value_size = min_value_size
+        self.merge_ratio = merge_ratio
+        self.segments = {}
+        self.next_id = 0
+        # Segments emptied while a snapshot may still read them; deleted once it ends
+        self._snapshots = 0
+        self._doomed = []
+        self.stats = {"reads": 0, "deleted": 0, "merged_bytes": 0}
+
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                os.remove(os.path.join(directory, name))
+        self.active = self._new_segment()
+
+    def _new_segment(self):
+        segment_id = self.next_id
+        self.next_id += 1
+        path = os.path.join(self.directory, f"{SEGMENT_PREFIX}{segment_id}{SEGMENT_SUFFIX}")
+        segment = self.segments[segment_id] = Segment(segment_id, path)
+        return segment
+
+    def _seal(self, segment):
+        segment.file.flush()
+        segment.flushed = segment.size
+        segment.mm = mmap.mmap(segment.file.fileno(), 0, access=mmap.ACCESS_READ) if segment.size else None
+        # The mapping keeps its own handle on the file
+        segment.file.close()
+        segment.file = None
+        segment.sealed = True
+
+    # --- Writes ---
+    def append(self, key: str, value: str):
+        """Appends a value (a str, or zlib bytes) and returns its SegmentRef."""
+        if type(value) is bytes:
+            return self._append(_encode(key), bytes((VALUE_COMPRESSED,)) + value)
+        return self._append(_encode(key), bytes((VALUE_PLAIN,)) + _encode(value))
+
+    def _append(self, k: bytes, v: bytes):
+        segment = self.active
+        if segment.size >= self.max_segment_size:
+            self._seal(segment)
+            segment = self.active = self._new_segment()
+        segment.file.write(RECORD.pack(len(k), len(v)) + k + v)
+        ref = SegmentRef(segment.id, segment.size + RECORD.size + len(k), len(v))
+        segment.size += RECORD.size + len(k) + len(v)
+        segment.values += len(v)
+        segment.live += len(v)
+        return ref
+
+    def release(self, ref: SegmentRef):
+        """Marks a value as garbage (its key was overwritten or deleted); empty sealed segments go away."""
+        segment = self.segments[ref.segment]
+        segment.live -= ref.length
+        if not segment.live and segment.sealed:
+            self.retire(segment)
+
+    # --- Reads ---
+    def view(self, ref: SegmentRef):
+        """
+        (mapping, start, end) of a value, for read_view() on another thread.
+        Call on the event loop: it may flush the active segment or remap it.
+        The view stays valid even if the segment is merged away meanwhile.
+        """
+        segment = self.segments[ref.segment]
+        end = ref.offset + ref.length
+        if end > segment.flushed:
+            segment.file.flush()
+            segment.flushed = segment.size
+        if segment.mm is None or len(segment.mm) < end:
+            # Old mappings are left to readers still holding them and closed when dropped
+            segment.mm = mmap.mmap(segment.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.stats["reads"] += 1
+        return segment.mm, ref.offset, end
+
+    def read(self, ref: SegmentRef):
+        """Reads a value synchronously (on the event loop)."""
+        return read_view(self.view(ref))
+
+    # --- Merges ---
+    def pause_deletes(self):
+        """A snapshot started: its copy-on-write view may still refer to released values."""
+        self._snapshots += 1
+
+    def resume_deletes(self):
+        self._snapshots -= 1
+        if not self._snapshots:
+            doomed, self._doomed = self._doomed, []
+            for segment in doomed:
+                self.retire(segment)
+
+    def merge_candidates(self):
+        """Sealed segments whose share of garbage has reached merge_ratio."""
+        return [segment for segment in list(self.segments.values())
+                if segment.sealed and segment.garbage_ratio() >= self.merge_ratio]
+
+    def records(self, segment):
+        """
+        Yields (key, value offset, value bytes) for every record of a sealed
+        segment, live or not. Sealed segments never change, so this can be
+        consumed from any thread.
+        """
+        mm, pos = segment.mm, 0
+        while mm is not None and pos < segment.size:
+            key_len, value_len = RECORD.unpack_from(mm, pos)
+            key_start = pos + RECORD.size
+            value_start = key_start + key_len
+            yield _decode(mm[key_start:value_start]), value_start, mm[value_start:value_start + value_len]
+            pos = value_start + value_len
+
+    def relocate(self, key: str, ref: SegmentRef, data: bytes):
+        """Appends a live value's record bytes `data` to the active segment and points `ref` at the copy."""
+        old = self.segments[ref.segment]
+        new = self._append(_encode(key), data)
+        old.live -= ref.length
+        ref.segment, ref.offset = new.segment, new.offset
+        self.stats["merged_bytes"] += ref.length
+
+    def retire(self, segment):
+        """Deletes a sealed segment nothing refers to any more."""
+        if self._snapshots:
+            self._doomed.append(segment)
+            return
+        if self.segments.pop(segment.id, None) is None:
+            return
+        segment.mm = None
+        os.remove(segment.path)
+        self.stats["deleted"] += 1
+
+    # --- Introspection ---
+    def totals(self):
+        return {
+            "segment_files": len(self.segments),
+            "segment_bytes": sum(segment.size for segment in self.segments.values()),
+            "segment_live_bytes": sum(segment.live for segment in self.segments.values()),
+            "segment_reads": self.stats["reads"],
+            "segments_deleted": self.stats["deleted"],
+            "segment_merged_bytes": self.stats["merged_bytes"],
+        }
+
+    def close(self):
+        for segment in self.segments.values():
+            if segment.file is not None:
+                segment.file.close()
+            segment.mm = None
@@ -0,0 +1,203 @@
+"""
+Client connections of the leader: the registry behind CLIENT LIST, CLIENT
+KILL and INFO's Clients section, and the limits that keep misbehaving
+clients from pinning memory or loop time:
+
+    --maxclients                   connections beyond this are refused
+    --timeout                      connections idle this long are closed (0 = never)
+    --client-query-buffer-limit    an unparsed request larger than this closes the connection
+    --client-output-buffer-*       output the client hasn't read above the hard limit, or above
+                                   the soft limit for longer than soft-seconds, closes it
+
+Replies to everything that arrived in one read are written at once, so the
+output that can pile up is what the socket hasn't accepted yet: a client
+that pipelines requests but doesn't read its replies. Such a connection is
+aborted, dropping its pending output. Followers (after PSYNC) have their
+own limits, and invalidation connections (CLIENT TRACKING REDIRECT
+targets) only receive pushes, so neither is subject to the idle timeout.
+"""
+import asyncio
+import time
+
+# Seconds between two passes over the clients (idle timeout, soft output limit, command rates)
+REAPER_INTERVAL = 1.0
+
+def format_address(address):
+    if not address:
+        return "?"
+    return f"{address[0]}:{address[1]}"
+
+class Client:
+    """One connection: its writer, request parser, session and counters."""
+
+    def __init__(self, client_id, writer, parser):
+        self.id = client_id
+        self.writer = writer
+        self.parser = parser
+        self.session = None
+        self.address = format_address(writer.get_extra_info("peername"))
+        self.created = self.last_interaction = time.monotonic()
+        self.commands = 0
+        self.last_command = "NULL"
+        self.command_rate = 0.0     # Commands per second over the last reaper interval
+        self._commands_at_mark = 0
+        self.follower = False       # The connection now carries the replication stream
+        self.redirect_target = False  # Receives CLIENT TRACKING invalidations
+        self.killed = False         # Closed (or to be closed once its replies are written)
+        self.over_soft_since = None
+
+    def output_size(self):
+        """Bytes written for this client that the socket hasn't accepted yet."""
+        transport = self.writer.transport
+        return transport.get_write_buffer_size() if transport is not None else 0
+
+    def flags(self):
+        flags = ""
+        if self.follower:
+            flags += "S"
+        session = self.session
+        if session is not None and session.queue is not None:
+            flags += "x"
+        if session is not None and session.tracking is not None:
+            flags += "t"
+        if self.redirect_target:
+            flags += "R"
+        return flags or "N"
+
+    def describe(self, now):
+        session = self.session
+        return (f"id={self.id} addr={self.address} age={int(now - self.created)} "
+                f"idle={int(now - self.last_interaction)} flags={self.flags()} "
+                f"multi={len(session.queue) if session is not None and session.queue is not None else -1} "
+                f"qbuf={self.parser.buffered()} obuf={self.output_size()} cmds={self.commands} "
+                f"cmd_rate={self.command_rate:.1f} cmd={self.last_command}")
+
+class ClientRegistry:
+    def __init__(self, max_clients=10000, idle_timeout=0, query_buffer_limit=1024 ** 3,
+                 output_limits=(0, 0, 0)):
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout
+        self.query_buffer_limit = query_buffer_limit
+        self.hard_limit, self.soft_limit, self.soft_seconds = output_limits
+        self.clients = {}  # client id -> Client
+        self.stats = {
+            "total_connections": 0,
+            "rejected_connections": 0,
+            "killed_clients": 0,
+            "idle_timeouts": 0,
+            "output_buffer_disconnects": 0,
+            "query_buffer_disconnects": 0,
+        }
+
+    def __len__(self):
+        return len(self.clients)
+
+    def accept(self, client_id, writer, parser):
+        """Registers a new connection; None if --maxclients connections are already open."""
+        if self.max_clients and len(self.clients) >= self.max_clients:
+            self.stats["rejected_connections"] += 1
+            return None
+        client = self.clients[client_id] = Client(client_id, writer, parser)
+        self.stats["total_connections"] += 1
+        return client
+
+    def remove(self, client):
+        self.clients.pop(client.id, None)
+
+    def close(self, client, reason, stat=None, abort=False):
+        """Disconnects a client; abort drops output it hasn't read (the limits) instead of flushing it."""
+        if client.killed:
+            return
+        client.killed = True
+        if stat is not None:
+            self.stats[stat] += 1
+        print(f"[Clients] Closing client id={client.id} addr={client.address}: {reason}")
+        if abort and client.writer.transport is not None:
+            client.writer.transport.abort()
+        else:
+            client.writer.close()
+
+    def check_query_buffer(self, client):
+        """False (and the client closed) if its unparsed input is over the limit."""
+        if self.query_buffer_limit and client.parser.buffered() > self.query_buffer_limit:
+            self.close(client, f"query buffer of {client.parser.buffered()} bytes over the limit",
+                       "query_buffer_disconnects", abort=True)
+            return False
+        return True
+
+    def check_output(self, client, now=None):
+        """False (and the client aborted) if its pending output is over the hard limit, or the soft one for too long."""
+        size = client.output_size()
+        if self.hard_limit and size > self.hard_limit:
+            self.close(client, f"output buffer of {size} bytes over the hard limit",
+                       "output_buffer_disconnects", abort=True)
+            return False
+        if not self.soft_limit or size <= self.soft_limit:
+            client.over_soft_since = None
+            return True
+        now = time.monotonic() if now is None else now
+        if client.over_soft_since is None:
+            client.over_soft_since = now
+        elif now - client.over_soft_since > self.soft_seconds:
+            self.close(client, f"output buffer of {size} bytes over the soft limit for "
+                       f"{now - client.over_soft_since:.0f}s", "output_buffer_disconnects", abort=True)
+            return False
+        return True
+
+    async def reaper(self, interval=REAPER_INTERVAL):
+        """Background task: idle timeouts, the soft output limit and per-client command rates."""
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for client in list(self.clients.values()):
+                client.command_rate = (client.commands - client._commands_at_mark) / interval
+                client._commands_at_mark = client.commands
+                if client.killed or client.follower:
+                    continue
+                if not self.check_output(client, now):
+                    continue
+                if (self.idle_timeout and not client.redirect_target
+                        and now - client.last_interaction > self.idle_timeout):
+                    self.close(client, f"idle for {now - client.last_interaction:.0f}s", "idle_timeouts")
+
+    def list(self):
+        now = time.monotonic()
+        return "\n".join(client.describe(now) for client in self.clients.values())
+
+    def kill(self, filters, current):
+        """
+        CLIENT KILL: closes the clients matching every (ID|ADDR, value) filter
+        and returns how many. The calling client (`current`) is only marked,
+        so it still gets its reply before the connection is closed.
+        """
+        killed = 0
+        for client in list(self.clients.values()):
+            if client.killed:
+                continue
+            if all(str(client.id) == value if name == "ID" else client.address == value
+                   for name, value in filters):
+                killed += 1
+                if client.id == current:
+                    client.killed = True
+                    self.stats["killed_clients"] += 1
+                else:
+                    self.close(client, "CLIENT KILL", "killed_clients")
+        return killed
+
+    def get_info(self):
+        return (
+            f"connected_clients: {len(self.clients)}\n"
+            f"maxclients: {self.max_clients}\n"
+            f"clients_over_soft_output_limit: "
+            f"{sum(1 for c in self.clients.values() if c.over_soft_since is not None)}\n"
+            f"client_recent_max_output_buffer: "
+            f"{max((c.output_size() for c in self.clients.values()), default=0)}\n"
+            f"client_recent_max_input_buffer: "
+            f"{max((c.parser.buffered() for c in self.clients.values()), default=0)}\n"
+            f"total_connections_received: {self.stats['total_connections']}\n"
+            f"rejected_connections: {self.stats['rejected_connections']}\n"
+            f"killed_clients: {self.stats['killed_clients']}\n"
+            f"idle_timeouts: {self.stats['idle_timeouts']}\n"
+            f"output_buffer_disconnects: {self.stats['output_buffer_disconnects']}\n"
+            f"query_buffer_disconnects: {self.stats['query_buffer_disconnects']}"
+        )
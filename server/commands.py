@@ -0,0 +1,446 @@
+"""
+Command table shared by the leader and the follower.
+
+Every handler receives the store and the full argument list (command name
+included) and returns a reply value that core.protocol knows how to encode.
+execute() records each call's latency in store.metrics (see core.metrics);
+the time includes waiting for the AOF unless the caller defers durability.
+"""
+import itertools
+import time
+
+from core.protocol import MAX_BULK_LENGTH, Error, OK, SimpleString
+from core.scan import compile_pattern
+from core.shard import INT64_MIN, OutOfMemoryError, Watch, check_compressed, parse_int64
+
+# Commands that modify the dataset; followers apply only these from the replication stream
+WRITE_COMMANDS = {"SET", "SETZ", "DEL", "INCR", "INCRBY", "DECRBY", "APPEND", "MSET", "MSETEX", "MDEL"}
+
+# Commands that may be queued between MULTI and EXEC
+TRANSACTION_COMMANDS = WRITE_COMMANDS | {"GET", "MGET", "MEMORY", "INFO"}
+
+QUEUED = SimpleString("QUEUED")
+
+def parse_expiry_option(option, value):
+    """
+    (ttl, expiry) for `EX <seconds>` or `PXAT <unix time in ms>` (how the
+    leader logs and replicates expiries). Raises ValueError otherwise.
+    """
+    option = option.upper()
+    if option == "EX":
+        return int(value), None
+    if option == "PXAT":
+        return None, int(value) / 1000
+    raise ValueError(option)
+
+def parse_set_args(args):
+    """
+    SET <key> <value> [EX <seconds> | PXAT <unix ms>]. Inline clients may send
+    unquoted values containing spaces, so everything between the key and
+    the option is the value. Returns (key, value, ttl, expiry).
+    """
+    key, rest, ttl, expiry = args[1], args[2:], None, None
+    if len(rest) >= 3:
+        try:
+            ttl, expiry = parse_expiry_option(rest[-2], rest[-1])
+            rest = rest[:-2]
+        except ValueError:
+            # Fallback if the option is malformed: keep it as part of the value
+            pass
+    return key, " ".join(rest), ttl, expiry
+
+async def cmd_set(store, args):
+    key, value, ttl, expiry = parse_set_args(args)
+    await store.set(key, value, ttl, expiry)
+    return OK
+
+async def cmd_setz(store, args):
+    # SETZ <key> <zlib-compressed value> [EX <seconds> | PXAT <unix ms>]: how compressed values
+    # are replicated. The value is stored compressed (or decompressed if compression is off).
+    if len(args) not in (3, 5):
+        return Error("ERROR: Syntax is SETZ <key> <zlib value> [EX <seconds> | PXAT <unix ms>]")
+    try:
+        ttl, expiry = parse_expiry_option(args[3], args[4]) if len(args) == 5 else (None, None)
+    except ValueError:
+        return Error("ERROR: Syntax is SETZ <key> <zlib value> [EX <seconds> | PXAT <unix ms>]")
+    data = args[2].encode("utf-8", "surrogateescape")
+    try:
+        # Bounded like any other value, without inflating it in memory
+        check_compressed(data, MAX_BULK_LENGTH)
+    except ValueError:
+        return Error("ERROR: Value is not a zlib stream")
+    await store.set(args[1], data, ttl, expiry)
+    return OK
+
+async def cmd_get(store, args):
+    # If key is expired or missing, store.get returns None
+    return await store.get(args[1])
+
+async def cmd_incr(store, args):
+    result = await store.increment(args[1])
+    return Error(result) if isinstance(result, str) else result
+
+async def cmd_incrby(store, args):
+    # INCRBY <key> <amount> / DECRBY <key> <amount>
+    try:
+        delta = parse_int64(args[2])
+    except ValueError:
+        return Error("ERROR: Value is not an integer")
+    if args[0].upper() == "DECRBY":
+        if delta == INT64_MIN:
+            return Error("ERROR: Increment or decrement would overflow")
+        delta = -delta
+    result = await store.increment(args[1], delta)
+    return Error(result) if isinstance(result, str) else result
+
+async def cmd_append(store, args):
+    # Like SET, unquoted inline values may contain spaces
+    return await store.append(args[1], " ".join(args[2:]))
+
+async def cmd_del(store, args):
+    return OK if await store.delete(args[1]) else None
+
+async def cmd_mget(store, args):
+    return await store.mget(args[1:])
+
+def _pairs(args):
+    if len(args) % 2:
+        return None
+    return list(zip(args[0::2], args[1::2]))
+
+async def cmd_mset(store, args):
+    # MSET <key> <value> [<key> <value> ...]
+    pairs = _pairs(args[1:])
+    if pairs is None:
+        return Error("ERROR: Wrong number of arguments for 'MSET'")
+    await store.mset(pairs)
+    return OK
+
+async def cmd_msetex(store, args):
+    # MSETEX <seconds> <key> <value> [<key> <value> ...]
+    try:
+        ttl = int(args[1])
+    except ValueError:
+        return Error("ERROR: TTL is not an integer")
+    pairs = _pairs(args[2:])
+    if pairs is None:
+        return Error("ERROR: Wrong number of arguments for 'MSETEX'")
+    await store.mset(pairs, ttl)
+    return OK
+
+async def cmd_mdel(store, args):
+    return await store.mdelete(args[1:])
+
+async def cmd_info(store, args):
+    # INFO [section]
+    return store.get_info(args[1] if len(args) > 1 else None)
+
+async def cmd_memory(store, args):
+    # MEMORY USAGE <key>
+    if args[1].upper() != "USAGE" or len(args) != 3:
+        return Error("ERROR: Syntax is MEMORY USAGE <key>")
+    return await store.memory_usage(args[2])
+
+async def cmd_bgrewriteaof(store, args):
+    if store.aof.rewrite_in_progress or store.aof.rewrite_task is not None:
+        return Error("ERROR: Background AOF rewrite already in progress")
+    store.aof.start_compaction(store)
+    return SimpleString("Background append only file rewriting started")
+
+def parse_max_lag(args):
+    """MAXLAG <seconds>: seconds as a float, None for 0 (no bound). Raises ValueError."""
+    seconds = float(args[1])
+    if seconds < 0:
+        raise ValueError(seconds)
+    return seconds or None
+
+async def cmd_maxlag(store, args):
+    # The bound is per connection and only matters on followers (server/follower.py);
+    # the leader is never stale, so here it is just validated
+    try:
+        parse_max_lag(args)
+    except ValueError:
+        return Error("ERROR: Syntax is MAXLAG <seconds>")
+    return OK
+
+async def cmd_slowlog(store, args):
+    # SLOWLOG GET [count] | SLOWLOG LEN | SLOWLOG RESET
+    slowlog = store.metrics.slowlog
+    sub = args[1].upper()
+    if sub == "GET" and len(args) <= 3:
+        try:
+            count = int(args[2]) if len(args) == 3 else 10
+        except ValueError:
+            return Error("ERROR: Count is not an integer")
+        return list(slowlog.entries if count < 0 else itertools.islice(slowlog.entries, count))
+    if sub == "LEN" and len(args) == 2:
+        return len(slowlog.entries)
+    if sub == "RESET" and len(args) == 2:
+        slowlog.reset()
+        return OK
+    return Error("ERROR: Syntax is SLOWLOG GET [count] | LEN | RESET")
+
+async def cmd_scan(store, args):
+    # SCAN <cursor> [MATCH <pattern>] [COUNT <count>]
+    pattern, count = None, 10
+    options = args[2:]
+    if len(options) % 2:
+        return Error("ERROR: Syntax is SCAN <cursor> [MATCH <pattern>] [COUNT <count>]")
+    for option, value in zip(options[0::2], options[1::2]):
+        option = option.upper()
+        if option == "MATCH":
+            try:
+                compile_pattern(value)
+            except ValueError:
+                return Error("ERROR: Invalid pattern")
+            pattern = value
+        elif option == "COUNT":
+            try:
+                count = int(value)
+            except ValueError:
+                count = 0
+            if count < 1:
+                return Error("ERROR: COUNT must be a positive integer")
+        else:
+            return Error("ERROR: Syntax is SCAN <cursor> [MATCH <pattern>] [COUNT <count>]")
+    try:
+        cursor, keys = await store.scan(args[1], pattern, count)
+    except ValueError:
+        return Error("ERROR: Invalid cursor")
+    return [cursor, keys]
+
+def parse_lex_bound(bound, unbounded):
+    """A KEYRANGE bound: `unbounded` ("-" or "+"), "[key" (inclusive) or "(key" (exclusive)."""
+    if bound == unbounded:
+        return None, True
+    if bound[:1] in ("[", "("):
+        return bound[1:], bound[0] == "["
+    raise ValueError(bound)
+
+async def cmd_keyrange(store, args):
+    # KEYRANGE <start> <end> [LIMIT <count>], bounds as in ZRANGEBYLEX
+    try:
+        start, start_inclusive = parse_lex_bound(args[1], "-")
+        end, end_inclusive = parse_lex_bound(args[2], "+")
+        limit = None
+        if len(args) == 5 and args[3].upper() == "LIMIT":
+            limit = int(args[4])
+            if limit < 0:
+                raise ValueError(limit)
+        elif len(args) != 3:
+            raise ValueError(args)
+    except ValueError:
+        return Error("ERROR: Syntax is KEYRANGE <[start|(start|-> <[end|(end|+> [LIMIT <count>]")
+    try:
+        return await store.key_range(start, start_inclusive, end, end_inclusive, limit)
+    except ValueError as e:
+        return Error(f"ERROR: {e}")
+
+# name -> (handler, arity); a negative arity means "at least that many arguments"
+COMMANDS = {
+    "SET": (cmd_set, -3),
+    "SETZ": (cmd_setz, -3),
+    "GET": (cmd_get, 2),
+    "INCR": (cmd_incr, 2),
+    "INCRBY": (cmd_incrby, 3),
+    "DECRBY": (cmd_incrby, 3),
+    "APPEND": (cmd_append, -3),
+    "DEL": (cmd_del, 2),
+    "MGET": (cmd_mget, -2),
+    "MSET": (cmd_mset, -3),
+    "MSETEX": (cmd_msetex, -4),
+    "MDEL": (cmd_mdel, -2),
+    "INFO": (cmd_info, -1),
+    "MEMORY": (cmd_memory, -2),
+    "BGREWRITEAOF": (cmd_bgrewriteaof, 1),
+    "MAXLAG": (cmd_maxlag, 2),
+    "SLOWLOG": (cmd_slowlog, -2),
+    "SCAN": (cmd_scan, -2),
+    "KEYRANGE": (cmd_keyrange, -3),
+}
+
+def check_arity(name, args):
+    """An Error if `args` can't be a valid call of command `name`, else None."""
+    entry = COMMANDS.get(name)
+    if entry is None:
+        return Error("ERROR: Unknown Command")
+    arity = entry[1]
+    if (arity > 0 and len(args) != arity) or (arity < 0 and len(args) < -arity):
+        return Error(f"ERROR: Wrong number of arguments for '{name}'")
+    return None
+
+async def execute(store, args):
+    name = args[0].upper()
+    error = check_arity(name, args)
+    if error is not None:
+        return error
+    start = time.perf_counter()
+    try:
+        reply = await COMMANDS[name][0](store, args)
+    except OutOfMemoryError as e:
+        reply = Error(str(e))
+    store.metrics.record_command(name, args, time.perf_counter() - start, isinstance(reply, Error))
+    return reply
+
+# --- MULTI / EXEC / WATCH ---
+SESSION_COMMANDS = {"MULTI", "EXEC", "DISCARD", "WATCH", "UNWATCH"}
+
+def command_keys(args):
+    """The keys a (valid) command reads or writes."""
+    name = args[0].upper()
+    if name in ("MGET", "MDEL"):
+        return args[1:]
+    if name == "MSET":
+        return args[1::2]
+    if name == "MSETEX":
+        return args[2::2]
+    if name == "MEMORY":
+        return args[2:3]
+    if name == "INFO":
+        return []
+    return args[1:2]
+
+# Reads whose keys are remembered for connections with CLIENT TRACKING on
+TRACKED_READS = {"GET", "MGET"}
+
+class Session:
+    """Transaction and tracking state of one client connection."""
+
+    def __init__(self, client_id=0):
+        self.client_id = client_id
+        self.queue = None    # Commands queued since MULTI (None outside a transaction)
+        self.failed = False  # A command was refused while queuing, so EXEC will abort
+        self.watch = None    # core.shard.Watch over the keys given to WATCH
+        self.tracking = None  # Client id invalidations are redirected to while CLIENT TRACKING is on
+
+    def close(self, store):
+        if self.watch is not None:
+            store.unwatch(self.watch)
+            self.watch = None
+
+async def execute_in_session(store, session, args):
+    """
+    Runs one command for a connection: handles MULTI/EXEC/DISCARD/WATCH/
+    UNWATCH and CLIENT, and queues commands while a transaction is open.
+    """
+    name = args[0].upper()
+    if name in SESSION_COMMANDS:
+        return await _session_command(store, session, name, args)
+    if name == "CLIENT":
+        return _client_command(store, session, args)
+    if session.tracking is not None and name in TRACKED_READS:
+        # Before the read: a write racing with it must still send an invalidation
+        store.tracking.track(session.tracking, command_keys(args))
+    if session.queue is None:
+        return await execute(store, args)
+
+    error = check_arity(name, args)
+    if error is None and name not in TRANSACTION_COMMANDS:
+        error = Error(f"ERROR: '{name}' is not allowed inside MULTI")
+    if error is not None:
+        session.failed = True
+        return error
+    session.queue.append(args)
+    return QUEUED
+
+async def _session_command(store, session, name, args):
+    if name == "MULTI":
+        if session.queue is not None:
+            return Error("ERROR: MULTI calls can not be nested")
+        session.queue = []
+        return OK
+
+    if name == "WATCH":
+        if session.queue is not None:
+            return Error("ERROR: WATCH inside MULTI is not allowed")
+        if len(args) < 2:
+            return Error("ERROR: Wrong number of arguments for 'WATCH'")
+        if session.watch is None:
+            session.watch = Watch()
+        store.watch(session.watch, args[1:])
+        return OK
+
+    if name == "UNWATCH":
+        session.close(store)
+        return OK
+
+    # EXEC and DISCARD end the transaction and forget the watched keys
+    queue, failed = session.queue, session.failed
+    session.queue, session.failed = None, False
+    if queue is None:
+        return Error(f"ERROR: {name} without MULTI")
+    try:
+        if name == "DISCARD":
+            return OK
+        if failed:
+            return Error("ERROR: EXECABORT Transaction discarded because of previous errors")
+        start = time.perf_counter()
+        reply = await exec_transaction(store, queue, session.watch)
+        store.metrics.record_command(name, args, time.perf_counter() - start, False)
+        return reply
+    finally:
+        # Only after EXEC holds the locks: a write in between must still mark the watch dirty
+        session.close(store)
+
+CLIENT_SYNTAX = ("ERROR: Syntax is CLIENT ID | CLIENT LIST | CLIENT KILL <ip:port> | "
+                 "CLIENT KILL [ID <id>] [ADDR <ip:port>] | CLIENT TRACKING ON REDIRECT <id> | "
+                 "CLIENT TRACKING OFF")
+
+def _client_command(store, session, args):
+    """CLIENT ID | LIST | KILL | TRACKING"""
+    sub = args[1].upper() if len(args) > 1 else ""
+    if sub == "ID" and len(args) == 2:
+        return session.client_id
+    if sub in ("LIST", "KILL") and store.clients is None:
+        return Error("ERROR: Client introspection is not available on this node")
+    if sub == "LIST" and len(args) == 2:
+        return store.clients.list()
+    if sub == "KILL" and len(args) == 3:
+        # Legacy form: an address, OK or an error
+        if store.clients.kill([("ADDR", args[2])], session.client_id):
+            return OK
+        return Error("ERROR: No such client")
+    if sub == "KILL" and len(args) >= 4 and len(args) % 2 == 0:
+        filters = [(name.upper(), value) for name, value in zip(args[2::2], args[3::2])]
+        if any(name not in ("ID", "ADDR") for name, _ in filters):
+            return Error(CLIENT_SYNTAX)
+        return store.clients.kill(filters, session.client_id)
+    if sub != "TRACKING" or len(args) < 3:
+        return Error(CLIENT_SYNTAX)
+    if store.tracking is None:
+        return Error("ERROR: Client tracking is not available on this node")
+    mode = args[2].upper()
+    if mode == "OFF" and len(args) == 3:
+        session.tracking = None
+        return OK
+    if mode != "ON" or len(args) != 5 or args[3].upper() != "REDIRECT":
+        return Error("ERROR: Syntax is CLIENT TRACKING ON REDIRECT <id> | CLIENT TRACKING OFF "
+                     "(invalidations are pushed to the connection with that CLIENT ID)")
+    try:
+        target = int(args[4])
+    except ValueError:
+        return Error("ERROR: Invalid client id")
+    if target not in store.tracking.connections:
+        return Error("ERROR: The client ID to redirect to does not exist")
+    session.tracking = target
+    if store.clients is not None and target in store.clients.clients:
+        # It only receives pushes, so it must not be closed for being idle
+        store.clients.clients[target].redirect_target = True
+    return OK
+
+async def exec_transaction(store, queue, watch=None):
+    """
+    Runs queued commands as one critical section and returns their replies,
+    or None without running anything if a watched key was modified.
+    """
+    keys = [key for args in queue for key in command_keys(args)]
+    async with store.transaction(keys) as tx:
+        if watch is not None and watch.dirty:
+            return None
+        replies = []
+        for args in queue:
+            try:
+                replies.append(await COMMANDS[args[0].upper()][0](tx, args))
+            except OutOfMemoryError as e:
+                replies.append(Error(str(e)))
+        return replies
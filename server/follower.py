@@ -1,6 +1,7 @@
 import sys
 import os
 import asyncio
+import argparse
 import datetime
 import time
 
@@ -8,97 +9,320 @@ import time
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from core.store import LRUCache
+from core.eviction import parse_memory
+from core.protocol import (
+    RequestParser, ProtocolError, Error, OK, encode_command, encode_reply, encode_inline_reply,
+)
+from server import commands, prometheus
+from persistence.aof_format import AOFCorruptionError
+from persistence.aof_logger import AOFLogger
+from persistence.manager import SnapshotError
+from persistence.segment_store import SegmentStore
+from persistence.hotset import HotSetCheckpoint
 
-async def compaction_housekeeper(follower_store, interval=30):
+async def compaction_housekeeper(follower_store, interval=1):
     """
-    Background Task: Periodically cleans the follower_appendonly.aof file.
+    Background Task: Rewrites the follower_appendonly.aof file once it has grown enough.
     """
     while True:
         await asyncio.sleep(interval)
+        if not follower_store.aof.should_rewrite():
+            continue
         now = datetime.datetime.now().strftime("%H:%M:%S")
         print(f"[Follower Housekeeper {now}] Triggering Compaction...")
         try:
-            # Compaction will now skip expired keys because the follower 
-            # now tracks expiries locally.
+            # Compaction skips expired keys the leader's DEL hasn't reached yet
             await follower_store.aof.trigger_compaction(follower_store)
         except Exception as e:
             print(f"[Follower] Compaction error: {e}")
 
-async def run_follower(leader_ip='127.0.0.1', leader_port=8889):
-    # 1. Initialize Follower Store
-    follower_store = LRUCache(capacity=5) 
-    follower_store.aof.filepath = "persistence/follower_appendonly.aof"
-    
-    # Start the TTL cleanup task on the follower so it can delete keys locally
-    asyncio.create_task(follower_store.cleanup_expired_keys())
-    
-    # 2. Start independent compaction for the follower's log
-    asyncio.create_task(compaction_housekeeper(follower_store, interval=30))
-    
-    print(f"[Follower] Connecting to Leader at {leader_ip}:{leader_port}...")
-    
+async def receive_full_sync(follower_store, reader, state):
+    """
+    Streams the leader's snapshot ($<size>\r\n<bytes>) to disk and loads it
+    as the new dataset. Clients get LOADING errors while it is applied.
+    """
+    header = await reader.readline()
+    if not header.startswith(b"$"):
+        raise ConnectionError(f"Unexpected full sync header: {header!r}")
+    remaining = int(header[1:])
+    path = f"{follower_store.aof.filepath}.sync"
     try:
-        reader, writer = await asyncio.open_connection(leader_ip, leader_port)
-        
-        # Handshake
-        writer.write(b"REPLICATE\n")
+        with open(path, "wb") as f:
+            while remaining:
+                chunk = await reader.read(min(remaining, 64 * 1024))
+                if not chunk:
+                    raise ConnectionError("Leader disconnected during full sync")
+                f.write(chunk)
+                remaining -= len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        state["loading"] = True
+        try:
+            count = await follower_store.load_snapshot_file(path)
+        finally:
+            state["loading"] = False
+        print(f"[Follower] Full sync complete: loaded {count} keys.")
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+async def sync_with_leader(follower_store, leader_ip, leader_port, state):
+    """
+    One replication session: PSYNC handshake, then apply the stream until the
+    leader disconnects. `state` keeps the replid and offset across sessions.
+    """
+    reader, writer = await asyncio.open_connection(leader_ip, leader_port)
+    ack_task = None
+    try:
+        # Handshake: ask to resume where we stopped ("? -1" forces a full sync)
+        writer.write(encode_command("PSYNC", state["replid"], state["offset"]))
         await writer.drain()
-        
-        response = await reader.read(1024)
-        if response.decode().strip() == "ACK_REPLICATION":
-            print("[Follower] Replication Link Established. Mirroring all Leader data.")
 
+        response = (await reader.readline()).decode().strip()
+        if response.startswith("+FULLRESYNC"):
+            _, replid, offset = response.split()
+            await receive_full_sync(follower_store, reader, state)
+            state["replid"], state["offset"] = replid, int(offset)
+        elif response.startswith("+CONTINUE"):
+            print(f"[Follower] Partial resync from offset {state['offset']}.")
+        else:
+            raise ConnectionError(f"Leader refused replication: {response}")
+        print("[Follower] Replication Link Established. Mirroring all Leader data.")
+        state["link"] = "up"
+        ack_task = asyncio.create_task(send_acks(writer, state))
+
+        # The leader streams RESP-framed commands; one read may carry many of them.
+        # The offset only counts fully applied commands, so it never points
+        # inside a MULTI ... EXEC block.
+        parser = RequestParser()
+        base, received = state["offset"], 0
+        transaction = None  # Commands of a MULTI block until its EXEC arrives
+        applied = base
         while True:
-            data = await reader.read(1024)
+            data = await reader.read(64 * 1024)
             if not data:
                 print("[Follower] Leader disconnected.")
-                break
-            
-            command_str = data.decode().strip()
-            # Handle potential multiple commands in one buffer
-            for line in command_str.split('\n'):
-                if not line: continue
-                
-                parts = line.split()
-                cmd = parts[0].upper()
-                
-                # --- SYNC SET with TTL Support ---
-                if cmd == "SET" and len(parts) >= 3:
-                    key = parts[1]
-                    ttl = None
-                    parts_upper = [p.upper() for p in parts]
-                    
-                    if "EX" in parts_upper:
-                        try:
-                            ex_idx = parts_upper.index("EX")
-                            ttl = int(parts[ex_idx + 1])
-                            value = " ".join(parts[2:ex_idx])
-                        except (ValueError, IndexError):
-                            value = " ".join(parts[2:])
+                return
+
+            parser.feed(data)
+            received += len(data)
+            async with follower_store.aof.deferred_durability():
+                for args, _ in parser:
+                    cmd = args[0].upper()
+                    if cmd == "MULTI":
+                        transaction = []
+                    elif cmd == "EXEC":
+                        # Applied as one critical section, as it was on the leader
+                        replies = await commands.exec_transaction(follower_store, transaction or [])
+                        for queued, reply in zip(transaction or [], replies):
+                            if isinstance(reply, Error):
+                                print(f"[Follower] Failed to apply {queued[0]}: {reply}")
+                        print(f"[Follower] Synced MULTI/EXEC of {len(replies)} commands")
+                        transaction = None
+                    elif cmd not in commands.WRITE_COMMANDS:
+                        if cmd == "PING":
+                            # Leader heartbeat: everything before it in the stream is applied
+                            state["last_heartbeat"] = time.monotonic()
+                    elif transaction is not None:
+                        transaction.append(args)
                     else:
-                        value = " ".join(parts[2:])
-
-                    await follower_store.set(key, value, ttl)
-                    print(f"[Follower] Synced SET: {key} (TTL: {ttl if ttl else 'None'})")
-                
-                # --- SYNC DEL ---
-                elif cmd == "DEL" and len(parts) == 2:
-                    await follower_store.delete(parts[1])
-                    print(f"[Follower] Synced DEL: {parts[1]}")
-                
-                # --- SYNC INCR ---
-                elif cmd == "INCR" and len(parts) == 2:
-                    await follower_store.increment(parts[1])
-                    print(f"[Follower] Synced INCR: {parts[1]}")
+                        reply = await commands.execute(follower_store, args)
+                        if isinstance(reply, Error):
+                            print(f"[Follower] Failed to apply {cmd}: {reply}")
+                        else:
+                            print(f"[Follower] Synced {cmd}: {args[1]}")
+                    if transaction is None:
+                        applied = base + received - parser.buffered()
+            state["offset"] = applied
+    finally:
+        state["link"] = "down"
+        if ack_task is not None:
+            ack_task.cancel()
+        writer.close()
+
+async def send_acks(writer, state, interval=1.0):
+    """Reports the applied offset so the leader can track this follower's lag."""
+    while True:
+        writer.write(encode_command("REPLCONF", "ACK", state["offset"]))
+        await writer.drain()
+        await asyncio.sleep(interval)
 
+def replication_lag(state):
+    """Seconds since the last leader heartbeat was applied (infinite before the first one)."""
+    if state["last_heartbeat"] is None:
+        return float("inf")
+    return time.monotonic() - state["last_heartbeat"]
+
+def follower_info(state):
+    lag = replication_lag(state)
+    leader_host, leader_port = state["leader"]
+    return (
+        f"role: follower\n"
+        f"leader_host: {leader_host}\n"
+        f"leader_port: {leader_port}\n"
+        f"leader_link_status: {state['link']}\n"
+        f"sync_in_progress: {int(state['loading'])}\n"
+        f"repl_offset: {state['offset']}\n"
+        f"repl_lag_seconds: {-1 if lag == float('inf') else round(lag, 3)}"
+    )
+
+async def execute_read_only(follower_store, state, args, max_lag):
+    """
+    Runs one client command against the local copy. Writes are refused with
+    a READONLY error naming the leader, and reads with a STALE error when the
+    connection's MAXLAG bound is exceeded.
+    """
+    name = args[0].upper()
+    if name in commands.WRITE_COMMANDS or name in ("PSYNC", "REPLICATE"):
+        leader_host, leader_port = state["leader"]
+        return Error(f"ERROR: READONLY {leader_host}:{leader_port} Writes must be sent to the leader")
+    if name == "MAXLAG":
+        return await commands.execute(follower_store, args)
+    if state["loading"] and name != "INFO":
+        return Error("ERROR: LOADING The dataset is being replaced by a full sync from the leader")
+    if max_lag is not None:
+        lag = replication_lag(state)
+        if lag > max_lag:
+            return Error(f"ERROR: STALE Replication lag {lag:.1f}s exceeds MAXLAG {max_lag:g}s")
+
+    reply = await commands.execute(follower_store, args)
+    section = args[1].lower() if name == "INFO" and len(args) > 1 else "all"
+    if name == "INFO" and not isinstance(reply, Error) and section in ("all", "replication"):
+        reply = f"{reply}\n\n# Replication\n{follower_info(state)}".lstrip()
+    return reply
+
+async def handle_client(reader, writer, follower_store, state):
+    """
+    Serves clients from the follower's copy of the dataset with the same
+    protocol as the leader. `MAXLAG <seconds>` sets how stale the reads on
+    this connection may be (0 = no bound).
+    """
+    address = writer.get_extra_info('peername')
+    print(f"[Follower] New client connection from {address}")
+    parser = RequestParser()
+    max_lag = None
+
+    try:
+        while data := await reader.read(64 * 1024):
+            parser.feed(data)
+            replies = []
+            try:
+                for args, inline in parser:
+                    reply = await execute_read_only(follower_store, state, args, max_lag)
+                    if args[0].upper() == "MAXLAG" and reply is OK:
+                        max_lag = commands.parse_max_lag(args)
+                    replies.append(encode_inline_reply(reply) if inline else encode_reply(reply))
+            except ProtocolError as e:
+                replies.append(encode_reply(Error(f"ERROR: Protocol error: {e}")))
+                writer.write(b"".join(replies))
+                await writer.drain()
+                break
+            if replies:
+                writer.write(b"".join(replies))
+                await writer.drain()
     except Exception as e:
-        print(f"[Follower] Connection Error: {e}")
+        print(f"[Follower] Error handling {address}: {e}")
     finally:
         writer.close()
-        await writer.wait_closed()
+
+async def run_follower(leader_ip='127.0.0.1', leader_port=8889, host='127.0.0.1', port=8890,
+                       aof_path="persistence/follower_appendonly.aof", max_reconnect_delay=10.0,
+                       metrics_port=0, ordered_index=False, tiered_dir="", compression_threshold=0,
+                       hot_set_checkpoint_interval=60, capacity=5, num_shards=16):
+    # 1. Initialize Follower Store
+    segments = SegmentStore(tiered_dir) if tiered_dir else None
+    hot_set = None
+    if hot_set_checkpoint_interval > 0:
+        hot_set = HotSetCheckpoint(f"{os.path.splitext(aof_path)[0]}.hotset")
+    # No active expiry: keys are only deleted when the leader's DEL arrives,
+    # so the follower can't diverge. Reads hide expired keys until then.
+    follower_store = LRUCache(capacity=capacity, aof=AOFLogger(filepath=aof_path), num_shards=num_shards,
+                              ordered_index=ordered_index, segments=segments,
+                              compression_threshold=compression_threshold, hot_set=hot_set,
+                              expire_keys=False)
+
+    if segments is not None:
+        asyncio.create_task(follower_store.merge_segments())
+    if hot_set is not None:
+        asyncio.create_task(follower_store.warm_up())
+        asyncio.create_task(follower_store.checkpoint_hot_set_periodically(hot_set_checkpoint_interval))
+    
+    # 2. Start independent compaction for the follower's log
+    asyncio.create_task(compaction_housekeeper(follower_store))
+
+    # 3. Serve read-only clients
+    state = {"replid": "?", "offset": -1, "leader": (leader_ip, leader_port),
+             "link": "down", "last_heartbeat": None, "loading": False}
+    server = await asyncio.start_server(
+        lambda r, w: handle_client(r, w, follower_store, state), host, port)
+    print(f"[Follower] Serving reads on {server.sockets[0].getsockname()}")
+    metrics_server = None
+    if metrics_port:
+        metrics_server = await prometheus.start_listener(
+            host, metrics_port, lambda: prometheus.render(follower_store, follower_state=state))
+
+    # 4. Replicate forever, reconnecting with exponential backoff
+    delay = 0.5
+    try:
+        while True:
+            print(f"[Follower] Connecting to Leader at {leader_ip}:{leader_port}...")
+            offset_before = state["offset"]
+            try:
+                await sync_with_leader(follower_store, leader_ip, leader_port, state)
+            except (OSError, ConnectionError, ValueError) as e:
+                print(f"[Follower] Connection Error: {e}")
+            except (SnapshotError, AOFCorruptionError, ProtocolError) as e:
+                # What was received can't be trusted, nor can the offset it led to
+                print(f"[Follower] Replication Error: {e}; forcing a full resync.")
+                state["replid"], state["offset"] = "?", -1
+            # A session that made progress resets the backoff
+            delay = 0.5 if state["offset"] != offset_before else min(delay * 2, max_reconnect_delay)
+            print(f"[Follower] Reconnecting in {delay:.1f}s...")
+            await asyncio.sleep(delay)
+    finally:
+        server.close()
+        if metrics_server is not None:
+            metrics_server.close()
+        if hot_set is not None:
+            try:
+                await follower_store.checkpoint_hot_set()
+            except OSError as e:
+                print(f"[Follower] Hot-set checkpoint failed: {e}")
+        await follower_store.aof.close()
+        if segments is not None:
+            segments.close()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="PyKV read-only follower")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to serve read-only clients on")
+    parser.add_argument("--port", type=int, default=8890)
+    parser.add_argument("--leader-host", default="127.0.0.1")
+    parser.add_argument("--leader-port", type=int, default=8889)
+    parser.add_argument("--aof-path", default="persistence/follower_appendonly.aof")
+    parser.add_argument("--capacity", type=int, default=5, help="Hot cache capacity")
+    parser.add_argument("--shards", type=int, default=16,
+                        help="Number of independently locked keyspace shards")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="Serve Prometheus metrics over HTTP on this port (0 = off)")
+    parser.add_argument("--ordered-index", action="store_true",
+                        help="Keep keys sorted so SCAN MATCH prefix* and KEYRANGE cost O(log n + k)")
+    parser.add_argument("--tiered-dir", default="",
+                        help="Spill cold values to segment files in this directory (empty = all in memory)")
+    parser.add_argument("--compression-threshold", type=parse_memory, default=0,
+                        help="Keep values of at least this many bytes zlib-compressed, e.g. 1kb (0 = off)")
+    parser.add_argument("--hot-set-checkpoint-interval", type=float, default=60,
+                        help="Seconds between checkpoints of the hot tier's keys, prewarmed on the next "
+                             "start (0 = off)")
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
+    args = parse_args()
     try:
-        asyncio.run(run_follower(leader_port=8889))
+        asyncio.run(run_follower(args.leader_host, args.leader_port, args.host, args.port,
+                                 args.aof_path, metrics_port=args.metrics_port,
+                                 ordered_index=args.ordered_index, tiered_dir=args.tiered_dir,
+                                 compression_threshold=args.compression_threshold,
+                                 hot_set_checkpoint_interval=args.hot_set_checkpoint_interval,
+                                 capacity=args.capacity, num_shards=args.shards))
     except KeyboardInterrupt:
-        print("\n[Follower] Shutting down.")
\ No newline at end of file
+        print("\n[Follower] Shutting down.")
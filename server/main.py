@@ -1,147 +1,331 @@
 import sys
 import os
 import asyncio
+import argparse
 import datetime
+import itertools
+import multiprocessing
+import time
 
 # Ensure project root is in the path for core and persistence imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from core.store import LRUCache
+from core.eviction import EVICTION_POLICIES, parse_memory
+from core.hot_cache import HOT_CACHE_POLICIES
+from core.metrics import SlowLog
+from core.protocol import RequestParser, ProtocolError, Error, encode_reply, encode_inline_reply
+from server import commands, prometheus
+from server.workers import WorkerCluster, worker_aof_path
+from server.replication import ReplicationLeader
+from server.tracking import TrackingTable
+from server.clients import ClientRegistry
+from persistence.aof_logger import AOFLogger, FSYNC_POLICIES
+from persistence.segment_store import SegmentStore
+from persistence.hotset import HotSetCheckpoint
 
-# Initialize the store
-store = LRUCache(capacity=5)
+# The store is initialized in main() once the command line has been parsed
+store = None
 
-# List to keep track of active follower connections
-connected_followers = []
+# Set in each worker process when running with --workers N
+cluster = None
 
-async def broadcast_to_followers(command_str):
-    """
-    Sends write commands to all connected followers for replication.
-    """
-    if not connected_followers:
-        return
+# Bytes requested per socket read; a read may hold many pipelined commands
+READ_CHUNK_SIZE = 64 * 1024
 
-    msg = f"{command_str}\n".encode()
-    for writer in connected_followers[:]:  # Iterate over a copy to safely remove disconnected ones
-        try:
-            writer.write(msg)
-            await writer.drain()
-        except Exception:
-            print(f"[Replication] Follower disconnected.")
-            connected_followers.remove(writer)
+# Replication stream, backlog and follower links (single-process mode only)
+replication = None
+
+# Keys read by CLIENT TRACKING connections (single-process mode only)
+tracking = None
+
+# Open client connections and their limits (set in main())
+clients = None
+
+# CLIENT ID of each new connection
+client_ids = itertools.count(1)
+
+def parse_psync(args):
+    """(replid, offset) of a PSYNC or REPLICATE handshake, or an Error if it is malformed."""
+    if args[0].upper() == "REPLICATE" and len(args) == 1:
+        return "?", -1
+    if args[0].upper() != "PSYNC" or len(args) != 3:
+        return Error("ERROR: Syntax is PSYNC <replid> <offset>")
+    try:
+        offset = int(args[2])
+    except ValueError:
+        return Error("ERROR: Invalid PSYNC offset")
+    if offset < -1:
+        return Error("ERROR: Invalid PSYNC offset")
+    return args[1], offset
 
 async def handle_client(reader, writer):
     """
     Handles both User Clients and Replication Followers.
+    Every read may carry any number of pipelined commands (RESP or inline);
+    their replies are flushed back with a single write. The connection is
+    registered in `clients`, which enforces --maxclients, --timeout and the
+    buffer limits.
     """
     address = writer.get_extra_info('peername')
+    parser = RequestParser()
+    client = clients.accept(next(client_ids), writer, parser)
+    if client is None:
+        print(f"[Server] Refusing connection from {address}: max number of clients reached")
+        writer.write(encode_reply(Error("ERROR: max number of clients reached")))
+        writer.close()
+        return
     print(f"[Server] New connection from {address}")
+    session = client.session = commands.Session(client.id)
+    if tracking is not None:
+        tracking.connect(session.client_id, writer)
 
     try:
-        while True:
-            data = await reader.read(1024)
+        while not client.killed:
+            data = await reader.read(READ_CHUNK_SIZE)
             if not data:
                 break
+            client.last_interaction = time.monotonic()
+            parser.feed(data)
+
+            replies = []
+            psync = protocol_error = None
+            try:
+                # Writes in one pipelined batch share a single AOF group commit
+                async with store.aof.deferred_durability():
+                    for args, inline in parser:
+                        command = args[0].upper()
+                        client.commands += 1
+                        client.last_command = command.lower()
 
-            message = data.decode().strip()
-            parts = message.split()
-            if not parts:
-                continue
+                        # --- REPLICATION HANDSHAKE ---
+                        # PSYNC <replid> <offset> ("PSYNC ? -1" or bare REPLICATE asks for a full sync)
+                        if command in ("PSYNC", "REPLICATE") and cluster is not None:
+                            replies.append(encode_reply(Error("ERROR: Replication is not supported with --workers")))
+                            continue
+                        if command in ("PSYNC", "REPLICATE"):
+                            psync = parse_psync(args)
+                            if isinstance(psync, Error):
+                                replies.append(encode_reply(psync))
+                                psync = None
+                                continue
+                            print(f"[Replication] Node at {address} is now a Follower.")
+                            break
 
-            command = parts[0].upper()
-            response = "ERROR: Unknown Command"
+                        if command in commands.SESSION_COMMANDS and cluster is not None:
+                            replies.append(encode_reply(Error("ERROR: Transactions are not supported with --workers")))
+                            continue
+                        if (command == "CLIENT" and cluster is not None and len(args) > 1
+                                and args[1].upper() == "TRACKING"):
+                            replies.append(encode_reply(Error("ERROR: Client tracking is not supported with --workers")))
+                            continue
 
-            # --- REPLICATION HANDSHAKE ---
-            if command == "REPLICATE":
-                print(f"[Replication] Node at {address} is now a Follower.")
-                connected_followers.append(writer)
-                writer.write(b"ACK_REPLICATION\n")
+                        # --- STANDARD COMMANDS ---
+                        if cluster is not None and command != "CLIENT":
+                            # Forwarded commands are awaited together after the batch is sent
+                            forwarded = cluster.forward_nowait(args)
+                            if forwarded is not None:
+                                replies.append((forwarded, inline))
+                                continue
+                            reply = await cluster.execute(args)
+                        else:
+                            reply = await commands.execute_in_session(store, session, args)
+                        replies.append(encode_inline_reply(reply) if inline else encode_reply(reply))
+            except ProtocolError as e:
+                # Replies to the commands parsed before the bad one still go out first
+                protocol_error = Error(f"ERROR: Protocol error: {e}")
+
+            for i, pending in enumerate(replies):
+                if isinstance(pending, tuple):
+                    reply, inline = await pending[0], pending[1]
+                    replies[i] = encode_inline_reply(reply) if inline else encode_reply(reply)
+            if protocol_error is not None:
+                replies.append(encode_reply(protocol_error))
+
+            # Send all responses for this read back to the client at once
+            if replies:
+                writer.write(b"".join(replies))
+                # Whatever the socket didn't take counts against the output buffer limits
+                if not clients.check_output(client):
+                    break
                 await writer.drain()
-                return  # Stay connected as a broadcast target, stop parsing commands here
-
-            # --- STANDARD COMMANDS ---
-            
-            # 1. SET <key> <value> [EX <seconds>]
-            if command == "SET" and len(parts) >= 3:
-                key = parts[1]
-                ttl = None
-                parts_upper = [p.upper() for p in parts]
-                
-                if "EX" in parts_upper:
-                    try:
-                        ex_index = parts_upper.index("EX")
-                        ttl = int(parts[ex_index + 1])
-                        # Value is everything between the key and the EX flag
-                        value = " ".join(parts[2:ex_index])
-                    except (ValueError, IndexError):
-                        # Fallback if EX is present but malformed
-                        value = " ".join(parts[2:])
-                else:
-                    value = " ".join(parts[2:])
-
-                await store.set(key, value, ttl)
-                await broadcast_to_followers(message) # Broadcast full command string to followers
-                response = "OK"
-
-            # 2. GET <key>
-            elif command == "GET" and len(parts) == 2:
-                key = parts[1]
-                val = await store.get(key)
-                # If key is expired or missing, store.get returns None
-                response = val if val is not None else "(nil)"
-
-            # 3. INCR <key>
-            elif command == "INCR" and len(parts) == 2:
-                key = parts[1]
-                result = await store.increment(key)
-                await broadcast_to_followers(message)
-                response = str(result)
-
-            # 4. INFO (Internal Statistics)
-            elif command == "INFO":
-                response = store.get_info()
-
-            # 5. DEL <key>
-            elif command == "DEL" and len(parts) == 2:
-                key = parts[1]
-                success = await store.delete(key)
-                if success:
-                    await broadcast_to_followers(message)
-                response = "OK" if success else "(nil)"
-
-            # Send response back to the client
-            writer.write(f"{response}\n".encode())
-            await writer.drain()
+            if protocol_error is not None or not clients.check_query_buffer(client):
+                break
+            if psync:
+                # From here on this connection only carries the replication stream
+                client.follower = True
+                link = await replication.attach(writer, *psync)
+                await replication.serve(reader, link)
+                break
 
     except Exception as e:
-        print(f"[Server] Error handling {address}: {e}")
+        if not client.killed:
+            print(f"[Server] Error handling {address}: {e}")
     finally:
-        if writer not in connected_followers:
-            print(f"[Server] Closing connection from {address}")
-            writer.close()
+        session.close(store)
+        clients.remove(client)
+        if tracking is not None:
+            tracking.disconnect(session.client_id)
+        print(f"[Server] Closing connection from {address}")
+        writer.close()
+        try:
             await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
 
-async def compaction_housekeeper(interval=30):
+async def compaction_housekeeper(interval=1):
     """
-    Background Task: Periodically triggers AOF compaction to optimize file size.
+    Background Task: Triggers an AOF rewrite once the file has outgrown
+    the --aof-rewrite-percentage / --aof-rewrite-min-size thresholds.
     """
     while True:
         await asyncio.sleep(interval)
+        if not store.aof.should_rewrite():
+            continue
         now = datetime.datetime.now().strftime("%H:%M:%S")
-        print(f"[{now}] Housekeeper: Triggering AOF Compaction...")
+        print(f"[{now}] Housekeeper: AOF grew to {store.aof.current_size} bytes, triggering compaction...")
         try:
             await store.aof.trigger_compaction(store)
         except Exception as e:
             print(f"[Server] Compaction error: {e}")
 
-async def main():
-    server = await asyncio.start_server(handle_client, '127.0.0.1', 8889)
-    addr = server.sockets[0].getsockname()
-    print(f"[Server] PyKV LEADER ACTIVE on {addr}")
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="PyKV leader server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8889)
+    parser.add_argument("--capacity", type=int, default=5, help="Hot cache capacity")
+    parser.add_argument("--hot-cache-policy", choices=HOT_CACHE_POLICIES, default="lru",
+                        help="Which keys the hot cache keeps (slru and w-tinylfu resist scans)")
+    parser.add_argument("--ordered-index", action="store_true",
+                        help="Keep keys sorted so SCAN MATCH prefix* and KEYRANGE cost O(log n + k)")
+    parser.add_argument("--shards", type=int, default=16,
+                        help="Number of independently locked keyspace shards")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes sharing the port, each owning a slice of the keyspace")
+    parser.add_argument("--aof-path", default="persistence/appendonly.aof",
+                        help="AOF file (with --workers, worker i uses <name>.<i>.aof)")
+    parser.add_argument("--appendfsync", choices=FSYNC_POLICIES, default="everysec",
+                        help="AOF fsync policy (always / everysec / no)")
+    parser.add_argument("--aof-batch-size", type=int, default=512,
+                        help="Maximum commands per AOF group commit")
+    parser.add_argument("--aof-batch-delay", type=float, default=0.0,
+                        help="Seconds to wait for more commands before writing a batch")
+    parser.add_argument("--aof-rewrite-percentage", type=int, default=100,
+                        help="Rewrite the AOF once it grows by this percentage since the last rewrite (0 disables)")
+    parser.add_argument("--aof-rewrite-min-size", type=int, default=64 * 1024 * 1024,
+                        help="Minimum AOF size in bytes before an automatic rewrite")
+    parser.add_argument("--maxmemory", type=parse_memory, default=0,
+                        help="Memory limit for the dataset, e.g. 512mb (0 = unlimited; split across --workers)")
+    parser.add_argument("--repl-backlog-size", type=parse_memory, default=1024 * 1024,
+                        help="Bytes of recent writes kept for follower partial resyncs, e.g. 1mb")
+    parser.add_argument("--repl-buffer-hard-limit", type=parse_memory, default=256 * 1024 * 1024,
+                        help="Drop a follower whose output buffer exceeds this many bytes (0 = no limit)")
+    parser.add_argument("--repl-buffer-soft-limit", type=parse_memory, default=64 * 1024 * 1024,
+                        help="Drop a follower whose output buffer stays above this size ...")
+    parser.add_argument("--repl-buffer-soft-seconds", type=float, default=60,
+                        help="... for longer than this many seconds")
+    parser.add_argument("--repl-ping-interval", type=float, default=1.0,
+                        help="Seconds between heartbeats sent to followers (bounds their reported lag)")
+    parser.add_argument("--maxclients", type=int, default=10000,
+                        help="Refuse connections beyond this many open clients (per worker with --workers; 0 = no limit)")
+    parser.add_argument("--timeout", type=float, default=0,
+                        help="Close client connections idle for this many seconds (0 = never)")
+    parser.add_argument("--client-query-buffer-limit", type=parse_memory, default=1024 * 1024 * 1024,
+                        help="Close a client whose unparsed request data exceeds this, e.g. 1gb (0 = no limit)")
+    parser.add_argument("--client-output-buffer-hard-limit", type=parse_memory, default=256 * 1024 * 1024,
+                        help="Close a client whose unread replies exceed this many bytes (0 = no limit)")
+    parser.add_argument("--client-output-buffer-soft-limit", type=parse_memory, default=64 * 1024 * 1024,
+                        help="Close a client whose unread replies stay above this size ...")
+    parser.add_argument("--client-output-buffer-soft-seconds", type=float, default=60,
+                        help="... for longer than this many seconds")
+    parser.add_argument("--tracking-table-max-keys", type=int, default=1_000_000,
+                        help="Keys remembered for CLIENT TRACKING before the oldest are invalidated early")
+    parser.add_argument("--hot-set-checkpoint-interval", type=float, default=60,
+                        help="Seconds between checkpoints of the hot tier's keys (next to the AOF, as "
+                             "<name>.hotset), prewarmed on the next start; 0 disables warm restarts")
+    parser.add_argument("--tiered-dir", default="",
+                        help="Spill cold values to segment files in this directory (with --workers, "
+                             "worker i uses <dir>/<i>); empty keeps every value in memory")
+    parser.add_argument("--segment-size", type=parse_memory, default=64 * 1024 * 1024,
+                        help="Size at which a segment file is sealed, e.g. 64mb")
+    parser.add_argument("--tiered-min-value-size", type=int, default=64,
+                        help="Values shorter than this many bytes stay in memory")
+    parser.add_argument("--compression-threshold", type=parse_memory, default=0,
+                        help="Keep values of at least this many bytes zlib-compressed, e.g. 1kb (0 = off)")
+    parser.add_argument("--maxmemory-policy", choices=EVICTION_POLICIES, default="noeviction",
+                        help="What to do when --maxmemory is reached")
+    parser.add_argument("--slowlog-log-slower-than", type=int, default=10000,
+                        help="Log commands that take at least this many microseconds (0 = all, -1 = none)")
+    parser.add_argument("--slowlog-max-len", type=int, default=128, help="Entries kept in the slow log")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="Serve Prometheus metrics over HTTP on this port (worker i uses port + i; 0 = off)")
+    return parser.parse_args(argv)
+
+async def main(args=None, worker_id=None):
+    global store, cluster, replication, tracking, clients
+    args = args or parse_args()
+    aof_path = args.aof_path if worker_id is None else worker_aof_path(args.aof_path, worker_id)
+    aof = AOFLogger(filepath=aof_path, fsync_policy=args.appendfsync,
+                    max_batch_size=args.aof_batch_size, max_batch_delay=args.aof_batch_delay,
+                    rewrite_percentage=args.aof_rewrite_percentage,
+                    rewrite_min_size=args.aof_rewrite_min_size)
+    # Each worker replays only its own AOF, so startup recovery runs in parallel
+    maxmemory = args.maxmemory if worker_id is None else args.maxmemory // args.workers
+    segments = None
+    if args.tiered_dir:
+        tiered_dir = args.tiered_dir if worker_id is None else os.path.join(args.tiered_dir, str(worker_id))
+        segments = SegmentStore(tiered_dir, max_segment_size=args.segment_size,
+                                min_value_size=args.tiered_min_value_size)
+    hot_set = None
+    if args.hot_set_checkpoint_interval > 0:
+        hot_set = HotSetCheckpoint(f"{os.path.splitext(aof_path)[0]}.hotset")
+    store = LRUCache(capacity=args.capacity, aof=aof, num_shards=args.shards,
+                     maxmemory=maxmemory, maxmemory_policy=args.maxmemory_policy,
+                     hot_cache_policy=args.hot_cache_policy, ordered_index=args.ordered_index,
+                     segments=segments, compression_threshold=args.compression_threshold,
+                     hot_set=hot_set)
+    store.metrics.slowlog = SlowLog(args.slowlog_log_slower_than, args.slowlog_max_len)
+    clients = ClientRegistry(max_clients=args.maxclients, idle_timeout=args.timeout,
+                             query_buffer_limit=args.client_query_buffer_limit,
+                             output_limits=(args.client_output_buffer_hard_limit,
+                                            args.client_output_buffer_soft_limit,
+                                            args.client_output_buffer_soft_seconds))
+    store.clients = clients
+
+    if worker_id is None:
+        replication = ReplicationLeader(
+            store, backlog_size=args.repl_backlog_size,
+            output_limits=(args.repl_buffer_hard_limit, args.repl_buffer_soft_limit,
+                           args.repl_buffer_soft_seconds))
+        tracking = TrackingTable(max_keys=args.tracking_table_max_keys)
+        store.tracking = tracking
+        server = await asyncio.start_server(handle_client, args.host, args.port)
+        addr = server.sockets[0].getsockname()
+        print(f"[Server] PyKV LEADER ACTIVE on {addr}")
+    else:
+        cluster = WorkerCluster(worker_id, args.workers, args.port)
+        await cluster.start(store)
+        # SO_REUSEPORT lets the kernel spread incoming connections across workers
+        server = await asyncio.start_server(handle_client, args.host, args.port, reuse_port=True)
+        addr = server.sockets[0].getsockname()
+        print(f"[Server] PyKV worker {worker_id}/{args.workers} ACTIVE on {addr} (pid {os.getpid()})")
+
+    metrics_server = None
+    if args.metrics_port:
+        metrics_server = await prometheus.start_listener(
+            args.host, args.metrics_port + (worker_id or 0), lambda: prometheus.render(store))
 
     # 1. Start background tasks and keep a reference to them
     cleanup_task = asyncio.create_task(store.cleanup_expired_keys())
-    compaction_task = asyncio.create_task(compaction_housekeeper(interval=30))
+    compaction_task = asyncio.create_task(compaction_housekeeper())
+    tasks = [cleanup_task, compaction_task, asyncio.create_task(clients.reaper())]
+    if segments is not None:
+        tasks.append(asyncio.create_task(store.merge_segments()))
+    if hot_set is not None:
+        tasks.append(asyncio.create_task(store.warm_up()))
+        tasks.append(asyncio.create_task(store.checkpoint_hot_set_periodically(args.hot_set_checkpoint_interval)))
+    if replication is not None:
+        tasks.append(asyncio.create_task(replication.heartbeat(args.repl_ping_interval)))
     
     try:
         async with server:
@@ -152,16 +336,57 @@ async def main():
     finally:
         # 2. PROPER CLEANUP: Tell background tasks to stop
         print("[Server] Stopping background tasks...")
-        cleanup_task.cancel()
-        compaction_task.cancel()
+        for task in tasks:
+            task.cancel()
         
         # 3. Wait a tiny bit for them to acknowledge the cancellation
-        await asyncio.gather(cleanup_task, compaction_task, return_exceptions=True)
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if metrics_server is not None:
+            metrics_server.close()
+        # 4. Record the hot set for the next start, then flush any AOF batches that are still queued
+        if hot_set is not None:
+            try:
+                count = await store.checkpoint_hot_set()
+                if count is not None:
+                    print(f"[Server] Hot-set checkpoint of {count} keys saved.")
+            except OSError as e:
+                print(f"[Server] Hot-set checkpoint failed: {e}")
+        await store.aof.close()
+        if segments is not None:
+            segments.close()
+        if cluster is not None:
+            await cluster.close()
         print("[Server] Cleanup complete.")
 
+def run_worker(worker_id, args):
+    try:
+        asyncio.run(main(args, worker_id))
+    except KeyboardInterrupt:
+        pass
+
+def run_workers(args):
+    """Starts one process per worker; each owns a disjoint slice of the keyspace."""
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(i, args), name=f"pykv-worker-{i}")
+        for i in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Ctrl+C reaches every worker in the process group; wait for their cleanup
+        for process in processes:
+            process.join()
+
 if __name__ == "__main__":
+    args = parse_args()
     try:
-        asyncio.run(main())
+        if args.workers > 1:
+            run_workers(args)
+        else:
+            asyncio.run(main(args))
     except KeyboardInterrupt:
         # This is now handled silently
-        pass
\ No newline at end of file
+        pass
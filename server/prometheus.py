@@ -0,0 +1,149 @@
+"""
+Prometheus text exposition (format 0.0.4) of a node's metrics, served by a
+minimal HTTP listener (`--metrics-port`). Every request gets the current
+metrics, whatever its path; it is rendered from the same counters and
+histograms as INFO, so scraping costs nothing until it happens.
+"""
+import asyncio
+import time
+
+from core.metrics import HISTOGRAM_BUCKETS
+
+PREFIX = "pykv"
+
+# Header lines read from a scrape request before giving up on it
+MAX_REQUEST_LINES = 100
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+class Exposition:
+    """Accumulates metric families; each family's HELP/TYPE is written once."""
+
+    def __init__(self):
+        self.lines = []
+        self._declared = set()
+
+    def _declare(self, name, kind, help_text):
+        if name not in self._declared:
+            self._declared.add(name)
+            self.lines.append(f"# HELP {name} {help_text}")
+            self.lines.append(f"# TYPE {name} {kind}")
+
+    def sample(self, name, kind, help_text, value, **labels):
+        name = f"{PREFIX}_{name}"
+        self._declare(name, kind, help_text)
+        self.lines.append(f"{name}{_labels(labels)} {value}")
+
+    def histogram(self, name, help_text, histogram, **labels):
+        """Converts a core.metrics.LatencyHistogram (µs buckets) into a seconds histogram."""
+        name = f"{PREFIX}_{name}_seconds"
+        self._declare(name, "histogram", help_text)
+        cumulative = 0
+        for i in range(HISTOGRAM_BUCKETS - 1):
+            cumulative += histogram.counts[i]
+            bucket = _labels({**labels, "le": f"{(1 << i) / 1e6:g}"})
+            self.lines.append(f"{name}_bucket{bucket} {cumulative}")
+        self.lines.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {histogram.count}")
+        self.lines.append(f"{name}_sum{_labels(labels)} {histogram.total:.6f}")
+        self.lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+    def text(self):
+        return "\n".join(self.lines) + "\n"
+
+# Internal histograms in store.metrics.histograms and their descriptions
+INTERNAL_HISTOGRAMS = {
+    "lock_wait": "Time spent waiting for a shard lock",
+    "aof_write": "AOF batch write and flush time",
+    "aof_fsync": "AOF fsync time",
+    "aof_rewrite": "Duration of completed AOF rewrites",
+    "expire_cycle": "Duration of active expiry cycles",
+    "full_sync": "Duration of full syncs sent to followers",
+}
+
+def render(store, follower_state=None):
+    """The exposition text for `store` (plus replication lag on a follower)."""
+    out = Exposition()
+    metrics = store.metrics
+    for name, histogram in sorted(metrics.commands.items()):
+        command = name.lower()
+        out.sample("commands_total", "counter", "Commands executed", histogram.count, command=command)
+        out.sample("command_failures_total", "counter", "Commands that returned an error",
+                   metrics.failed[name], command=command)
+    for name, histogram in sorted(metrics.commands.items()):
+        out.histogram("command_duration", "Command execution time", histogram, command=name.lower())
+    for name, histogram in sorted(metrics.histograms.items()):
+        out.histogram(name, INTERNAL_HISTOGRAMS.get(name, name.replace("_", " ")), histogram)
+
+    totals = store.totals()
+    out.sample("keys", "gauge", "Keys in the database", totals["keys_in_db"])
+    out.sample("keys_with_ttl", "gauge", "Keys with an expiry", totals["keys_with_ttl"])
+    out.sample("hot_cache_keys", "gauge", "Keys in the hot cache", totals["keys_in_hot_cache"])
+    out.sample("hot_cache_hits_total", "counter", "Reads served by the hot cache", totals["cache_hits"])
+    out.sample("hot_cache_misses_total", "counter", "Reads that missed the hot cache", totals["cache_misses"])
+    out.sample("expired_keys_total", "counter", "Keys removed because their TTL passed", totals["expired_keys"])
+    out.sample("evicted_keys_total", "counter", "Keys evicted by maxmemory", totals["evicted_keys"])
+    out.sample("used_memory_bytes", "gauge", "Estimated dataset size", totals["used_memory"])
+    out.sample("maxmemory_bytes", "gauge", "Configured memory limit (0 = unlimited)", store.maxmemory)
+    out.sample("slowlog_length", "gauge", "Entries in the slow log", len(metrics.slowlog.entries))
+    out.sample("aof_size_bytes", "gauge", "Current AOF size", store.aof.current_size)
+    out.sample("aof_fsyncs_total", "counter", "AOF fsyncs", store.aof.stats["fsyncs"])
+    out.sample("aof_rewrites_total", "counter", "Completed AOF rewrites", store.aof.stats["rewrites"])
+    if store.segments is not None:
+        segments = store.segments.totals()
+        out.sample("segment_files", "gauge", "Segment files in the disk tier", segments["segment_files"])
+        out.sample("segment_bytes", "gauge", "Bytes in segment files", segments["segment_bytes"])
+        out.sample("segment_live_bytes", "gauge", "Value bytes in segment files still referenced",
+                   segments["segment_live_bytes"])
+        out.sample("segment_reads_total", "counter", "Values read back from segment files",
+                   segments["segment_reads"])
+    out.sample("uptime_seconds", "gauge", "Seconds since the store started",
+               int(time.time() - store.stats["start_time"]))
+
+    leader = store.replication
+    if leader is not None:
+        out.sample("connected_followers", "gauge", "Followers attached", len(leader.followers))
+        out.sample("repl_offset_bytes", "counter", "Replication stream offset", leader.offset)
+        for link in leader.followers:
+            follower = "%s:%s" % link.address[:2]
+            if link.ack_offset is not None:
+                out.sample("follower_lag_bytes", "gauge", "Stream bytes a follower has not acknowledged",
+                           leader.offset - link.ack_offset, follower=follower)
+            out.sample("follower_output_buffer_bytes", "gauge", "Bytes queued for a follower",
+                       link.output_size(), follower=follower)
+    if follower_state is not None:
+        from server.follower import replication_lag
+        lag = replication_lag(follower_state)
+        out.sample("repl_link_up", "gauge", "1 while connected to the leader",
+                   int(follower_state["link"] == "up"))
+        out.sample("repl_offset_bytes", "counter", "Replication stream offset applied", follower_state["offset"])
+        out.sample("repl_lag_seconds", "gauge", "Seconds since the last heartbeat from the leader (-1 if none)",
+                   f"{lag:.3f}" if lag != float("inf") else -1)
+    return out.text()
+
+async def _serve_scrape(reader, writer, render_text):
+    try:
+        # Only the request line and headers matter; any request gets the metrics
+        for _ in range(MAX_REQUEST_LINES):
+            line = await reader.readline()
+            if not line.strip():
+                break
+        body = render_text().encode()
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                     b"Content-Length: %d\r\nConnection: close\r\n\r\n%s" % (len(body), body))
+        await writer.drain()
+    except (ConnectionError, OSError):
+        pass
+    finally:
+        writer.close()
+
+async def start_listener(host, port, render_text):
+    """Serves `render_text()` over HTTP on host:port; returns the asyncio server."""
+    server = await asyncio.start_server(lambda r, w: _serve_scrape(r, w, render_text), host, port)
+    print(f"[Metrics] Prometheus metrics on http://{host}:{port}/metrics")
+    return server
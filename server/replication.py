@@ -0,0 +1,254 @@
+"""
+Leader side of replication.
+
+Every record the store logs to its AOF is also appended, RESP-encoded, to
+the replication stream; a position in that stream is a replication offset.
+The leader keeps the most recent bytes in a bounded backlog so a follower
+that lost its connection can resume with `PSYNC <replid> <offset>`. New or
+far-behind followers get a full sync instead: a point-in-time snapshot
+followed by every write made since it was taken.
+
+Handshake replies:
+    +CONTINUE <replid>\r\n                       then the stream from <offset>
+    +FULLRESYNC <replid> <offset>\r\n$<size>\r\n  then <size> snapshot bytes, then the stream
+
+Writing to followers never blocks the client path: every follower has its
+own output buffer drained by a sender task, and a follower whose buffer
+outgrows the configured limits is disconnected (it will resync). Followers
+report the offset they have applied with `REPLCONF ACK <offset>` about
+once a second, which gives per-follower lag. The leader also feeds a PING
+into the stream every second; followers use the time since the last one to
+bound the staleness of the reads they serve.
+"""
+import os
+import asyncio
+import secrets
+import tempfile
+import time
+
+from core.protocol import RequestParser, encode_command
+from persistence.manager import SnapshotWriter
+
+# Snapshot bytes sent per write during a full sync
+SYNC_CHUNK_SIZE = 64 * 1024
+
+class FollowerLink:
+    """One follower connection: its output buffer, sender task and lag bookkeeping."""
+
+    def __init__(self, writer, limits):
+        self.writer = writer
+        self.address = writer.get_extra_info("peername")
+        self.hard_limit, self.soft_limit, self.soft_seconds = limits
+        self.state = "sync"
+        self.buffer = []
+        self.buffered = 0
+        self.over_soft_since = None
+        self.closed = False
+        self.sent_bytes = 0
+        self.ack_offset = None
+        self.last_ack = None
+        self._wakeup = asyncio.Event()
+        self._sender_task = None
+
+    def output_size(self):
+        """Bytes waiting for this follower: our queue plus the socket's own write buffer."""
+        return self.buffered + self.writer.transport.get_write_buffer_size()
+
+    def send(self, data):
+        """Queues stream bytes; returns False if the follower was dropped for being too slow."""
+        if self.closed:
+            return False
+        self.buffer.append(data)
+        self.buffered += len(data)
+        self._wakeup.set()
+
+        size = self.output_size()
+        if self.hard_limit and size > self.hard_limit:
+            return self.close(f"output buffer {size} bytes over the hard limit")
+        if self.soft_limit and size > self.soft_limit:
+            now = time.monotonic()
+            if self.over_soft_since is None:
+                self.over_soft_since = now
+            elif now - self.over_soft_since > self.soft_seconds:
+                return self.close(f"output buffer over the soft limit for {self.soft_seconds}s")
+        else:
+            self.over_soft_since = None
+        return True
+
+    def go_online(self):
+        """Starts streaming: everything queued during the sync goes out first."""
+        self.state = "online"
+        self._sender_task = asyncio.create_task(self._sender())
+
+    async def _sender(self):
+        # Coalesces everything queued since the last write into a single write
+        try:
+            while not self.closed:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                if not self.buffer:
+                    continue
+                data = b"".join(self.buffer)
+                self.buffer.clear()
+                self.buffered = 0
+                self.writer.write(data)
+                self.sent_bytes += len(data)
+                await self.writer.drain()
+        except (ConnectionError, OSError) as e:
+            self.close(f"write failed: {e}")
+
+    def ack(self, offset):
+        self.ack_offset = offset
+        self.last_ack = time.monotonic()
+
+    def close(self, reason=None):
+        if not self.closed:
+            self.closed = True
+            if reason:
+                print(f"[Replication] Dropping follower {self.address}: {reason}")
+            self.buffer.clear()
+            self.writer.close()
+            if self._sender_task is not None and self._sender_task is not asyncio.current_task():
+                self._sender_task.cancel()
+        return False
+
+class ReplicationLeader:
+    def __init__(self, store, backlog_size=1024 * 1024,
+                 output_limits=(256 * 1024 * 1024, 64 * 1024 * 1024, 60)):
+        self.store = store
+        # A new id per leader process: offsets are only comparable within one run
+        self.replid = secrets.token_hex(20)
+        self.offset = 0
+        self.backlog_size = backlog_size
+        self.backlog = None     # Created when the first follower attaches
+        self.backlog_start = 0  # Stream offset of backlog[0]
+        # (hard bytes, soft bytes, soft seconds) per follower; 0 disables a limit
+        self.output_limits = output_limits
+        self.followers = []
+        self.stats = {"full_syncs": 0, "partial_syncs": 0, "followers_dropped": 0}
+        store.replication = self
+
+    def feed(self, records):
+        """Appends records to the stream; called by the store with the shard lock(s) held."""
+        if self.backlog is None:
+            return
+        data = b"".join(encode_command(*record) for record in records)
+        self.offset += len(data)
+        self.backlog += data
+        # Trim in bulk, keeping between backlog_size and twice that many bytes
+        excess = len(self.backlog) - self.backlog_size
+        if excess >= self.backlog_size:
+            del self.backlog[:excess]
+            self.backlog_start += excess
+        for link in self.followers[:]:
+            if not link.send(data):
+                self.stats["followers_dropped"] += 1
+                self.followers.remove(link)
+
+    async def heartbeat(self, interval=1.0):
+        """Feeds a PING into the stream every `interval` seconds while followers are attached."""
+        while True:
+            await asyncio.sleep(interval)
+            if self.followers:
+                self.feed([("PING",)])
+
+    async def attach(self, writer, replid, offset):
+        """Handles PSYNC: resumes from the backlog when possible, otherwise runs a full sync."""
+        if self.backlog is None:
+            self.backlog = bytearray()
+            self.backlog_start = self.offset
+
+        link = FollowerLink(writer, self.output_limits)
+        if replid == self.replid and self.backlog_start <= offset <= self.offset:
+            writer.write(f"+CONTINUE {self.replid}\r\n".encode())
+            link.send(bytes(self.backlog[offset - self.backlog_start:]))
+            link.go_online()
+            self.followers.append(link)
+            self.stats["partial_syncs"] += 1
+            print(f"[Replication] Follower {link.address} resumed at offset {offset}.")
+        else:
+            try:
+                await self._full_sync(link)
+            except BaseException:
+                self.detach(link)
+                raise
+        return link
+
+    async def _full_sync(self, link):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        fd, path = tempfile.mkstemp(prefix="pykv-sync-", suffix=".snap")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async with self.store.snapshot_lock:
+                    # The snapshot view and the follower's stream start at the same instant
+                    batches = self.store.begin_snapshot()
+                    start = self.offset
+                    self.followers.append(link)
+                    link.writer.write(f"+FULLRESYNC {self.replid} {start}\r\n".encode())
+
+                    snapshot = SnapshotWriter(f)
+                    try:
+                        async for entries in batches:
+                            await loop.run_in_executor(None, snapshot.write_entries, entries)
+                    finally:
+                        await batches.aclose()
+                    await loop.run_in_executor(None, snapshot.finish)
+                size = f.tell()
+
+            link.writer.write(b"$%d\r\n" % size)
+            with open(path, "rb") as f:
+                while chunk := await loop.run_in_executor(None, f.read, SYNC_CHUNK_SIZE):
+                    if link.closed:
+                        raise ConnectionError("follower dropped during full sync")
+                    link.writer.write(chunk)
+                    await link.writer.drain()
+            link.go_online()
+            self.stats["full_syncs"] += 1
+            self.store.metrics.histogram("full_sync").observe(time.perf_counter() - started)
+            print(f"[Replication] Full sync of {snapshot.count} keys sent to {link.address} (offset {start}).")
+        finally:
+            os.remove(path)
+
+    async def serve(self, reader, link):
+        """Reads the follower's REPLCONF ACKs until its connection closes."""
+        parser = RequestParser()
+        try:
+            while data := await reader.read(SYNC_CHUNK_SIZE):
+                parser.feed(data)
+                for args, _ in parser:
+                    if len(args) == 3 and args[0].upper() == "REPLCONF" and args[1].upper() == "ACK":
+                        try:
+                            link.ack(int(args[2]))
+                        except ValueError:
+                            print(f"[Replication] Ignoring a malformed ACK from {link.address}: {args[2]!r}")
+        finally:
+            self.detach(link)
+
+    def detach(self, link):
+        link.close()
+        if link in self.followers:
+            self.followers.remove(link)
+            print(f"[Replication] Follower {link.address} disconnected.")
+
+    def get_info(self):
+        """The body of INFO's "# Replication" section."""
+        backlog = len(self.backlog) if self.backlog is not None else 0
+        return (
+            f"role: leader\n"
+            f"connected_followers: {len(self.followers)}\n"
+            f"repl_offset: {self.offset}\n"
+            f"repl_backlog_bytes: {backlog}\n"
+            f"full_syncs: {self.stats['full_syncs']}\n"
+            f"partial_syncs: {self.stats['partial_syncs']}\n"
+            f"followers_dropped: {self.stats['followers_dropped']}"
+        ) + "".join(f"\n{self._follower_info(i, link)}" for i, link in enumerate(self.followers))
+
+    def _follower_info(self, index, link):
+        now = time.monotonic()
+        host, port = link.address[:2]
+        lag_bytes = self.offset - link.ack_offset if link.ack_offset is not None else "?"
+        last_ack = f"{now - link.last_ack:.1f}" if link.last_ack is not None else "?"
+        return (f"follower{index}: ip={host},port={port},state={link.state},"
+                f"ack_offset={link.ack_offset},lag_bytes={lag_bytes},last_ack_seconds={last_ack},"
+                f"output_buffer={link.output_size()}")
@@ -0,0 +1,94 @@
+"""
+Server side of client-side caching (`CLIENT TRACKING`).
+
+A connection that turns tracking on has the keys of its GET and MGET calls
+remembered. The next time such a key is modified - by any write, TTL
+expiry or eviction, i.e. anything the store logs - an invalidation message
+is pushed and the key is forgotten until it is read again. Like Redis over
+RESP2, the messages go to another connection named with REDIRECT, so the
+request/reply stream of the tracking connections is never interleaved
+with pushes:
+
+    CLIENT ID                               (on the invalidation connection)
+    CLIENT TRACKING ON REDIRECT <id>        (on every data connection)
+
+An invalidation message is the array ["invalidate", [key, ...]].
+
+The table holds at most `max_keys` keys; past that the oldest ones are
+invalidated early, which only costs the clients a cache miss. A redirect
+connection that stops reading is disconnected once its unsent output
+exceeds MAX_PENDING_OUTPUT; the client must then flush its cache.
+"""
+import itertools
+
+from core.protocol import encode_reply
+
+INVALIDATE = "invalidate"
+
+# Unsent bytes after which an invalidation connection is dropped
+MAX_PENDING_OUTPUT = 8 * 1024 * 1024
+
+class TrackingTable:
+    def __init__(self, max_keys=1_000_000):
+        self.max_keys = max_keys
+        self.keys = {}          # key -> ids of the connections to notify (insertion order = age)
+        self.connections = {}   # client id -> StreamWriter, for every open connection
+        self.stats = {"tracked_reads": 0, "invalidation_messages": 0, "invalidated_keys": 0,
+                      "redirects_dropped": 0}
+
+    def connect(self, client_id, writer):
+        self.connections[client_id] = writer
+
+    def disconnect(self, client_id):
+        # Its entries in self.keys are dropped lazily, when their key is invalidated
+        self.connections.pop(client_id, None)
+
+    def track(self, target, keys):
+        """Remembers that `keys` were read on a connection redirecting to `target`."""
+        table = self.keys
+        for key in keys:
+            targets = table.get(key)
+            if targets is None:
+                table[key] = {target}
+            else:
+                targets.add(target)
+        self.stats["tracked_reads"] += 1
+        if len(table) > self.max_keys:
+            oldest = list(itertools.islice(table, len(table) - self.max_keys))
+            self._push_invalidations(oldest)
+
+    def invalidate(self, records):
+        """Called by the store, with the shard lock(s) held, for every batch of records it logs."""
+        if not self.keys:
+            return
+        self._push_invalidations(record[1] for record in records if len(record) > 1)
+
+    def _push_invalidations(self, keys):
+        pushes = {}
+        for key in keys:
+            targets = self.keys.pop(key, None)
+            if targets:
+                for target in targets:
+                    pushes.setdefault(target, []).append(key)
+        for target, keys in pushes.items():
+            writer = self.connections.get(target)
+            if writer is None or writer.is_closing():
+                continue
+            if writer.transport.get_write_buffer_size() > MAX_PENDING_OUTPUT:
+                print(f"[Tracking] Client {target} is not reading its invalidations; disconnecting it.")
+                self.stats["redirects_dropped"] += 1
+                writer.close()
+                continue
+            writer.write(encode_reply([INVALIDATE, keys]))
+            self.stats["invalidation_messages"] += 1
+            self.stats["invalidated_keys"] += len(keys)
+
+    def get_info(self):
+        return (
+            f"tracking_total_keys: {len(self.keys)}\n"
+            f"tracking_max_keys: {self.max_keys}\n"
+            f"tracking_reads: {self.stats['tracked_reads']}\n"
+            f"tracking_invalidation_messages: {self.stats['invalidation_messages']}\n"
+            f"tracking_invalidated_keys: {self.stats['invalidated_keys']}\n"
+            f"tracking_redirects_dropped: {self.stats['redirects_dropped']}"
+        )
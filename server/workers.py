@@ -0,0 +1,376 @@
+"""
+Shard-per-process mode (`python -m server.main --workers N`).
+
+Every worker process owns a disjoint slice of the keyspace and its own AOF
+file. All workers accept client connections on the same port (SO_REUSEPORT),
+and a command whose keys live on another worker is forwarded over a
+pipelined RESP connection to that worker's Unix domain socket.
+
+MSET and MSETEX are only accepted when one worker owns all of their keys,
+since nothing would roll back the other workers' parts if one failed.
+"""
+import os
+import asyncio
+import collections
+import heapq
+import itertools
+import tempfile
+
+from core.protocol import RequestParser, ReplyParser, Error, encode_command, encode_reply
+from core.shard import key_hash
+from server import commands
+
+def worker_for_key(key: str, worker_count: int):
+    # Uses the high bits of the hash; shards inside a worker use the low bits
+    return (key_hash(key) >> 16) % worker_count
+
+def worker_aof_path(aof_path: str, worker_id: int):
+    root, ext = os.path.splitext(aof_path)
+    return f"{root}.{worker_id}{ext}"
+
+def peer_socket_path(port: int, worker_id: int):
+    return os.path.join(tempfile.gettempdir(), f"pykv-{port}-worker{worker_id}.sock")
+
+# Backoff between attempts to reach a peer that isn't listening yet, and when to say so
+PEER_CONNECT_MIN_DELAY = 0.05
+PEER_CONNECT_MAX_DELAY = 1.0
+PEER_CONNECT_NOTICE_AFTER = 5.0
+
+# Commands whose keys may be spread over several workers (or whose key is not args[1])
+MULTI_KEY_COMMANDS = {"MGET", "MDEL", "MSET", "MSETEX", "INFO", "MEMORY", "MAXLAG", "SLOWLOG",
+                      "SCAN", "KEYRANGE"}
+
+# "k=v" INFO subfields that add up across workers; the others (percentiles, max) take the maximum
+SUMMED_INFO_SUBFIELDS = {"count", "calls", "usec", "failed_calls"}
+# Numeric INFO fields that describe the node rather than add up; the first worker's value is kept
+NODE_INFO_FIELDS = {"uptime_in_seconds", "ordered_index", "tiered_storage", "compression_threshold"}
+# Numeric INFO fields that are already maxima; the highest worker value is kept
+MAX_INFO_FIELDS = {"client_recent_max_output_buffer", "client_recent_max_input_buffer"}
+
+def merge_info_value(old, new):
+    """Combines one INFO value reported by two workers."""
+    if old is None:
+        return new
+    try:
+        return str(int(old) + int(new))
+    except ValueError:
+        pass
+    if "=" not in new:
+        return old
+    merged = dict(part.partition("=")[::2] for part in old.split(","))
+    for part in new.split(","):
+        name, _, value = part.partition("=")
+        try:
+            if name in SUMMED_INFO_SUBFIELDS:
+                merged[name] = str(int(merged.get(name, 0)) + int(value))
+            elif name != "usec_per_call":
+                merged[name] = str(max(int(merged.get(name, 0)), int(value)))
+        except ValueError:
+            pass
+    if "usec_per_call" in merged:
+        merged["usec_per_call"] = f"{int(merged['usec']) / max(int(merged['calls']), 1):.2f}"
+    return ",".join(f"{name}={value}" for name, value in merged.items())
+
+class PeerLink:
+    """Pipelined connection to another worker; replies resolve futures in send order."""
+
+    def __init__(self, path):
+        self.path = path
+        self.writer = None
+        self.pending = collections.deque()
+        self._connect_lock = asyncio.Lock()
+        self._reader_task = None
+
+    async def _connect(self):
+        async with self._connect_lock:
+            if self.writer is not None:
+                return
+            # Peers only listen once they have replayed their AOF, which
+            # takes as long as it takes: wait for them, backing off
+            delay, waited, announced = PEER_CONNECT_MIN_DELAY, 0.0, False
+            while True:
+                try:
+                    reader, writer = await asyncio.open_unix_connection(self.path)
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    if waited >= PEER_CONNECT_NOTICE_AFTER and not announced:
+                        print(f"[Workers] Waiting for the worker at {self.path} to finish starting...")
+                        announced = True
+                    await asyncio.sleep(delay)
+                    waited += delay
+                    delay = min(delay * 2, PEER_CONNECT_MAX_DELAY)
+            self._reader_task = asyncio.create_task(self._read_loop(reader))
+            self.writer = writer
+
+    async def call(self, *args):
+        if self.writer is None:
+            await self._connect()
+        future = self.send_nowait(args)
+        await self.writer.drain()
+        return await future
+
+    def send_nowait(self, args):
+        """Writes a command without waiting; the returned future resolves with its reply."""
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append(future)
+        self.writer.write(encode_command(*args))
+        return future
+
+    async def _read_loop(self, reader):
+        parser = ReplyParser()
+        try:
+            while True:
+                data = await reader.read(64 * 1024)
+                if not data:
+                    break
+                parser.feed(data)
+                for reply in parser:
+                    future = self.pending.popleft()
+                    if not future.done():
+                        future.set_result(reply)
+        finally:
+            self.writer = None
+            while self.pending:
+                future = self.pending.popleft()
+                if not future.done():
+                    future.set_exception(ConnectionError(f"Lost connection to worker at {self.path}"))
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+
+class WorkerCluster:
+    def __init__(self, worker_id: int, worker_count: int, port: int):
+        self.worker_id = worker_id
+        self.worker_count = worker_count
+        self.port = port
+        self.store = None
+        self.peers = {
+            i: PeerLink(peer_socket_path(port, i)) for i in range(worker_count) if i != worker_id
+        }
+        self.stats = {"forwarded_commands": 0}
+        self._server = None
+
+    async def start(self, store):
+        """Starts this worker's IPC listener for commands forwarded by its peers."""
+        self.store = store
+        path = peer_socket_path(self.port, self.worker_id)
+        if os.path.exists(path):
+            os.remove(path)
+        self._server = await asyncio.start_unix_server(self._handle_peer, path)
+
+    async def close(self):
+        for peer in self.peers.values():
+            await peer.close()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            path = peer_socket_path(self.port, self.worker_id)
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def _handle_peer(self, reader, writer):
+        """Executes forwarded commands locally; they are never forwarded again."""
+        parser = RequestParser()
+        try:
+            while True:
+                data = await reader.read(64 * 1024)
+                if not data:
+                    break
+                parser.feed(data)
+                replies = []
+                async with self.store.aof.deferred_durability():
+                    for args, _ in parser:
+                        replies.append(encode_reply(await commands.execute(self.store, args)))
+                if replies:
+                    writer.write(b"".join(replies))
+                    await writer.drain()
+        except Exception as e:
+            print(f"[Worker {self.worker_id}] Peer link error: {e}")
+        finally:
+            writer.close()
+
+    def owner(self, key: str):
+        return worker_for_key(key, self.worker_count)
+
+    async def _run_on(self, worker_id, args):
+        if worker_id == self.worker_id:
+            return await commands.execute(self.store, args)
+        self.stats["forwarded_commands"] += 1
+        return await self.peers[worker_id].call(*args)
+
+    def forward_nowait(self, args):
+        """
+        Sends a single-key command owned by a connected peer without waiting
+        and returns its reply future (None if it must go through execute()).
+        Replies still come back in order because each peer link is FIFO.
+        """
+        name = args[0].upper()
+        if len(args) < 2 or name not in commands.COMMANDS or name in MULTI_KEY_COMMANDS:
+            return None
+        owner = self.owner(args[1])
+        if owner == self.worker_id or self.peers[owner].writer is None:
+            return None
+        self.stats["forwarded_commands"] += 1
+        return self.peers[owner].send_nowait(args)
+
+    async def execute(self, args):
+        """Runs a client command on the worker(s) that own its keys."""
+        name = args[0].upper()
+
+        if name == "INFO":
+            return await self._info(args)
+        if name == "BGREWRITEAOF":
+            return await self._on_every_worker(args)
+        if name == "MEMORY" and len(args) == 3:
+            return await self._run_on(self.owner(args[2]), args)
+        if name == "MAXLAG":
+            return await commands.execute(self.store, args)
+        if name == "SLOWLOG" and len(args) >= 2:
+            return await self._slowlog(args)
+        if name == "SCAN" and len(args) >= 2:
+            return await self._scan(args)
+        if name == "KEYRANGE" and len(args) >= 3:
+            return await self._keyrange(args)
+
+        if name in ("MGET", "MDEL") and len(args) >= 2:
+            return await self._fan_out_keys(name, args)
+        if name in ("MSET", "MSETEX"):
+            return await self._fan_out_pairs(name, args)
+
+        # Single-key commands (and anything malformed) run where args[1] lives
+        if len(args) >= 2 and name in commands.COMMANDS:
+            return await self._run_on(self.owner(args[1]), args)
+        return await commands.execute(self.store, args)
+
+    async def _fan_out_keys(self, name, args):
+        groups = collections.defaultdict(list)
+        for pos, key in enumerate(args[1:]):
+            groups[self.owner(key)].append((pos, key))
+
+        owners = list(groups)
+        replies = await asyncio.gather(*(
+            self._run_on(owner, [name] + [key for _, key in groups[owner]]) for owner in owners
+        ))
+        for reply in replies:
+            if isinstance(reply, Error):
+                return reply
+
+        if name == "MDEL":
+            return sum(replies)
+        values = [None] * (len(args) - 1)
+        for owner, reply in zip(owners, replies):
+            for (pos, _), value in zip(groups[owner], reply):
+                values[pos] = value
+        return values
+
+    async def _fan_out_pairs(self, name, args):
+        """
+        MSET / MSETEX run on the one worker owning every key. Keys spread
+        over several workers are refused: each worker would apply its part
+        on its own, so a failure on one of them would leave a partial write.
+        """
+        prefix = args[:2] if name == "MSETEX" else args[:1]
+        body = args[len(prefix):]
+        if not body or len(body) % 2:
+            return Error(f"ERROR: Wrong number of arguments for '{name}'")
+        owners = {self.owner(key) for key in body[0::2]}
+        if len(owners) > 1:
+            return Error(f"ERROR: CROSSWORKER {name} keys must all belong to one worker with --workers "
+                         f"(use one SET per key)")
+        return await self._run_on(owners.pop(), args)
+
+    async def _on_every_worker(self, args):
+        """Runs a node-wide command on every worker; the first error wins."""
+        replies = await asyncio.gather(*(self._run_on(i, args) for i in range(self.worker_count)))
+        for reply in replies:
+            if isinstance(reply, Error):
+                return reply
+        return replies[0]
+
+    async def _info(self, args):
+        """
+        Node-wide INFO, section by section: counters are summed over the
+        workers; latency percentiles are the highest any worker reported.
+        """
+        replies = await asyncio.gather(*(self._run_on(i, args) for i in range(self.worker_count)))
+        sections = {}
+        for reply in replies:
+            if isinstance(reply, Error):
+                return reply
+            fields = None
+            for line in str(reply).splitlines():
+                if line.startswith("# "):
+                    fields = sections.setdefault(line, {})
+                    continue
+                field, sep, value = line.partition(": ")
+                if not sep or fields is None or (field in fields and field in NODE_INFO_FIELDS):
+                    continue
+                if field in MAX_INFO_FIELDS:
+                    fields[field] = str(max(int(fields.get(field, 0)), int(value)))
+                else:
+                    fields[field] = merge_info_value(fields.get(field), value)
+        for fields in sections.values():
+            # Ratios don't add up; derive the node-wide one from the summed counts
+            if "hot_cache_hit_ratio" in fields:
+                lookups = int(fields["hits"]) + int(fields["misses"])
+                fields["hot_cache_hit_ratio"] = f"{int(fields['hits']) / lookups if lookups else 0.0:.4f}"
+            if "compression_ratio" in fields:
+                compressed = int(fields["compress_output_bytes"])
+                ratio = int(fields["compress_input_bytes"]) / compressed if compressed else 1.0
+                fields["compression_ratio"] = f"{ratio:.2f}"
+            if "warmup_progress" in fields:
+                total = int(fields["warmup_keys_total"])
+                progress = 100.0 * int(fields["warmup_keys_processed"]) / total if total else 100.0
+                fields["warmup_progress"] = f"{progress:.1f}"
+        if "# Server" in sections:
+            sections["# Server"]["workers"] = self.worker_count
+        return "\n\n".join(header + "".join(f"\n{field}: {value}" for field, value in fields.items())
+                           for header, fields in sections.items())
+
+    async def _slowlog(self, args):
+        """SLOWLOG over every worker: entries merged newest first, lengths summed."""
+        replies = await asyncio.gather(*(self._run_on(i, args) for i in range(self.worker_count)))
+        for reply in replies:
+            if isinstance(reply, Error):
+                return reply
+        sub = args[1].upper()
+        if sub == "LEN":
+            return sum(replies)
+        if sub == "GET":
+            entries = sorted((entry for reply in replies for entry in reply), key=lambda e: -int(e[1]))
+            count = int(args[2]) if len(args) == 3 else 10
+            return entries if count < 0 else entries[:count]
+        return replies[0]
+
+    async def _scan(self, args):
+        """SCAN one worker at a time; the node-wide cursor is "<worker>/<that worker's cursor>"."""
+        worker, cursor = 0, args[1]
+        if "/" in cursor:
+            worker, _, cursor = cursor.partition("/")
+            try:
+                worker = int(worker)
+            except ValueError:
+                return Error("ERROR: Invalid cursor")
+            if not 0 <= worker < self.worker_count:
+                return Error("ERROR: Invalid cursor")
+        reply = await self._run_on(worker, ["SCAN", cursor] + args[2:])
+        if isinstance(reply, Error):
+            return reply
+        cursor, keys = reply
+        if cursor == "0":
+            worker += 1
+            if worker == self.worker_count:
+                return ["0", keys]
+        return [f"{worker}/{cursor}", keys]
+
+    async def _keyrange(self, args):
+        """KEYRANGE on every worker, merged back into one sorted list."""
+        replies = await asyncio.gather(*(self._run_on(i, args) for i in range(self.worker_count)))
+        for reply in replies:
+            if isinstance(reply, Error):
+                return reply
+        limit = int(args[4]) if len(args) == 5 else None
+        return list(itertools.islice(heapq.merge(*replies), limit))
@@ -0,0 +1,69 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.store import LRUCache
+from persistence.aof_logger import AOFLogger
+
+@pytest.fixture
+def aof_path(tmp_path):
+    return str(tmp_path / "appendonly.aof")
+
+@pytest.fixture
+def make_store(aof_path):
+    """Builds an LRUCache logging to a per-test AOF (replayed on construction)."""
+    def make(**kwargs):
+        return LRUCache(aof=AOFLogger(filepath=aof_path), **kwargs)
+    return make
+
+def free_port():
+    import socket
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def wait_for_port(port, task=None):
+    """Polls until something accepts connections on `port` (re-raising if `task` failed)."""
+    import asyncio
+    while True:
+        await asyncio.sleep(0.01)
+        if task is not None and task.done():
+            task.result()
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+        except OSError:
+            continue
+        writer.close()
+        return
+
+@pytest.fixture
+def start_server(tmp_path):
+    """
+    An async context manager running the leader (server.main) in the current
+    event loop on a free port, with its AOF under tmp_path; yields the port.
+    """
+    import asyncio
+    import contextlib
+
+    from server import main as server_main
+
+    @contextlib.asynccontextmanager
+    async def start(*argv):
+        port = free_port()
+        args = server_main.parse_args(["--port", str(port), "--aof-path", str(tmp_path / "server.aof"),
+                                       "--hot-set-checkpoint-interval", "0", *argv])
+        task = asyncio.create_task(server_main.main(args))
+        await wait_for_port(port, task)
+        # Let the server notice the probe is gone before a test counts connections
+        while len(server_main.clients):
+            await asyncio.sleep(0.01)
+        try:
+            yield port
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    return start
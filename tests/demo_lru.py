@@ -3,13 +3,13 @@ import time
 
 def send_cmd(s, cmd):
     print(f"Sending: {cmd}")
-    s.sendall(cmd.encode())
+    s.sendall(f"{cmd}\n".encode())
     response = s.recv(1024).decode().strip()
     print(f"Response: {response}")
     return response
 
 def run_demo():
-    host, port = '127.0.0.1', 8888
+    host, port = '127.0.0.1', 8889
     try:
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.connect((host, port))
@@ -0,0 +1,164 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+from persistence.aof_format import AOFCorruptionError, LogReader, encode_header, encode_record
+from persistence.aof_logger import AOFLogger
+from core.store import LRUCache
+
+def write_keys(make_store, count=10):
+    async def main():
+        store = make_store()
+        for i in range(count):
+            await store.set(f"k{i}", f"v{i}")
+        await store.aof.close()
+
+    asyncio.run(main())
+
+def test_records_round_trip():
+    log = encode_header() + b"".join(encode_record(r) for r in [
+        ("SET", "a", "1"), ("SET", "b", "2", "PXAT", 4102444800000), ("DEL", "a"),
+        ("MULTI",), ("SETZ", "c", b"\x78\x9c"), ("EXEC",)])
+    assert list(LogReader(log)) == [
+        ("SET", "a", "1", None), ("SET", "b", "2", 4102444800.0), ("DEL", "a"),
+        ("MULTI",), ("SET", "c", b"\x78\x9c", None), ("EXEC",)]
+
+def test_torn_tail_is_truncated(make_store, aof_path):
+    write_keys(make_store)
+    good_size = os.path.getsize(aof_path)
+    with open(aof_path, "ab") as f:
+        f.write(encode_record(("SET", "partial", "x" * 100))[:40])
+
+    store = make_store()
+    assert {key for shard in store.shards for key in shard.db} == {f"k{i}" for i in range(10)}
+    assert os.path.getsize(aof_path) == good_size
+
+def test_bad_checksum_on_the_last_record_is_a_torn_tail(make_store, aof_path):
+    write_keys(make_store)
+    good_size = os.path.getsize(aof_path)
+    record = bytearray(encode_record(("SET", "last", "value")))
+    record[-1] ^= 0xFF
+    with open(aof_path, "ab") as f:
+        f.write(record)
+
+    store = make_store()
+    assert "last" not in store._shard("last").db
+    assert os.path.getsize(aof_path) == good_size
+
+def test_unfinished_transaction_is_dropped(make_store, aof_path):
+    write_keys(make_store)
+    good_size = os.path.getsize(aof_path)
+    with open(aof_path, "ab") as f:
+        f.write(encode_record(("MULTI",)) + encode_record(("SET", "k0", "changed")))
+
+    store = make_store()
+    assert store._shard("k0").db["k0"] == "v0"
+    assert os.path.getsize(aof_path) == good_size
+
+def test_bad_checksum_mid_file_is_corruption(make_store, aof_path):
+    write_keys(make_store)
+    with open(aof_path, "r+b") as f:
+        data = bytearray(f.read())
+        # The last byte of the first SET's value (the file ends with nine more records)
+        pos = data.index(b"v0") + 1
+        data[pos] ^= 0xFF
+        f.seek(0)
+        f.write(data)
+
+    with pytest.raises(AOFCorruptionError):
+        make_store()
+
+def test_bgrewriteaof_keeps_its_task_and_logs_failures(make_store, capsys):
+    from server import commands
+
+    async def main():
+        store = make_store()
+        await store.set("k", "v")
+        assert await commands.execute(store, ["BGREWRITEAOF"]) == "Background append only file rewriting started"
+        task = store.aof.rewrite_task
+        assert task is not None
+        assert "in progress" in await commands.execute(store, ["BGREWRITEAOF"])
+        assert await task
+        assert store.aof.rewrite_task is None and store.aof.stats["rewrites"] == 1
+
+        async def fail(data_store):
+            raise OSError("disk full")
+        store.aof._rewrite = fail
+        await commands.execute(store, ["BGREWRITEAOF"])
+        await asyncio.gather(store.aof.rewrite_task, return_exceptions=True)
+        assert store.aof.rewrite_task is None
+        await store.aof.close()
+
+    asyncio.run(main())
+    assert "[AOF] Background rewrite failed: OSError('disk full')" in capsys.readouterr().out
+
+def count_fsyncs(monkeypatch):
+    calls = []
+    fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: (calls.append(fd), fsync(fd)))
+    return calls
+
+def test_concurrent_writers_share_one_write_and_fsync(aof_path, monkeypatch):
+    fsyncs = count_fsyncs(monkeypatch)
+
+    async def main():
+        store = LRUCache(aof=AOFLogger(filepath=aof_path, fsync_policy="always"))
+        await asyncio.gather(*(store.set(f"k{i}", f"v{i}") for i in range(50)))
+        assert store.aof.stats["batches_written"] == 1
+        assert store.aof.stats["commands_written"] == 50
+        assert store.aof.stats["fsyncs"] == len(fsyncs) == 1
+        await store.aof.close()
+
+    asyncio.run(main())
+
+@pytest.mark.parametrize("policy", ["always", "everysec", "no"])
+def test_fsync_policies(aof_path, monkeypatch, policy):
+    fsyncs = count_fsyncs(monkeypatch)
+
+    async def main():
+        aof = AOFLogger(filepath=aof_path, fsync_policy=policy)
+        await aof.append("SET", "a", "1")
+        await aof.append("SET", "b", "2")
+        # A second has passed since the last fsync
+        aof._last_fsync -= 1
+        await aof.append("SET", "c", "3")
+        expected = {"always": 3, "everysec": 1, "no": 0}[policy]
+        assert aof.stats["fsyncs"] == len(fsyncs) == expected
+        assert aof.stats["batches_written"] == 3
+        await aof.close()
+        # Closing always leaves the file synced
+        assert len(fsyncs) == expected + 1
+
+    asyncio.run(main())
+
+def test_writes_are_acknowledged_once_their_batch_is_on_disk(aof_path, monkeypatch):
+    release = threading.Event()
+
+    async def main():
+        store = LRUCache(aof=AOFLogger(filepath=aof_path, fsync_policy="always"))
+        write_batch = store.aof._write_batch
+
+        def slow_write(data, do_fsync):
+            release.wait(5)
+            write_batch(data, do_fsync)
+        monkeypatch.setattr(store.aof, "_write_batch", slow_write)
+
+        task = asyncio.create_task(store.set("k", "v"))
+        await asyncio.sleep(0.05)
+        # Applied in memory, but the client hasn't been answered
+        assert "k" in store._shard("k").db
+        assert not task.done()
+        assert not os.path.exists(aof_path) or b"k" not in open(aof_path, "rb").read()
+
+        release.set()
+        await task
+        with open(aof_path, "rb") as f:
+            assert list(LogReader(f.read())) == [("SET", "k", "v", None)]
+        await store.aof.close()
+
+    try:
+        asyncio.run(main())
+    finally:
+        release.set()
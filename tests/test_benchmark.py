@@ -0,0 +1,61 @@
+import asyncio
+import json
+
+from client.connection import AsyncConnection
+from conftest import free_port
+from core.protocol import encode_command
+from tools import benchmark
+
+async def command(conn, *args):
+    await conn.send(encode_command(*args))
+    (reply,) = await conn.read_replies(1)
+    return reply
+
+def test_benchmark_runs_the_requested_mix_against_a_server(start_server):
+    async def main():
+        async with start_server() as port:
+            args = benchmark.parse_args(["--port", str(port), "-c", "4", "-P", "8", "-n", "403",
+                                         "--keyspace", "50", "--read-ratio", "0.5", "--ttl-ratio", "0.5"])
+            latencies, elapsed, errors = await benchmark.run_benchmark(args)
+            assert errors == 0
+            assert len(latencies["GET"]) + len(latencies["SET"]) == 403
+            assert latencies["GET"] and latencies["SET"]
+
+            results = benchmark.summarize(latencies, elapsed)
+            assert results["ALL"]["requests"] == 403
+            for r in results.values():
+                assert 0 < r["p50_ms"] <= r["p99_ms"] <= r["p999_ms"] <= r["max_ms"]
+
+            # The keyspace was preloaded, and some SETs carried a TTL
+            conn = await AsyncConnection.open(port=port)
+            info = await command(conn, "INFO", "keyspace")
+            assert "keys_in_db: 50\n" in info and "keys_with_ttl: 0" not in info
+            await conn.close()
+
+    asyncio.run(main())
+
+def test_budget_is_shared_by_every_client():
+    budget = benchmark.Budget(10, 0)
+    assert [budget.take(4), budget.take(4), budget.take(4), budget.take(4)] == [4, 4, 2, 0]
+    assert benchmark.Budget(0, 0.01).take(5) == 5
+
+def test_results_are_saved_and_compared_with_a_baseline(tmp_path, capsys):
+    path = str(tmp_path / "run.json")
+    benchmark.main(["--server", "subprocess", "--port", str(free_port()), "-c", "2", "-n", "100",
+                    "--keyspace", "20", "--json", path])
+    with open(path) as f:
+        saved = json.load(f)
+    assert saved["errors"] == 0 and saved["results"]["ALL"]["requests"] == 100
+    assert saved["config"]["clients"] == 2
+
+    config = dict(saved["config"])
+    results = {name: dict(r) for name, r in saved["results"].items()}
+    assert benchmark.compare(config, results, path, threshold=10) == 0
+    # Throughput down 20% on GET, p99 up 50% on SET; a different client count is pointed out
+    results["GET"]["ops_per_sec"] *= 0.8
+    results["SET"]["p99_ms"] *= 1.5
+    config["clients"] = 3
+    assert benchmark.compare(config, results, path, threshold=10) == 2
+    output = capsys.readouterr().out
+    assert "different settings (clients)" in output
+    assert output.count("REGRESSION") == 2
@@ -0,0 +1,86 @@
+import asyncio
+
+from client.connection import AsyncConnection
+from core.protocol import encode_command
+from persistence.aof_logger import AOFLogger
+
+async def command(conn, *args):
+    await conn.send(encode_command(*args))
+    (reply,) = await conn.read_replies(1)
+    return reply
+
+def record_locking(monkeypatch, store):
+    """Appends a shard's index to the returned list every time its lock is acquired."""
+    acquired = []
+    for shard in store.shards:
+        def acquire(lock=shard.lock, index=shard.index, original=shard.lock.acquire):
+            acquired.append(index)
+            return original()
+        monkeypatch.setattr(shard.lock, "acquire", acquire)
+    return acquired
+
+def test_bulk_commands_lock_each_shard_once_and_log_one_batch(make_store, aof_path, monkeypatch):
+    keys = [f"k{i}" for i in range(40)]
+
+    async def main():
+        store = make_store(num_shards=8)
+        acquired = record_locking(monkeypatch, store)
+        await store.mset([(key, f"v{i}") for i, key in enumerate(keys)])
+        # Every shard taken exactly once, in ascending order (so bulk commands can't deadlock)
+        assert acquired == list(range(8))
+        assert store.aof.stats["batches_written"] == 1
+        assert store.aof.stats["commands_written"] == len(keys)
+
+        acquired.clear()
+        assert await store.mget(["k3", "missing", "k0", "k3"]) == ["v3", None, "v0", "v3"]
+        assert acquired == sorted(set(acquired))
+
+        acquired.clear()
+        assert await store.mdelete(["k0", "k1", "missing", "k0"]) == 2
+        assert acquired == sorted(set(acquired))
+        assert store.aof.stats["batches_written"] == 2
+        assert store.aof.stats["commands_written"] == len(keys) + 2
+        # Nothing to delete: nothing logged
+        assert await store.mdelete(["k0", "missing"]) == 0
+        assert store.aof.stats["batches_written"] == 2
+        await store.aof.close()
+
+    asyncio.run(main())
+    store = make_store(num_shards=8)
+
+    async def check():
+        assert await store.mget(keys[:3]) == [None, None, "v2"]
+        assert await store.mget(keys[3:]) == [f"v{i}" for i in range(3, 40)]
+        await store.aof.close()
+
+    asyncio.run(check())
+
+def test_concurrent_bulk_writes_over_the_same_shards_do_not_deadlock(make_store):
+    async def main():
+        store = make_store(num_shards=4)
+        forwards = [(f"k{i}", "a") for i in range(20)]
+        backwards = [(f"k{i}", "b") for i in reversed(range(20))]
+        await asyncio.wait_for(asyncio.gather(*(store.mset(forwards if i % 2 else backwards) for i in range(20)),
+                                              *(store.mdelete([f"k{i}" for i in range(0, 20, 3)]) for _ in range(5))),
+                               timeout=10)
+        values = await store.mget([f"k{i}" for i in range(20)])
+        # Each MSET is applied whole: a key is either missing or from one MSET or the other
+        assert set(values) <= {"a", "b", None}
+        await store.aof.close()
+
+    asyncio.run(main())
+
+def test_bulk_commands_over_the_wire(start_server):
+    async def main():
+        async with start_server("--shards", "4") as port:
+            conn = await AsyncConnection.open(port=port)
+            assert await command(conn, "MSET", "a", "1", "b", "2", "c", "3") == "OK"
+            assert await command(conn, "MGET", "a", "nope", "c") == ["1", None, "3"]
+            assert await command(conn, "MSETEX", "100", "t1", "x", "t2", "y") == "OK"
+            assert await command(conn, "MGET", "t1", "t2") == ["x", "y"]
+            assert await command(conn, "MDEL", "a", "b", "nope") == 2
+            assert await command(conn, "MGET", "a", "b", "c") == [None, None, "3"]
+            assert await command(conn, "MSET", "a", "1", "b") == "ERROR: Wrong number of arguments for 'MSET'"
+            await conn.close()
+
+    asyncio.run(main())
@@ -0,0 +1,98 @@
+import asyncio
+import concurrent.futures
+
+import pytest
+
+from client import AsyncPyKVClient, PoolTimeoutError, PyKVClient, ResponseError
+from client.connection import AsyncConnection, Connection
+
+def count_calls(monkeypatch, cls, name):
+    calls = []
+    original = getattr(cls, name)
+
+    def wrapper(*args, **kwargs):
+        calls.append(args)
+        return original(*args, **kwargs)
+    monkeypatch.setattr(cls, name, classmethod(lambda c, *a, **k: wrapper(*a, **k))
+                        if isinstance(cls.__dict__[name], classmethod) else wrapper)
+    return calls
+
+def test_async_pipeline_is_one_round_trip(start_server, monkeypatch):
+    sends = count_calls(monkeypatch, AsyncConnection, "send")
+
+    async def main():
+        async with start_server() as port:
+            async with AsyncPyKVClient(port=port) as client:
+                async with client.pipeline() as pipe:
+                    for i in range(100):
+                        pipe.set(f"k{i}", i)
+                    pipe.incr("k7").get("k7").mget("k1", "k2", "missing")
+                    before = len(sends)
+                    results = await pipe.execute()
+                assert len(sends) == before + 1
+                assert results[:100] == [True] * 100
+                assert results[100:] == [8, "8", ["1", "2", None]]
+
+                # Errors are raised, or returned in place with raise_on_error=False
+                pipe = client.pipeline().set("s", "text").incr("s").get("s")
+                with pytest.raises(ResponseError):
+                    await pipe.execute()
+                results = await client.pipeline().set("s", "text").incr("s").get("s").execute(
+                    raise_on_error=False)
+                assert results[0] is True and isinstance(results[1], ResponseError) and results[2] == "text"
+
+                # A transactional pipeline runs as MULTI/EXEC
+                assert await client.pipeline(transaction=True).incr("n").incrby("n", 5).execute() == [1, 6]
+
+    asyncio.run(main())
+
+def test_async_pool_is_bounded(start_server, monkeypatch):
+    async def main():
+        async with start_server() as port:
+            client = AsyncPyKVClient(port=port, max_connections=2)
+            await client.set("k", "v")
+            opened = count_calls(monkeypatch, AsyncConnection, "open")
+            assert await asyncio.gather(*(client.get("k") for _ in range(50))) == ["v"] * 50
+            # One connection was idle already; at most one more was needed
+            assert len(opened) <= 1
+
+            slow = AsyncPyKVClient(port=port, max_connections=1, pool_timeout=0.05)
+            conn = await slow.pool.get_connection()
+            with pytest.raises(PoolTimeoutError):
+                await slow.get("k")
+            slow.pool.release(conn)
+            assert await slow.get("k") == "v"
+            await slow.close()
+            await client.close()
+
+    asyncio.run(main())
+
+def test_sync_client_is_shared_between_threads(start_server, monkeypatch):
+    opened = count_calls(monkeypatch, Connection, "__init__")
+
+    async def main():
+        async with start_server() as port:
+            client = PyKVClient(port=port, max_connections=3)
+
+            def work(i):
+                client.set(f"k{i}", i)
+                with client.pipeline() as pipe:
+                    pipe.incr(f"k{i}").get(f"k{i}")
+                    return pipe.execute()
+
+            def text_incr():
+                client.set("t", "text")
+                return client.incr("t")
+
+            # Not the loop's default executor: the server's AOF writes run there
+            loop = asyncio.get_running_loop()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=8) as threads:
+                results = await asyncio.gather(*(loop.run_in_executor(threads, work, i) for i in range(20)))
+                assert results == [[i + 1, str(i + 1)] for i in range(20)]
+                assert len(opened) <= 3
+                assert await loop.run_in_executor(threads, client.mget, "k0", "k19") == ["1", "20"]
+                with pytest.raises(ResponseError):
+                    await loop.run_in_executor(threads, text_incr)
+                await loop.run_in_executor(threads, client.close)
+
+    asyncio.run(main())
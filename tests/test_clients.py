@@ -0,0 +1,67 @@
+import asyncio
+
+from client.connection import AsyncConnection, ConnectionError
+from core.protocol import Error, encode_command
+from server import main as server_main
+
+async def command(conn, *args):
+    await conn.send(encode_command(*args))
+    (reply,) = await conn.read_replies(1)
+    return reply
+
+async def refused(port):
+    """The reply to a connection over --maxclients, then whether the server closed it."""
+    conn = await AsyncConnection.open(port=port)
+    (reply,) = await asyncio.wait_for(conn.read_replies(1), 1)
+    try:
+        await asyncio.wait_for(conn.read_replies(1), 1)
+        closed = False
+    except ConnectionError:
+        closed = True
+    await conn.close()
+    return reply, closed
+
+def test_connections_over_maxclients_are_refused(start_server):
+    async def main():
+        async with start_server("--maxclients", "2") as port:
+            first = await AsyncConnection.open(port=port)
+            second = await AsyncConnection.open(port=port)
+            assert await command(first, "CLIENT", "ID") != await command(second, "CLIENT", "ID")
+
+            reply, closed = await refused(port)
+            assert isinstance(reply, Error) and "max number of clients reached" in str(reply)
+            assert closed
+            assert server_main.clients.stats["rejected_connections"] == 1
+            # The open connections keep working
+            assert str(await command(first, "SET", "k", "v")) == "OK"
+
+            # A slot frees up once a client leaves
+            await second.close()
+            while len(server_main.clients) > 1:
+                await asyncio.sleep(0.01)
+            third = await AsyncConnection.open(port=port)
+            assert await command(third, "GET", "k") == "v"
+            for conn in (first, third):
+                await conn.close()
+
+    asyncio.run(main())
+
+def test_client_kill_closes_the_connection(start_server):
+    async def main():
+        async with start_server() as port:
+            admin = await AsyncConnection.open(port=port)
+            victim = await AsyncConnection.open(port=port)
+            victim_id = await command(victim, "CLIENT", "ID")
+            assert await command(admin, "CLIENT", "KILL", "ID", str(victim_id)) == 1
+            try:
+                await asyncio.wait_for(victim.read_replies(1), 1)
+                assert False, "the killed connection is still open"
+            except ConnectionError:
+                pass
+            while len(server_main.clients) > 1:
+                await asyncio.sleep(0.01)
+            assert f"id={victim_id} " not in str(await command(admin, "CLIENT", "LIST"))
+            await admin.close()
+            await victim.close()
+
+    asyncio.run(main())
@@ -0,0 +1,118 @@
+import asyncio
+import zlib
+
+import pytest
+
+from core.shard import check_compressed
+from persistence.aof_format import LogReader
+from persistence.manager import SnapshotWriter
+from server import commands
+
+JSON = '{"user": "alice", "roles": ["admin", "dev"], "active": true}' * 40
+
+def info_fields(store, section):
+    return dict(line.split(": ", 1) for line in store.get_info(section).splitlines()[1:])
+
+def test_only_values_over_the_threshold_are_compressed(make_store):
+    async def main():
+        store = make_store(compression_threshold=1000)
+        await store.set("short", "x" * 999)
+        await store.set("long", "x" * 1000)
+        await store.set("json", JSON)
+        assert type(store._shard("short").db["short"]) is str
+        assert type(store._shard("long").db["long"]) is bytes
+        assert type(store._shard("json").db["json"]) is bytes
+        assert await store.mget(["short", "long", "json"]) == ["x" * 999, "x" * 1000, JSON]
+        await store.aof.close()
+
+    asyncio.run(main())
+
+def test_ratio_accounting(make_store):
+    async def main():
+        store = make_store(capacity=0, compression_threshold=100)
+        for i in range(10):
+            await store.set(f"k{i}", JSON)
+        stored = sum(len(store._shard(f"k{i}").db[f"k{i}"]) for i in range(10))
+        fields = info_fields(store, "memory")
+        assert int(fields["compressed_values"]) == 10
+        assert int(fields["compress_input_bytes"]) == 10 * len(JSON)
+        assert int(fields["compress_output_bytes"]) == stored
+        assert float(fields["compression_ratio"]) == pytest.approx(10 * len(JSON) / stored, abs=0.01)
+        assert float(fields["compression_ratio"]) > 5
+        # Reads that miss the hot tier decompress
+        assert await store.get("k0") == JSON
+        assert int(info_fields(store, "memory")["decompressions"]) >= 1
+        await store.aof.close()
+
+    asyncio.run(main())
+
+def test_compressed_values_round_trip_through_the_aof(make_store, aof_path):
+    async def main():
+        store = make_store(compression_threshold=100)
+        await store.set("json", JSON, ttl=3600)
+        await store.aof.close()
+        with open(aof_path, "rb") as f:
+            records = [r for r in LogReader(f.read()) if r[0] == "SET"]
+        # Logged compressed (a SETZ record), with its expiry
+        assert records[0][1] == "json" and zlib.decompress(records[0][2]).decode() == JSON
+        assert records[0][3] is not None
+
+        store = make_store(compression_threshold=100)
+        assert type(store._shard("json").db["json"].value) is bytes
+        assert await store.get("json") == JSON
+        # A node with compression off decompresses on replay
+        plain = make_store()
+        assert type(plain._shard("json").db["json"].value) is str
+        assert await plain.get("json") == JSON
+
+    asyncio.run(main())
+
+def test_compressed_values_round_trip_through_snapshots(make_store, tmp_path):
+    async def main():
+        store = make_store(compression_threshold=100)
+        await store.set("json", JSON)
+        await store.set("small", "v")
+        assert await store.aof.trigger_compaction(store)
+        await store.aof.close()
+        assert await make_store(compression_threshold=100).get("json") == JSON
+
+        # A full sync snapshot carries the compressed bytes as they are
+        path = tmp_path / "sync.snap"
+        with open(path, "wb") as f:
+            writer = SnapshotWriter(f)
+            async with store.snapshot_lock:
+                async for entries in store.begin_snapshot():
+                    writer.write_entries(entries)
+            writer.finish()
+        assert zlib.compress(JSON.encode(), 6) in path.read_bytes()
+        follower = make_store(compression_threshold=100)
+        assert await follower.load_snapshot_file(str(path)) == 2
+        assert type(follower._shard("json").db["json"]) is bytes
+        assert await follower.mget(["json", "small"]) == [JSON, "v"]
+
+    asyncio.run(main())
+
+def test_check_compressed_bounds_the_inflated_size():
+    bomb = zlib.compress(b"\0" * 10_000_000)
+    assert len(bomb) < 20_000
+    with pytest.raises(ValueError):
+        check_compressed(bomb, 1024 * 1024)
+    assert check_compressed(bomb, 10_000_000) == 10_000_000
+    good = zlib.compress(b"hello")
+    assert check_compressed(good, 5) == 5
+    for bad in (good[:-2], good + b"x", b"not zlib", b""):
+        with pytest.raises(ValueError):
+            check_compressed(bad, 1024)
+
+def test_setz_validates_the_stream(make_store):
+    async def main():
+        store = make_store(compression_threshold=100)
+        data = zlib.compress(JSON.encode()).decode("utf-8", "surrogateescape")
+        assert await commands.execute(store, ["SETZ", "k", data]) == "OK"
+        assert await store.get("k") == JSON
+        for bad in (data[:-1], data + "x", "plain text"):
+            assert await commands.execute(store, ["SETZ", "k", bad]) == "ERROR: Value is not a zlib stream"
+        assert await store.get("k") == JSON
+        await store.aof.close()
+
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+import asyncio
+
+from core import eviction
+from server import commands
+
+OOM = "ERROR: OOM command not allowed when used memory > 'maxmemory'"
+
+async def full_store(make_store, policy, keys=12, **ttls):
+    """A one-shard store holding k0..k<keys-1>, and a function that puts it just over its limit."""
+    store = make_store(num_shards=1, maxmemory=1 << 30, maxmemory_policy=policy)
+    for i in range(keys):
+        await store.set(f"k{i}", f"value-{i}", ttl=ttls.get(f"k{i}"))
+    shard = store.shards[0]
+
+    def squeeze(by=1):
+        # With by=1 the next write has to evict about one key to get back under
+        shard.maxmemory = shard.used_memory() - by
+    return store, shard, squeeze
+
+def present(shard, count=12):
+    return {f"k{i}" for i in range(count) if f"k{i}" in shard.db}
+
+def test_allkeys_lru_evicts_the_least_recently_used_key(make_store):
+    async def main():
+        store, shard, squeeze = await full_store(make_store, "allkeys-lru")
+        await store.get("k0")
+        await store.set("k2", "value-2")  # Overwrites count as uses too
+        squeeze()
+        await store.set("new", "value-n")
+        assert present(shard) == {f"k{i}" for i in range(12)} - {"k1"}
+        squeeze()
+        await store.set("new2", "value-n")
+        assert "k3" not in shard.db and "k0" in shard.db and "k2" in shard.db
+        assert shard.stats["evicted_keys"] == 2
+        await store.aof.close()
+
+    asyncio.run(main())
+
+def test_allkeys_lfu_evicts_the_least_frequently_used_key(make_store):
+    async def main():
+        store, shard, squeeze = await full_store(make_store, "allkeys-lfu")
+        # The first access after LFU_INIT_VAL always increments; k7 is never read
+        for i in range(12):
+            if i != 7:
+                await store.get(f"k{i}")
+        squeeze()
+        await store.set("new", "value-n")
+        assert present(shard) == {f"k{i}" for i in range(12)} - {"k7"}
+        await store.aof.close()
+
+    asyncio.run(main())
+
+def test_lfu_counters_decay(make_store, monkeypatch):
+    async def main():
+        store, shard, squeeze = await full_store(make_store, "allkeys-lfu")
+        policy = shard.policy
+        await store.get("k0")
+        assert policy.counter(shard, "k0") == eviction.LFU_INIT_VAL + 1
+        assert policy.counter(shard, "k1") == eviction.LFU_INIT_VAL
+
+        now = eviction.time.monotonic()
+        monkeypatch.setattr(eviction.time, "monotonic", lambda: now + 2 * eviction.LFU_DECAY_SECONDS)
+        assert policy.counter(shard, "k0") == eviction.LFU_INIT_VAL - 1
+        assert policy.counter(shard, "k1") == eviction.LFU_INIT_VAL - 2
+        # Relative order survives the decay, and a new key starts above decayed ones
+        squeeze()
+        await store.set("new", "value-n")
+        assert "k1" not in shard.db and "k0" in shard.db
+        assert policy.counter(shard, "new") == eviction.LFU_INIT_VAL
+        await store.aof.close()
+
+    asyncio.run(main())
+
+def test_volatile_ttl_evicts_the_nearest_expiry_then_refuses(make_store):
+    async def main():
+        store, shard, squeeze = await full_store(make_store, "volatile-ttl", k3=100, k5=10)
+        squeeze()
+        await store.set("new", "value-n")
+        assert present(shard) == {f"k{i}" for i in range(12)} - {"k5"}
+        squeeze()
+        await store.set("new2", "value-n")
+        assert "k3" not in shard.db
+        # Only persistent keys are left: nothing can be evicted
+        squeeze(1000)
+        assert await commands.execute(store, ["SET", "new3", "value-n"]) == OOM
+        assert len(present(shard)) == 10
+        await store.aof.close()
+
+    asyncio.run(main())
+
+def test_noeviction_refuses_writes_at_maxmemory(make_store):
+    async def main():
+        store, shard, squeeze = await full_store(make_store, "noeviction")
+        squeeze()
+        assert await commands.execute(store, ["SET", "new", "value-n"]) == OOM
+        assert await commands.execute(store, ["APPEND", "k0", "-more"]) == OOM
+        assert await commands.execute(store, ["MSET", "a", "1", "b", "2"]) == OOM
+        assert "new" not in shard.db and shard.stats["evicted_keys"] == 0
+        # Reads and deletes still work, and a delete makes room
+        assert await commands.execute(store, ["GET", "k0"]) == "value-0"
+        assert await commands.execute(store, ["DEL", "k1"]) == "OK"
+        assert await commands.execute(store, ["SET", "new", "value-n"]) == "OK"
+        await store.aof.close()
+
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+def test_pop_expired_skips_stale_heap_entries(make_store):
+    store = make_store(num_shards=1)
+    shard = store.shards[0]
+    now = time.time()
+    for i in range(10):
+        shard.put_locked(f"k{i}", "v", now - 100 + i)
+    shard.put_locked("k0", "v", now + 100)  # New TTL: its old heap entry is stale
+    shard.put_locked("k1", "v", None)       # Persistent now
+    shard.delete_locked("k2")
+    shard.put_locked("later", "v", now + 100)
+    assert len(shard.expiry_heap) == 12
+
+    # At most `limit` heap entries are looked at per call, stale ones included
+    deleted, more_due = shard.pop_expired_locked(now, 4)
+    assert deleted == ["k3"] and more_due
+    deleted, more_due = shard.pop_expired_locked(now, 100)
+    assert deleted == [f"k{i}" for i in range(4, 10)] and not more_due
+    assert sorted(shard.db) == ["k0", "k1", "later"]
+    assert shard.volatile_keys == 2 and shard.stats["expired_keys"] == 7
+    assert {entry.key for entry in shard.expiry_heap} == {"k0", "later"}
+
+def test_stale_heap_entries_do_not_pile_up(make_store):
+    store = make_store(num_shards=1)
+    shard = store.shards[0]
+    for i in range(1000):
+        shard.put_locked("k", str(i), time.time() + 100 + i)
+    assert shard.volatile_keys == 1
+    assert len(shard.expiry_heap) <= 2 * shard.volatile_keys + 64
+
+def test_expiry_cycles_drain_a_backlog_without_stalling_clients(make_store):
+    async def main():
+        store = make_store(num_shards=4)
+        for i in range(2000):
+            await store.set(f"k{i}", "v", expiry=time.time() + 0.2)
+        await store.set("kept", "v", ttl=100)
+        await store.set("plain", "v")
+        await asyncio.sleep(0.25)
+
+        task = asyncio.create_task(store.cleanup_expired_keys(hz=10, time_budget=0.01, slice_size=50))
+        # Clients keep being served between slices while the backlog drains
+        stalls = []
+        while store.totals()["keys_in_db"] > 2:
+            started = time.perf_counter()
+            assert await store.get("plain") == "v"
+            await asyncio.sleep(0)
+            stalls.append(time.perf_counter() - started)
+            assert stalls[-1] < 1
+        task.cancel()
+
+        assert await store.get("kept") == "v"
+        totals = store.totals()
+        assert totals["expired_keys"] == 2000 and totals["keys_with_ttl"] == 1
+        assert store.stats["expire_cycles_over_budget"] > 0
+        assert store.metrics.histograms["expire_cycle"].count >= store.stats["expire_cycles"] - 1
+        await store.aof.close()
+
+    asyncio.run(main())
+    # Every expired key was logged as a DEL
+    store = make_store(num_shards=4)
+    records = list(store.aof.replay())
+    assert sum(record[0] == "DEL" for record in records) == 2000
+
+def test_reading_an_expired_key_deletes_it(make_store):
+    async def main():
+        store = make_store(num_shards=1)
+        await store.set("k", "v", expiry=time.time() + 0.05)
+        assert await store.get("k") == "v"
+        await asyncio.sleep(0.1)
+        assert await store.get("k") is None
+        assert "k" not in store.shards[0].db
+        assert store.totals()["expired_keys"] == 1
+        await store.aof.close()
+
+    asyncio.run(main())
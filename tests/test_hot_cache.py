@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+@pytest.mark.parametrize("policy", ["lru", "slru", "w-tinylfu"])
+def test_writes_do_not_reorder_the_hot_set(make_store, policy):
+    async def main():
+        store = make_store(capacity=20, num_shards=1, hot_cache_policy=policy)
+        hot = store.shards[0].hot
+        for i in range(30):
+            await store.set(f"k{i}", f"v{i}")
+        # k0-k9 are read often, k10-k29 once
+        for _ in range(3):
+            for i in range(10):
+                await store.get(f"k{i}")
+        for i in range(10, 30):
+            await store.get(f"k{i}")
+        before = list(hot.checkpoint())
+
+        # A write scan over every key, hot or not
+        for _ in range(5):
+            for i in reversed(range(30)):
+                await store.set(f"k{i}", f"w{i}")
+        assert list(hot.checkpoint()) == before
+        # Hot keys hold the new values
+        node = hot.find(before[0][1])
+        assert node.value == "w" + before[0][1][1:]
+        await store.aof.close()
+
+    asyncio.run(main())
+
+def test_slru_and_tinylfu_keep_their_hot_set_under_a_write_scan(make_store):
+    async def main():
+        for policy in ("slru", "w-tinylfu"):
+            store = make_store(capacity=20, num_shards=1, hot_cache_policy=policy)
+            hot = store.shards[0].hot
+            for i in range(10):
+                await store.set(f"hot{i}", "v")
+            for _ in range(4):
+                for i in range(10):
+                    await store.get(f"hot{i}")
+            # Push the last one out of W-TinyLFU's window so every hot key is protected
+            await store.set("filler", "v")
+            await store.get("filler")
+            await store.get("hot9")
+            # Cold keys read once each, then written over and over
+            for i in range(100):
+                await store.set(f"cold{i}", "v")
+                await store.get(f"cold{i}")
+                for _ in range(3):
+                    await store.set(f"cold{i}", "w")
+            assert all(hot.find(f"hot{i}") is not None for i in range(10)), policy
+            await store.aof.close()
+
+    asyncio.run(main())
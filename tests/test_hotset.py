@@ -0,0 +1,99 @@
+import asyncio
+
+from client.connection import AsyncConnection
+from core.protocol import encode_command
+from persistence.hotset import HotSetCheckpoint
+
+async def command(conn, *args):
+    await conn.send(encode_command(*args))
+    (reply,) = await asyncio.wait_for(conn.read_replies(1), 5)
+    return reply
+
+def info_fields(text):
+    return dict(line.split(": ", 1) for line in text.splitlines() if ": " in line)
+
+def test_hot_set_is_restored_after_a_restart(make_store, tmp_path):
+    checkpoint = HotSetCheckpoint(str(tmp_path / "server.hotset"))
+
+    async def main():
+        store = make_store(capacity=16, num_shards=1, hot_cache_policy="w-tinylfu", hot_set=checkpoint)
+        for i in range(50):
+            await store.set(f"k{i}", f"v{i}")
+        for _ in range(4):
+            for i in range(10):
+                await store.get(f"k{i}")
+        for i in range(10, 50):
+            await store.get(f"k{i}")
+        before = list(store.shards[0].hot.checkpoint())
+        assert await store.checkpoint_hot_set() == len(before)
+        await store.aof.close()
+
+        store = make_store(capacity=16, num_shards=1, hot_cache_policy="w-tinylfu", hot_set=checkpoint)
+        assert len(store.shards[0].hot) == 0
+        await store.warm_up()
+        hot = store.shards[0].hot
+        assert [(segment, key) for segment, key, _ in hot.checkpoint()] == [
+            (segment, key) for segment, key, _ in before]
+        # Frequencies come back too, so the hot keys still win admission contests
+        assert all(hot.frequency(key) >= frequency for _, key, frequency in before)
+        assert all(hot.find(key).value == f"v{key[1:]}" for _, key, _ in before)
+        fields = info_fields(store.get_info("persistence"))
+        assert fields["warmup_in_progress"] == "0"
+        assert fields["warmup_keys_total"] == fields["warmup_keys_processed"] == str(len(before))
+        assert fields["warmup_keys_restored"] == str(len(before))
+        assert fields["warmup_progress"] == "100.0"
+        await store.aof.close()
+
+    asyncio.run(main())
+
+def test_keys_gone_since_the_checkpoint_and_damaged_checkpoints_are_skipped(make_store, tmp_path):
+    checkpoint = HotSetCheckpoint(str(tmp_path / "server.hotset"))
+    checkpoint.save([("main", "kept", 0, 0), ("main", "gone", 0, 0)])
+
+    async def main():
+        store = make_store(hot_set=checkpoint)
+        await store.set("kept", "v")
+        await store.warm_up()
+        assert store.warmup["restored"] == 1 and store.warmup["total"] == 2
+        await store.aof.close()
+
+        with open(checkpoint.filepath, "r+b") as f:
+            f.seek(12)
+            f.write(b"\xff")
+        store = make_store(hot_set=checkpoint)
+        await store.warm_up()
+        assert store.warmup["total"] == 0
+        await store.aof.close()
+
+    asyncio.run(main())
+
+def test_server_checkpoints_at_shutdown_and_warms_up_on_start(start_server):
+    options = ("--hot-set-checkpoint-interval", "60", "--capacity", "8", "--shards", "1")
+
+    async def main():
+        async with start_server(*options) as port:
+            conn = await AsyncConnection.open(port=port)
+            for i in range(20):
+                await command(conn, "SET", f"k{i}", f"v{i}")
+            for i in range(5):
+                assert await command(conn, "GET", f"k{i}") == f"v{i}"
+            await conn.close()
+
+        async with start_server(*options) as port:
+            conn = await AsyncConnection.open(port=port)
+            for _ in range(100):
+                fields = info_fields(await command(conn, "INFO", "persistence"))
+                if fields["warmup_in_progress"] == "0" and fields["warmup_keys_total"] != "0":
+                    break
+                await asyncio.sleep(0.01)
+            assert fields["warmup_keys_total"] == fields["warmup_keys_restored"] == "5"
+            assert fields["warmup_progress"] == "100.0"
+            assert float(fields["warmup_seconds"]) >= 0
+            # The first reads after the restart are hot-tier hits
+            for i in range(5):
+                assert await command(conn, "GET", f"k{i}") == f"v{i}"
+            stats = info_fields(await command(conn, "INFO", "stats"))
+            assert stats["hits"] == "5" and stats["misses"] == "0"
+            await conn.close()
+
+    asyncio.run(main())
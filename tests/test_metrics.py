@@ -0,0 +1,87 @@
+import asyncio
+
+from client.connection import AsyncConnection
+from conftest import free_port
+from core.metrics import SLOWLOG_MAX_ARG_LENGTH, SLOWLOG_MAX_ARGS, LatencyHistogram, SlowLog
+from core.protocol import encode_command
+
+async def command(conn, *args):
+    await conn.send(encode_command(*args))
+    (reply,) = await conn.read_replies(1)
+    return reply
+
+async def scrape(port):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.decode().partition("\r\n\r\n")
+    return head, body
+
+def samples(body):
+    """{'name{labels}': value} for every sample line of an exposition."""
+    return {line.rpartition(" ")[0]: float(line.rpartition(" ")[2])
+            for line in body.splitlines() if line and not line.startswith("#")}
+
+def test_histogram_percentiles_are_bucket_upper_bounds():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(0.99) == 0
+    for _ in range(98):
+        histogram.observe(0.000010)  # 10 µs: the [8, 16) bucket
+    histogram.observe(0.001)
+    histogram.observe(0.5)
+    assert histogram.percentile(0.5) == 16
+    assert histogram.percentile(0.99) == 1024
+    assert histogram.percentile(1.0) == 500000  # Capped at the max
+    assert histogram.describe() == "count=100,p50=16,p99=1024,p999=500000,max=500000"
+
+def test_slowlog_keeps_the_newest_entries_with_arguments_trimmed():
+    slowlog = SlowLog(threshold_usec=0, max_len=2)
+    slowlog.add(["GET", "a"], 0.001)
+    slowlog.add(["SET", "k", "v" * (SLOWLOG_MAX_ARG_LENGTH + 5)], 0.002)
+    slowlog.add(["MDEL"] + [f"k{i}" for i in range(SLOWLOG_MAX_ARGS + 3)], 0.003)
+    assert [entry[0] for entry in slowlog.entries] == [2, 1]
+    assert slowlog.entries[0][2] == 3000
+    assert slowlog.entries[0][3][-1] == "... (4 more arguments)"
+    assert len(slowlog.entries[0][3]) == SLOWLOG_MAX_ARGS + 1
+    assert slowlog.entries[1][3][2] == "v" * SLOWLOG_MAX_ARG_LENGTH + "... (5 more bytes)"
+
+def test_slowlog_latency_info_and_prometheus_endpoint(start_server):
+    metrics_port = free_port()
+
+    async def main():
+        async with start_server("--slowlog-log-slower-than", "0", "--slowlog-max-len", "3",
+                                "--metrics-port", str(metrics_port)) as port:
+            conn = await AsyncConnection.open(port=port)
+            await command(conn, "SET", "a", "1")
+            await command(conn, "SET", "b", "2")
+            await command(conn, "GET", "a")
+            await command(conn, "INCR", "b")
+            assert await command(conn, "SLOWLOG", "LEN") == 3
+            entries = await command(conn, "SLOWLOG", "GET", "2")
+            assert [entry[3] for entry in entries] == [["SLOWLOG", "LEN"], ["INCR", "b"]]
+            assert await command(conn, "SLOWLOG", "RESET") == "OK"
+            # Only the RESET itself has been logged since
+            assert [entry[3] for entry in await command(conn, "SLOWLOG", "GET")] == [["SLOWLOG", "RESET"]]
+            assert (await command(conn, "SLOWLOG", "FOO")).startswith("ERROR: Syntax is SLOWLOG")
+
+            info = await command(conn, "INFO", "latencystats")
+            assert "latency_percentiles_usec_set: count=2," in info
+            assert "lock_wait_usec: count=" in info
+            assert "cmdstat_set: calls=2," in await command(conn, "INFO", "commandstats")
+
+            head, body = await scrape(metrics_port)
+            assert head.startswith("HTTP/1.1 200 OK") and "version=0.0.4" in head
+            values = samples(body)
+            assert values['pykv_commands_total{command="set"}'] == 2
+            assert values['pykv_command_failures_total{command="slowlog"}'] == 1
+            assert values["pykv_keys"] == 2
+            assert "# TYPE pykv_command_duration_seconds histogram" in body
+            buckets = [value for name, value in values.items()
+                       if name.startswith('pykv_command_duration_seconds_bucket{command="set"')]
+            assert buckets == sorted(buckets) and buckets[-1] == 2
+            assert values['pykv_command_duration_seconds_count{command="set"}'] == 2
+            assert "pykv_lock_wait_seconds_count" in values
+            await conn.close()
+
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from client.connection import AsyncConnection
+from core.protocol import (Error, ProtocolError, ReplyParser, RequestParser, SimpleString,
+                           encode_command, encode_reply)
+
+def parse(*chunks):
+    parser, commands = RequestParser(), []
+    for chunk in chunks:
+        parser.feed(chunk)
+        commands.extend(parser)
+    return commands, parser
+
+def test_frame_split_across_reads_is_reassembled():
+    frame = encode_command("SET", "key", "a value\r\nwith CRLF")
+    for split in range(1, len(frame)):
+        commands, parser = parse(frame[:split], frame[split:])
+        assert commands == [(["SET", "key", "a value\r\nwith CRLF"], False)]
+        assert parser.buffered() == 0
+
+def test_one_byte_at_a_time():
+    data = encode_command("GET", "k") + b"PING\r\n" + encode_command("DEL", "k")
+    commands, _ = parse(*(data[i:i + 1] for i in range(len(data))))
+    assert commands == [(["GET", "k"], False), (["PING"], True), (["DEL", "k"], False)]
+
+def test_mixed_resp_and_inline_commands():
+    commands, _ = parse(b"SET a 1\n" + encode_command("GET", "a") + b"\r\n\r\nINFO  server\r\n")
+    assert commands == [(["SET", "a", "1"], True), (["GET", "a"], False), (["INFO", "server"], True)]
+
+def test_incomplete_frame_waits_for_more_data():
+    commands, parser = parse(b"*2\r\n$3\r\nGET\r\n$5\r\nab")
+    assert commands == []
+    assert parser.buffered() == len(b"*2\r\n$3\r\nGET\r\n$5\r\nab")
+    parser.feed(b"cde\r\n")
+    assert list(parser) == [(["GET", "abcde"], False)]
+
+@pytest.mark.parametrize("data", [
+    b"*1\r\n$x\r\nabc\r\n",          # non-numeric bulk length
+    b"*z\r\n",                       # non-numeric array length
+    b"*1\r\n$-3\r\nabc\r\n",         # negative bulk length
+    b"*1\r\n$600000000\r\n",         # bulk over MAX_BULK_LENGTH
+    b"*2000000\r\n",                 # array over MAX_ARRAY_LENGTH
+    b"*1\r\n:3\r\nabc\r\n",          # an integer where a bulk string belongs
+    b"*1\r\n$3\r\nabcXY",            # bulk not terminated by CRLF
+])
+def test_malformed_lengths_raise(data):
+    with pytest.raises(ProtocolError):
+        parse(data)
+
+def test_unterminated_inline_request_is_bounded():
+    with pytest.raises(ProtocolError):
+        parse(b"x" * (64 * 1024 + 1))
+
+def test_reply_round_trip():
+    parser = ReplyParser()
+    values = [SimpleString("OK"), Error("ERROR: nope"), 42, None, "text", ["a", None, [1, "b"]]]
+    data = b"".join(encode_reply(v) for v in values)
+    parser.feed(data[:7])
+    replies = list(parser)
+    parser.feed(data[7:])
+    replies.extend(parser)
+    assert replies == values
+    assert isinstance(replies[0], SimpleString) and isinstance(replies[1], Error)
+
+def test_pipelined_replies_come_back_in_order(start_server):
+    async def main():
+        async with start_server() as port:
+            conn = await AsyncConnection.open(port=port)
+            commands = []
+            for i in range(200):
+                commands += [("SET", f"k{i}", str(i)), ("INCR", f"k{i}"), ("GET", f"k{i}")]
+            # One write, cut in the middle of a frame
+            data = b"".join(encode_command(*args) for args in commands)
+            conn.writer.write(data[:1001])
+            await conn.writer.drain()
+            await asyncio.sleep(0.01)
+            await conn.send(data[1001:])
+            replies = await asyncio.wait_for(conn.read_replies(len(commands)), 5)
+            assert replies == [r for i in range(200) for r in ("OK", i + 1, str(i + 1))]
+
+            await conn.send(b"*1\r\n$4\r\nPING\r\n*1\r\n$x\r\n")
+            reply, error = await asyncio.wait_for(conn.read_replies(2), 5)
+            assert isinstance(error, Error) and "Protocol error" in error
+            await conn.close()
+
+    asyncio.run(main())
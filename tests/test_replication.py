@@ -0,0 +1,269 @@
+import asyncio
+import contextlib
+import socket
+import time
+
+from client.connection import AsyncConnection
+from conftest import free_port, wait_for_port
+from core.protocol import Error, RequestParser, encode_command
+from server import follower
+from server import main as server_main
+from server.replication import FollowerLink
+
+async def command(conn, *args):
+    await conn.send(encode_command(*args))
+    (reply,) = await asyncio.wait_for(conn.read_replies(1), 5)
+    return reply
+
+async def psync(port, replid="?", offset=-1):
+    """Raw handshake: (first line, snapshot bytes or None, reader, writer)."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(encode_command("PSYNC", replid, offset))
+    line = (await asyncio.wait_for(reader.readline(), 5)).decode().strip()
+    snapshot = None
+    if line.startswith("+FULLRESYNC"):
+        size = int((await reader.readline())[1:])
+        snapshot = await reader.readexactly(size)
+    return line, snapshot, reader, writer
+
+async def stream_commands(reader, count):
+    parser, received = RequestParser(), []
+    while len(received) < count:
+        parser.feed(await asyncio.wait_for(reader.read(64 * 1024), 5))
+        received.extend(args for args, _ in parser if args[0] != "PING")
+    return received
+
+@contextlib.asynccontextmanager
+async def start_follower(tmp_path, leader_port):
+    port = free_port()
+    task = asyncio.create_task(follower.run_follower(
+        leader_port=leader_port, port=port, aof_path=str(tmp_path / "follower.aof"),
+        hot_set_checkpoint_interval=0))
+    await wait_for_port(port, task)
+    conn = await AsyncConnection.open(port=port)
+    try:
+        yield conn
+    finally:
+        await conn.close()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+async def eventually(check, timeout=5):
+    for _ in range(int(timeout / 0.02)):
+        if await check():
+            return
+        await asyncio.sleep(0.02)
+    assert await check()
+
+def test_follower_full_sync_then_stream(start_server, tmp_path):
+    async def main():
+        async with start_server() as port:
+            leader = await AsyncConnection.open(port=port)
+            for i in range(100):
+                await command(leader, "SET", f"k{i}", str(i))
+            async with start_follower(tmp_path, port) as reader:
+                await eventually(lambda: _equals(reader, ["GET", "k99"], "99"))
+                await command(leader, "SET", "late", "x")
+                await command(leader, "DEL", "k0")
+                await command(leader, "MULTI")
+                await command(leader, "INCR", "k1")
+                await command(leader, "APPEND", "k2", "!")
+                await command(leader, "EXEC")
+                await eventually(lambda: _equals(reader, ["GET", "late"], "x"))
+                await eventually(lambda: _equals(reader, ["MGET", "k0", "k1", "k2"], [None, "2", "2!"]))
+                assert isinstance(await command(reader, "SET", "a", "b"), Error)
+            await leader.close()
+
+    asyncio.run(main())
+
+async def _equals(conn, args, expected):
+    return await command(conn, *args) == expected
+
+async def _keys_in_db(conn, count):
+    return f"keys_in_db: {count}\n" in await command(conn, "INFO", "keyspace")
+
+async def _stat_is(name, value):
+    # Counted once the last snapshot byte is drained, just after the follower reads it
+    return server_main.replication.stats[name] == value
+
+def test_partial_resync_from_the_backlog(start_server):
+    async def main():
+        async with start_server() as port:
+            leader = await AsyncConnection.open(port=port)
+            line, _, reader, writer = await psync(port)
+            _, replid, offset = line.split()
+            await command(leader, "SET", "a", "1")
+            assert await stream_commands(reader, 1) == [["SET", "a", "1"]]
+            resume_at = int(offset) + len(encode_command("SET", "a", "1"))
+            writer.close()
+
+            # Written while the follower is away
+            await command(leader, "SET", "b", "2")
+            await command(leader, "DEL", "a")
+            line, snapshot, reader, writer = await psync(port, replid, resume_at)
+            assert line == f"+CONTINUE {replid}" and snapshot is None
+            assert await stream_commands(reader, 2) == [["SET", "b", "2"], ["DEL", "a"]]
+            assert server_main.replication.stats["partial_syncs"] == 1
+            writer.close()
+            await leader.close()
+
+    asyncio.run(main())
+
+def test_trimmed_offset_falls_back_to_a_full_sync(start_server):
+    async def main():
+        async with start_server("--repl-backlog-size", "1024") as port:
+            leader = await AsyncConnection.open(port=port)
+            line, _, _, writer = await psync(port)
+            _, replid, offset = line.split()
+            writer.close()
+            for i in range(200):
+                await command(leader, "SET", f"k{i}", "x" * 50)
+            assert server_main.replication.backlog_start > int(offset)
+
+            line, snapshot, _, writer = await psync(port, replid, int(offset))
+            assert line.startswith("+FULLRESYNC") and snapshot
+            # An unknown replication id also means a full sync
+            line, _, _, writer2 = await psync(port, "not-this-leader", 0)
+            assert line.startswith("+FULLRESYNC")
+            await eventually(lambda: _stat_is("full_syncs", 3))
+            writer.close()
+            writer2.close()
+            await leader.close()
+
+    asyncio.run(main())
+
+def test_writes_during_a_full_sync_are_buffered_and_sent_after_it(start_server, tmp_path):
+    async def main():
+        async with start_server() as port:
+            leader = await AsyncConnection.open(port=port)
+            await leader.send(b"".join(encode_command("SET", f"k{i}", "v" * 100) for i in range(20000)))
+            await asyncio.wait_for(leader.read_replies(20000), 30)
+
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(encode_command("PSYNC", "?", -1))
+            line = (await asyncio.wait_for(reader.readline(), 5)).decode()
+            assert line.startswith("+FULLRESYNC")
+            # The snapshot is still being written: this write is queued for the follower
+            links = server_main.replication.followers
+            assert links and links[0].state == "sync"
+            await command(leader, "SET", "during", "sync")
+            assert links[0].buffered > 0
+
+            size = int((await reader.readline())[1:])
+            await reader.readexactly(size)
+            assert await stream_commands(reader, 1) == [["SET", "during", "sync"]]
+            assert links[0].state == "online"
+            writer.close()
+            await leader.close()
+
+    asyncio.run(main())
+
+def test_malformed_psync_gets_an_error_reply(start_server):
+    async def main():
+        async with start_server() as port:
+            conn = await AsyncConnection.open(port=port)
+            assert "Invalid PSYNC offset" in await command(conn, "PSYNC", "?", "abc")
+            assert "Syntax" in await command(conn, "PSYNC", "?")
+            # The connection is still a normal client
+            assert await command(conn, "SET", "k", "v") == "OK"
+            assert not server_main.replication.followers
+            await conn.close()
+
+    asyncio.run(main())
+
+def test_follower_store_hides_expired_keys_until_the_leaders_del(make_store):
+    async def main():
+        store = make_store(expire_keys=False)
+        await store.set("k", "v", expiry=time.time() - 1)
+        await store.set("n", "5", expiry=time.time() - 1)
+        assert await store.get("k") is None
+        assert await store.mget(["k"]) == [None]
+        # Still there, and not counted or logged as expired
+        assert "k" in store._shard("k").db
+        assert "keys_in_db: 2\n" in store.get_info("keyspace")
+        assert "expired_keys: 0" in store.get_info("stats")
+        # A write to the expired key starts it over without the stale TTL
+        assert await store.increment("n") == 1
+        assert store._shard("n")._expiry_of("n") is None
+        await store.delete("k")
+        assert "k" not in store._shard("k").db
+
+    asyncio.run(main())
+
+def test_follower_drops_expired_keys_only_on_the_leaders_del(start_server, tmp_path):
+    async def main():
+        async with start_server() as port:
+            leader = await AsyncConnection.open(port=port)
+            async with start_follower(tmp_path, port) as reader:
+                await command(leader, "SET", "k", "v", "PXAT", int(time.time() * 1000) + 500)
+                await eventually(lambda: _equals(reader, ["GET", "k"], "v"))
+                await eventually(lambda: _equals(reader, ["GET", "k"], None))
+                # The leader's sweeper deletes the key and the DEL reaches the follower
+                await eventually(lambda: _keys_in_db(reader, 0))
+            await leader.close()
+
+    asyncio.run(main())
+
+class FakeTransport:
+    def get_write_buffer_size(self):
+        return 0
+
+class FakeWriter:
+    transport = FakeTransport()
+
+    def get_extra_info(self, name):
+        return ("127.0.0.1", 4321)
+
+    def close(self):
+        self.closed = True
+
+def test_follower_over_the_soft_limit_for_too_long_is_dropped():
+    async def main():
+        link = FollowerLink(FakeWriter(), (0, 100, 0.05))
+        assert link.send(b"x" * 150)
+        # Back under the limit: the soft-limit clock starts over
+        link.buffer.clear()
+        link.buffered = 0
+        assert link.send(b"x" * 10) and link.over_soft_since is None
+        assert link.send(b"x" * 150)
+        await asyncio.sleep(0.06)
+        assert not link.send(b"x")
+        assert link.closed and link.writer.closed and not link.buffer
+
+    asyncio.run(main())
+
+async def stalled_psync(port):
+    """A PSYNC from a follower that never reads what it is sent (and has a tiny receive buffer)."""
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.connect(("127.0.0.1", port))
+    _, writer = await asyncio.open_connection(sock=sock)
+    writer.write(encode_command("PSYNC", "?", -1))
+    return writer
+
+def test_slow_follower_is_dropped_without_stalling_writes(start_server):
+    value = "v" * 64 * 1024
+
+    async def main():
+        async with start_server("--repl-buffer-hard-limit", "256kb") as port:
+            leader = await AsyncConnection.open(port=port)
+            _, _, reader, writer = await psync(port)
+            stalled = await stalled_psync(port)
+            await eventually(lambda: _stat_is("full_syncs", 2))
+            received = asyncio.create_task(stream_commands(reader, 160))
+
+            # 10mb: well past what the kernel's socket buffers can absorb
+            started = time.monotonic()
+            for i in range(160):
+                assert await command(leader, "SET", f"k{i}", value) == "OK"
+            assert time.monotonic() - started < 5
+            # The stalled follower was dropped; the other one got every write
+            assert len(await received) == 160
+            assert server_main.replication.stats["followers_dropped"] == 1
+            info = await command(leader, "INFO", "replication")
+            assert "connected_followers: 1\n" in info
+            writer.close()
+            stalled.close()
+            await leader.close()
+
+    asyncio.run(main())
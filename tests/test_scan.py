@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+from core.scan import HashBucketIndex, compile_pattern
+from server.commands import cmd_scan
+from core.protocol import Error
+
+async def scan_all(store, count=10, pattern=None, between_calls=None):
+    cursor, seen, calls = "0", [], 0
+    while True:
+        cursor, keys = await store.scan(cursor, pattern, count)
+        seen.extend(keys)
+        calls += 1
+        if cursor == "0":
+            return seen, calls
+        if between_calls is not None:
+            await between_calls(calls)
+
+@pytest.mark.parametrize("ordered_index", [False, True])
+def test_scan_returns_every_key_while_the_table_grows(make_store, ordered_index):
+    async def main():
+        store = make_store(num_shards=4, ordered_index=ordered_index)
+        for i in range(2000):
+            await store.set(f"old:{i}", "v")
+
+        async def churn(calls):
+            # Grow every shard's table several times and delete other keys meanwhile
+            if calls > 10:
+                return
+            for i in range(calls * 400, (calls + 1) * 400):
+                await store.set(f"new:{i}", "v")
+            await store.delete(f"new:{calls * 400 - 1}")
+
+        seen, _ = await scan_all(store, count=50, between_calls=churn)
+        assert {f"old:{i}" for i in range(2000)} <= set(seen)
+        await store.aof.close()
+
+    asyncio.run(main())
+
+def test_scan_match_and_deleted_keys(make_store):
+    async def main():
+        store = make_store(num_shards=2)
+        for i in range(500):
+            await store.set(f"user:{i}", "v")
+            await store.set(f"item:{i}", "v")
+        for i in range(0, 500, 2):
+            await store.delete(f"user:{i}")
+        seen, _ = await scan_all(store, count=20, pattern="user:*")
+        assert set(seen) == {f"user:{i}" for i in range(1, 500, 2)}
+        await store.aof.close()
+
+    asyncio.run(main())
+
+def test_scan_step_examines_about_count_keys(make_store):
+    async def main():
+        store = make_store(num_shards=1)
+        for i in range(5000):
+            await store.set(f"k{i}", "v")
+        shard, position, seen = store.shards[0], None, set()
+        while True:
+            position, keys = shard.scan_locked(position, 100)
+            # Whole buckets of about BUCKET_TARGET_KEYS keys, not the whole shard
+            assert len(keys) < 300
+            seen.update(keys)
+            if position is None:
+                break
+        assert len(seen) == 5000
+        await store.aof.close()
+
+    asyncio.run(main())
+
+def test_hash_bucket_index_keeps_every_key_in_its_bucket():
+    index = HashBucketIndex()
+    keys = [f"key:{i}" for i in range(5000)]
+    for key in keys:
+        index.add(key)
+    for key in keys[::3]:
+        index.remove(key)
+    live = set(keys) - set(keys[::3])
+    assert len(index) == len(live)
+    found = []
+    for b in range(len(index.buckets)):
+        bucket = index.bucket(b)
+        assert all(hash(key) & index.mask == b for key in bucket)
+        found.extend(bucket)
+    assert sorted(found) == sorted(live)
+
+def test_invalid_match_pattern_is_an_error(make_store):
+    async def main():
+        store = make_store()
+        await store.set("a", "1")
+        for pattern in ("[z-a]", "[^]x]"):
+            reply = await cmd_scan(store, ["SCAN", "0", "MATCH", pattern])
+            assert isinstance(reply, Error) and "Invalid pattern" in str(reply)
+        assert await cmd_scan(store, ["SCAN", "0", "MATCH", "[a-c]"]) == ["0", ["a"]]
+        await store.aof.close()
+
+    with pytest.raises(ValueError):
+        compile_pattern("[z-a]")
+    asyncio.run(main())
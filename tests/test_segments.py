@@ -0,0 +1,129 @@
+import asyncio
+import threading
+
+import pytest
+
+from core.node import SegmentRef
+from persistence.segment_store import SegmentStore
+from server.commands import exec_transaction
+
+@pytest.fixture
+def make_tiered_store(make_store, tmp_path):
+    """A store whose values of 16+ bytes live in small segment files."""
+    def make(**kwargs):
+        segments = SegmentStore(str(tmp_path / "segments"), max_segment_size=4096, min_value_size=16)
+        return make_store(capacity=1, num_shards=2, segments=segments, **kwargs)
+    return make
+
+def value_of(i):
+    return f"value-{i:04d}-" + "x" * 40
+
+def spilled(store, key):
+    return store._shard(key).spilled_locked(key) is not None
+
+def test_spilled_values_read_back(make_tiered_store):
+    async def main():
+        store = make_tiered_store()
+        for i in range(200):
+            await store.set(f"k{i}", value_of(i))
+        await store.set("short", "small")
+        assert all(spilled(store, f"k{i}") for i in range(200))
+        assert len(store.segments.segments) > 1
+        assert [await store.get(f"k{i}") for i in range(200)] == [value_of(i) for i in range(200)]
+        assert await store.mget(["k5", "short", "k7", "missing"]) == [value_of(5), "small", value_of(7), None]
+        await store.aof.close()
+
+    asyncio.run(main())
+
+def test_writes_transactions_and_rewrites_read_spilled_values_off_the_loop(make_tiered_store, monkeypatch):
+    async def main():
+        store = make_tiered_store()
+        await store.set("n", "0" * 20 + "41", ttl=100)
+        for i in range(50):
+            await store.set(f"k{i}", value_of(i))
+        assert spilled(store, "n") and spilled(store, "k1")
+
+        def synchronous_read(ref):
+            raise AssertionError("spilled value read on the event loop")
+        monkeypatch.setattr(store.segments, "read", synchronous_read)
+
+        assert await store.increment("n", 1) == 42
+        assert await store.append("k1", "!") == len(value_of(1)) + 1
+        replies = await exec_transaction(store, [["GET", "k2"], ["APPEND", "k3", "?"], ["GET", "k4"]])
+        assert replies == [value_of(2), len(value_of(3)) + 1, value_of(4)]
+
+        assert await store.aof.trigger_compaction(store)
+        await store.aof.close()
+
+    asyncio.run(main())
+    monkeypatch.undo()
+    # The rewritten AOF holds the spilled values themselves
+    store = make_tiered_store()
+
+    async def check():
+        assert await store.get("n") == "42"
+        assert await store.get("k1") == value_of(1) + "!"
+        assert await store.get("k3") == value_of(3) + "?"
+        assert await store.get("k10") == value_of(10)
+        await store.aof.close()
+
+    asyncio.run(check())
+
+def test_hot_spilled_values_are_not_read_on_the_loop(make_tiered_store, monkeypatch):
+    async def main():
+        store = make_tiered_store()
+        await store.set("n", "0" * 20 + "41")
+        await store.set("m", "0" * 20 + "7")
+        # In the hot tier and on disk
+        assert await store.get("n") == "0" * 20 + "41"
+        assert store._shard("n").hot.find("n") is not None and spilled(store, "n")
+
+        def synchronous_read(ref):
+            raise AssertionError("spilled value read on the event loop")
+        monkeypatch.setattr(store.segments, "read", synchronous_read)
+        assert await store.increment("n", 1) == 42
+        replies = await exec_transaction(store, [["INCRBY", "m", "1"], ["INCRBY", "n", "1"]])
+        assert replies == [8, 43]
+        await store.aof.close()
+
+    asyncio.run(main())
+
+def test_merge_compacts_segments_that_are_mostly_garbage(make_tiered_store, monkeypatch):
+    async def main():
+        store = make_tiered_store()
+        records = store.segments.records
+
+        def records_off_the_loop(segment):
+            for record in records(segment):
+                assert threading.current_thread() is not threading.main_thread()
+                yield record
+        monkeypatch.setattr(store.segments, "records", records_off_the_loop)
+        for i in range(200):
+            await store.set(f"k{i}", value_of(i))
+        # Overwriting three keys in four leaves the old segments mostly garbage
+        for i in range(200):
+            if i % 4:
+                await store.set(f"k{i}", "new-" + value_of(i))
+        candidates = store.segments.merge_candidates()
+        assert candidates
+        merged_ids = {segment.id for segment in candidates}
+
+        task = asyncio.create_task(store.merge_segments(interval=0))
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if not store.segments.merge_candidates():
+                break
+        task.cancel()
+
+        assert not merged_ids & set(store.segments.segments)
+        assert store.segments.totals()["segment_merged_bytes"] > 0
+        for i in range(200):
+            expected = ("new-" if i % 4 else "") + value_of(i)
+            assert await store.get(f"k{i}") == expected
+        for shard in store.shards:
+            for raw in shard.db.values():
+                if type(raw) is SegmentRef:
+                    assert raw.segment in store.segments.segments
+        await store.aof.close()
+
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+import asyncio
+
+from core.metrics import LatencyHistogram, TimedLock
+from core.shard import key_hash
+
+def keys_by_shard(store, count=200):
+    by_shard = {}
+    for i in range(count):
+        by_shard.setdefault(store._shard(f"k{i}").index, []).append(f"k{i}")
+    return by_shard
+
+def test_keys_spread_over_shards_that_split_capacity_and_memory(make_store):
+    async def main():
+        store = make_store(capacity=10, num_shards=4, maxmemory=4 << 20)
+        by_shard = keys_by_shard(store)
+        assert sorted(by_shard) == [0, 1, 2, 3]
+        assert all(store._shard(key).index == key_hash(key) % 4 for key in by_shard[2])
+        assert [shard.capacity for shard in store.shards] == [3, 3, 2, 2]
+        assert [shard.maxmemory for shard in store.shards] == [1 << 20] * 4
+
+        for i in range(200):
+            await store.set(f"k{i}", "v")
+        assert [len(shard.db) for shard in store.shards] == [len(by_shard[i]) for i in range(4)]
+        assert "keys_in_db: 200" in store.get_info("keyspace")
+        await store.aof.close()
+
+    asyncio.run(main())
+
+def test_a_held_shard_lock_only_blocks_its_own_shard(make_store):
+    async def main():
+        store = make_store(num_shards=4)
+        by_shard = keys_by_shard(store)
+        blocked, free = by_shard[0][0], by_shard[1][0]
+        await store.set(free, "1")
+
+        async with store.shards[0].lock:
+            write = asyncio.create_task(store.set(blocked, "x"))
+            # Other shards keep serving reads and writes meanwhile
+            assert await asyncio.wait_for(store.get(free), 1) == "1"
+            assert await asyncio.wait_for(store.increment(free, 1), 1) == 2
+            await asyncio.sleep(0.05)
+            assert not write.done()
+        assert await asyncio.wait_for(write, 1)
+        assert await store.get(blocked) == "x"
+
+        # The write's wait for the held lock was recorded
+        lock_wait = store.metrics.histograms["lock_wait"]
+        assert lock_wait.max >= 0.05
+        assert "lock_wait_usec: count=" in store.get_info("latencystats")
+        await store.aof.close()
+
+    asyncio.run(main())
+
+def test_timed_lock_records_every_acquire():
+    async def main():
+        histogram = LatencyHistogram()
+        lock = TimedLock(histogram)
+        async with lock:
+            pass
+        assert histogram.count == 1 and histogram.max < 0.05
+
+        await lock.acquire()
+        waiter = asyncio.create_task(lock.acquire())
+        await asyncio.sleep(0.02)
+        lock.release()
+        await waiter
+        lock.release()
+        assert histogram.count == 3
+        assert histogram.max >= 0.02
+        assert histogram.percentile(1.0) == int(histogram.max * 1e6)
+
+    asyncio.run(main())
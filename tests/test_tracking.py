@@ -0,0 +1,78 @@
+import asyncio
+
+from client.connection import AsyncConnection
+from client.near_cache import NearCache
+from core.protocol import encode_command
+from server.tracking import TrackingTable
+
+class FakeTransport:
+    def get_write_buffer_size(self):
+        return 0
+
+class FakeWriter:
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.written = []
+
+    def is_closing(self):
+        return False
+
+    def write(self, data):
+        self.written.append(data)
+
+async def command(conn, *args):
+    await conn.send(encode_command(*args))
+    (reply,) = await conn.read_replies(1)
+    return reply
+
+def test_invalidation_is_pushed_before_the_write_returns(make_store):
+    async def main():
+        store = make_store()
+        store.tracking = tracking = TrackingTable()
+        push = FakeWriter()
+        tracking.connect(7, push)
+        await store.set("k", "v1")
+        tracking.track(7, ["k"])
+
+        await store.set("k", "v2")
+        assert push.written == [b"*2\r\n$10\r\ninvalidate\r\n*1\r\n$1\r\nk\r\n"]
+        # The key is forgotten until it is read again
+        await store.delete("k")
+        assert len(push.written) == 1
+        await store.aof.close()
+
+    asyncio.run(main())
+
+def test_near_cache_drops_a_read_that_raced_with_an_invalidation():
+    cache = NearCache(10)
+    hit, token = cache.get("k")
+    assert not hit
+    # The invalidation for a write arrives before the (older) GET reply
+    cache.invalidate(["k"])
+    cache.put("k", token, "old")
+    hit, token = cache.get("k")
+    assert not hit
+    cache.put("k", token, "new")
+    assert cache.get("k") == (True, "new")
+
+def test_redirect_connection_receives_the_push_before_the_writer_gets_its_reply(start_server):
+    async def main():
+        async with start_server() as port:
+            pushes = await AsyncConnection.open(port=port)
+            reader = await AsyncConnection.open(port=port)
+            writer = await AsyncConnection.open(port=port)
+            client_id = await command(pushes, "CLIENT", "ID")
+            assert str(await command(reader, "CLIENT", "TRACKING", "ON", "REDIRECT", str(client_id))) == "OK"
+            await command(writer, "SET", "a", "1")
+            await command(writer, "SET", "b", "1")
+            assert await command(reader, "MGET", "a", "b") == ["1", "1"]
+
+            # The push is written while the write holds its shard lock, before its reply
+            await command(writer, "SET", "b", "2")
+            assert await asyncio.wait_for(pushes.read_replies(1), 1) == [["invalidate", ["b"]]]
+            await command(writer, "DEL", "a")
+            assert await asyncio.wait_for(pushes.read_replies(1), 1) == [["invalidate", ["a"]]]
+            for conn in (pushes, reader, writer):
+                await conn.close()
+
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+import asyncio
+
+from core.shard import Expiring
+from server.commands import Session, execute, execute_in_session
+
+def expiry_of(store, key):
+    raw = store._shard(key).db[key]
+    return raw.expiry if type(raw) is Expiring else None
+
+def test_append_keeps_ttl(make_store):
+    async def main():
+        store = make_store()
+        await store.set("k", "v", ttl=100)
+        expiry = expiry_of(store, "k")
+        assert await store.append("k", "x") == 2
+        assert await store.get("k") == "vx"
+        assert expiry_of(store, "k") == expiry
+        await store.aof.close()
+        return expiry
+
+    expiry = asyncio.run(main())
+    # The AOF record carries the TTL too
+    replayed = make_store()
+    assert replayed._shard("k").db["k"].value == "vx"
+    assert abs(expiry_of(replayed, "k") - expiry) < 0.001
+
+def test_incrby_keeps_ttl(make_store):
+    async def main():
+        store = make_store()
+        await store.set("n", "5", ttl=100)
+        expiry = expiry_of(store, "n")
+        assert await store.increment("n", 10) == 15
+        assert expiry_of(store, "n") == expiry
+        assert await store.increment("fresh", 1) == 1
+        assert expiry_of(store, "fresh") is None
+        await store.aof.close()
+
+    asyncio.run(main())
+
+def test_incr_only_accepts_plain_64_bit_integers(make_store):
+    async def main():
+        store = make_store()
+        for value in (" 5", "5 ", "+5", "1_000", "0x10", "5.0", "", "-", "\u0665", str(2 ** 63)):
+            await store.set("n", value)
+            assert await execute(store, ["INCR", "n"]) == "ERROR: Value is not an integer", value
+            assert await store.get("n") == value
+        for amount in ("+1", " 1", "1_0", str(2 ** 63)):
+            assert await execute(store, ["INCRBY", "n", amount]) == "ERROR: Value is not an integer"
+
+        await store.set("n", "-0042")
+        assert await execute(store, ["INCR", "n"]) == -41
+        await store.set("n", str(2 ** 63 - 2))
+        assert await execute(store, ["INCR", "n"]) == 2 ** 63 - 1
+        overflow = "ERROR: Increment or decrement would overflow"
+        assert await execute(store, ["INCR", "n"]) == overflow
+        assert await store.get("n") == str(2 ** 63 - 1)
+        await store.set("n", str(-2 ** 63))
+        assert await execute(store, ["DECRBY", "n", "1"]) == overflow
+        assert await execute(store, ["DECRBY", "m", str(-2 ** 63)]) == overflow
+        await store.aof.close()
+
+    asyncio.run(main())
+
+def test_watch_aborts_exec_after_a_write(make_store):
+    async def main():
+        store = make_store()
+        session = Session(1)
+        await store.set("k", "old")
+        assert await execute_in_session(store, session, ["WATCH", "k"]) is not None
+        await store.set("k", "changed")
+        await execute_in_session(store, session, ["MULTI"])
+        await execute_in_session(store, session, ["SET", "k", "mine"])
+        assert await execute_in_session(store, session, ["EXEC"]) is None
+        assert await store.get("k") == "changed"
+        # The watch is gone after EXEC, so the next transaction runs
+        await execute_in_session(store, session, ["MULTI"])
+        await execute_in_session(store, session, ["SET", "k", "mine"])
+        assert await execute_in_session(store, session, ["EXEC"]) is not None
+        assert await store.get("k") == "mine"
+        await store.aof.close()
+
+    asyncio.run(main())
+
+def test_untouched_watch_runs_exec(make_store):
+    async def main():
+        store = make_store()
+        session = Session(1)
+        await execute_in_session(store, session, ["WATCH", "k"])
+        await store.set("other", "1")
+        await execute_in_session(store, session, ["MULTI"])
+        await execute_in_session(store, session, ["APPEND", "k", "abc"])
+        assert await execute_in_session(store, session, ["EXEC"]) == [3]
+        await store.aof.close()
+
+    asyncio.run(main())
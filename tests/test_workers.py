@@ -0,0 +1,88 @@
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+
+from client.connection import AsyncConnection
+from core.protocol import encode_command
+from core.shard import key_hash
+from persistence.aof_logger import AOFLogger
+from server.workers import merge_info_value, peer_socket_path, worker_for_key
+
+from conftest import free_port, wait_for_port
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+async def command(conn, *args):
+    await conn.send(encode_command(*args))
+    (reply,) = await conn.read_replies(1)
+    return reply
+
+def keys_of(worker, count, workers=2):
+    keys = (f"k{i}" for i in range(10000))
+    return [key for key in keys if worker_for_key(key, workers) == worker][:count]
+
+def test_workers_and_shards_use_different_hash_bits():
+    for i in range(1000):
+        key = f"k{i}"
+        assert worker_for_key(key, 4) == (key_hash(key) >> 16) % 4
+    # Every worker still spreads its keys over all of its shards
+    assert {key_hash(key) % 4 for key in keys_of(0, 100, workers=4)} == {0, 1, 2, 3}
+
+def test_info_values_merge_across_workers():
+    assert merge_info_value(None, "3") == "3"
+    assert merge_info_value("3", "4") == "7"
+    assert merge_info_value("lru", "lru") == "lru"
+    assert (merge_info_value("calls=2,usec=10,usec_per_call=5.00,failed_calls=0",
+                             "calls=3,usec=50,usec_per_call=16.67,failed_calls=1")
+            == "calls=5,usec=60,usec_per_call=12.00,failed_calls=1")
+    assert merge_info_value("count=1,p50=8,max=9", "count=2,p50=4,max=30") == "count=3,p50=8,max=30"
+
+def test_workers_forward_commands_to_the_owner_of_each_key(tmp_path):
+    port = free_port()
+    aof_path = str(tmp_path / "server.aof")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "server.main", "--workers", "2", "--port", str(port), "--aof-path", aof_path,
+         "--hot-set-checkpoint-interval", "0"],
+        cwd=ROOT, stdout=subprocess.DEVNULL, start_new_session=True)
+    zeros, ones = keys_of(0, 5), keys_of(1, 5)
+
+    async def main():
+        await asyncio.wait_for(wait_for_port(port), 30)
+        # SO_REUSEPORT spreads connections over both workers; every one of them sees every key
+        conns = [await AsyncConnection.open(port=port) for _ in range(6)]
+        for i, conn in enumerate(conns):
+            assert await command(conn, "SET", zeros[i % 5], f"zero-{i}") == "OK"
+            assert await command(conn, "SET", ones[i % 5], f"one-{i}") == "OK"
+        for conn in conns:
+            assert await command(conn, "GET", zeros[0]) == "zero-5"
+            assert await command(conn, "INCR", "counter") in range(1, 7)
+        conn = conns[0]
+        assert await command(conn, "MGET", zeros[1], ones[1], "missing") == ["zero-1", "one-1", None]
+        assert await command(conn, "MDEL", zeros[4], ones[4], "missing") == 2
+
+        # MSET is only accepted when one worker owns every key
+        assert await command(conn, "MSET", ones[0], "a", ones[1], "b") == "OK"
+        reply = await command(conn, "MSET", zeros[0], "a", ones[0], "b")
+        assert reply.startswith("ERROR: CROSSWORKER MSET")
+        assert await command(conn, "GET", zeros[0]) == "zero-5"
+
+        info = await command(conn, "INFO")
+        assert "workers: 2" in info
+        assert "keys_in_db: 9" in info
+        for conn in conns:
+            await conn.close()
+
+    try:
+        asyncio.run(main())
+    finally:
+        os.killpg(process.pid, signal.SIGINT)
+        process.wait(30)
+
+    # Each worker logged only the keys it owns, to its own AOF, and removed its peer socket
+    for worker in (0, 1):
+        assert not os.path.exists(peer_socket_path(port, worker))
+        aof = AOFLogger(filepath=str(tmp_path / f"server.{worker}.aof"))
+        keys = {record[1] for record in aof.replay()}
+        assert keys and all(worker_for_key(key, 2) == worker for key in keys)
@@ -0,0 +1,280 @@
+"""
+pykv-benchmark: a load generator in the spirit of redis-benchmark.
+
+Opens --clients connections, each sending --pipeline commands per round
+trip from a GET/SET mix over a fixed keyspace, and reports throughput and
+latency percentiles per command. A command's latency is the round trip of
+the pipeline it was sent in. Results can be written as JSON and compared
+against an earlier run to catch regressions between versions.
+
+    python tools/benchmark.py --clients 50 --pipeline 16 --requests 200000
+    python tools/benchmark.py --server subprocess --server-args "--appendfsync always"
+    python tools/benchmark.py --server subprocess --json new.json --compare baseline.json
+
+The load generator is a single asyncio process, so with deep pipelines it
+can become the bottleneck itself; watch its CPU when interpreting results.
+"""
+import sys
+import os
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import random
+import shlex
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+
+# Ensure project root is in the path for core and server imports
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from core.protocol import ReplyParser, Error, encode_command
+
+# Distinct commands generated per client; longer runs cycle through them
+OPS_PER_CLIENT = 10000
+
+# --- Server under test ---
+def wait_for_port(host, port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), 0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server did not start listening on {host}:{port}")
+
+def start_subprocess_server(args, workdir):
+    command = [sys.executable, os.path.join(ROOT, "server", "main.py"), "--host", args.host,
+               "--port", str(args.port), "--aof-path", os.path.join(workdir, "appendonly.aof")]
+    command += shlex.split(args.server_args)
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    wait_for_port(args.host, args.port)
+    return process
+
+def start_inprocess_server(args, workdir):
+    """Runs server.main in a daemon thread with its own event loop (it shares our GIL)."""
+    from server import main as server_main
+    server_args = server_main.parse_args(
+        ["--host", args.host, "--port", str(args.port),
+         "--aof-path", os.path.join(workdir, "appendonly.aof")] + shlex.split(args.server_args))
+    thread = threading.Thread(target=asyncio.run, args=(server_main.main(server_args),), daemon=True)
+    thread.start()
+    wait_for_port(args.host, args.port)
+    return thread
+
+# --- Workload ---
+def make_ops(args, rng, count):
+    """Pre-encoded (command name, request bytes) pairs for one client."""
+    value = "x" * args.value_size
+    ops = []
+    for _ in range(count):
+        key = f"key:{rng.randrange(args.keyspace):012d}"
+        if rng.random() < args.read_ratio:
+            ops.append(("GET", encode_command("GET", key)))
+        elif rng.random() < args.ttl_ratio:
+            ops.append(("SET", encode_command("SET", key, value, "EX", args.ttl)))
+        else:
+            ops.append(("SET", encode_command("SET", key, value)))
+    return ops
+
+async def preload(args):
+    """Fills the keyspace so GETs find values (pipelined SETs: MSET can't span --workers)."""
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    parser = ReplyParser()
+    value = "x" * args.value_size
+    batch = 1000
+    for start in range(0, args.keyspace, batch):
+        keys = range(start, min(start + batch, args.keyspace))
+        writer.write(b"".join(encode_command("SET", f"key:{i:012d}", value) for i in keys))
+        await read_replies(reader, parser, len(keys))
+    writer.close()
+
+async def read_replies(reader, parser, count):
+    errors = 0
+    while count:
+        data = await reader.read(64 * 1024)
+        if not data:
+            raise ConnectionError("Server closed the connection")
+        parser.feed(data)
+        for reply in parser:
+            count -= 1
+            if isinstance(reply, Error):
+                errors += 1
+    return errors
+
+class Budget:
+    """Requests left to send, shared by every client (or a deadline with --duration)."""
+
+    def __init__(self, requests, duration):
+        self.remaining = requests
+        self.deadline = time.perf_counter() + duration if duration else None
+
+    def take(self, n):
+        if self.deadline is not None:
+            return n if time.perf_counter() < self.deadline else 0
+        n = min(n, self.remaining)
+        self.remaining -= n
+        return n
+
+async def run_client(args, ops, budget, latencies, stats):
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    parser = ReplyParser()
+    position = 0
+    try:
+        while n := budget.take(args.pipeline):
+            batch = [ops[(position + i) % len(ops)] for i in range(n)]
+            position += n
+            start = time.perf_counter()
+            writer.write(b"".join(request for _, request in batch))
+            stats["errors"] += await read_replies(reader, parser, n)
+            elapsed = time.perf_counter() - start
+            for name, _ in batch:
+                latencies[name].append(elapsed)
+    finally:
+        writer.close()
+
+async def run_benchmark(args):
+    if not args.no_preload:
+        await preload(args)
+    rng = random.Random(args.seed)
+    ops = [make_ops(args, rng, min(OPS_PER_CLIENT, args.requests // args.clients + 1))
+           for _ in range(args.clients)]
+    latencies = {"GET": [], "SET": []}
+    stats = {"errors": 0}
+    budget = Budget(args.requests, args.duration)
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(args, client_ops, budget, latencies, stats) for client_ops in ops))
+    return latencies, time.perf_counter() - start, stats["errors"]
+
+# --- Reporting ---
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+def summarize(latencies, elapsed):
+    results = {}
+    everything = [value for values in latencies.values() for value in values]
+    for name, values in list(latencies.items()) + [("ALL", everything)]:
+        if not values:
+            continue
+        values = sorted(values)
+        results[name] = {
+            "requests": len(values),
+            "ops_per_sec": round(len(values) / elapsed, 1),
+            "mean_ms": round(sum(values) / len(values) * 1000, 3),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+            "p999_ms": round(percentile(values, 0.999) * 1000, 3),
+            "max_ms": round(values[-1] * 1000, 3),
+        }
+    return results
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def print_report(config, results, elapsed, errors):
+    print(f"====== pykv-benchmark ({elapsed:.2f}s) ======")
+    print(f"{config['clients']} clients, pipeline {config['pipeline']}, keyspace {config['keyspace']}, "
+          f"{config['value_size']}-byte values, {config['read_ratio']:.0%} reads, "
+          f"{config['ttl_ratio']:.0%} of SETs with a TTL")
+    print(f"{'command':<8} {'requests':>9} {'ops/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'p999 ms':>8} {'max ms':>8}")
+    for name, r in results.items():
+        print(f"{name:<8} {r['requests']:>9} {r['ops_per_sec']:>10.0f} {r['p50_ms']:>8.3f} "
+              f"{r['p99_ms']:>8.3f} {r['p999_ms']:>8.3f} {r['max_ms']:>8.3f}")
+    if errors:
+        print(f"{errors} error replies")
+
+def compare(config, results, baseline_path, threshold):
+    """Prints throughput drops and p99 increases above `threshold` percent; returns how many."""
+    with open(baseline_path) as f:
+        saved = json.load(f)
+    baseline = saved["results"]
+    changed = [name for name, value in config.items() if saved["config"].get(name) != value]
+    if changed:
+        print(f"Warning: the baseline was run with different settings ({', '.join(changed)})")
+    regressions = 0
+    for name, r in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        ops_change = (r["ops_per_sec"] - old["ops_per_sec"]) / old["ops_per_sec"] * 100
+        p99_change = (r["p99_ms"] - old["p99_ms"]) / old["p99_ms"] * 100 if old["p99_ms"] else 0.0
+        flagged = ops_change < -threshold or p99_change > threshold
+        regressions += flagged
+        print(f"{'REGRESSION' if flagged else 'ok':<10} {name:<4} ops/s {ops_change:+.1f}%  p99 {p99_change:+.1f}%")
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="PyKV load generator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8889)
+    parser.add_argument("--server", choices=("none", "subprocess", "inprocess"), default="none",
+                        help="Benchmark a running server, or start one (with a throwaway AOF)")
+    parser.add_argument("--server-args", default="",
+                        help='Extra options for a started server, e.g. "--appendfsync always --shards 32"')
+    parser.add_argument("-c", "--clients", type=int, default=50, help="Concurrent connections")
+    parser.add_argument("-P", "--pipeline", type=int, default=1, help="Commands per round trip")
+    parser.add_argument("-n", "--requests", type=int, default=100000, help="Total requests")
+    parser.add_argument("--duration", type=float, default=0,
+                        help="Run for this many seconds instead of a fixed number of requests")
+    parser.add_argument("--keyspace", type=int, default=10000, help="Distinct keys")
+    parser.add_argument("--value-size", type=int, default=32, help="Bytes per SET value")
+    parser.add_argument("--read-ratio", type=float, default=0.8, help="Fraction of GETs (the rest are SETs)")
+    parser.add_argument("--ttl-ratio", type=float, default=0.0, help="Fraction of SETs sent with EX")
+    parser.add_argument("--ttl", type=int, default=60, help="Seconds for SETs with EX")
+    parser.add_argument("--no-preload", action="store_true", help="Don't fill the keyspace first")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="Percent change that counts as a regression with --compare")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = None
+    with tempfile.TemporaryDirectory(prefix="pykv-bench-") as workdir:
+        if args.server == "subprocess":
+            server = start_subprocess_server(args, workdir)
+        elif args.server == "inprocess":
+            start_inprocess_server(args, workdir)
+        try:
+            latencies, elapsed, errors = asyncio.run(run_benchmark(args))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    config = {name: getattr(args, name) for name in (
+        "server", "server_args", "clients", "pipeline", "requests", "duration", "keyspace",
+        "value_size", "read_ratio", "ttl_ratio", "ttl", "seed")}
+    results = summarize(latencies, elapsed)
+    print_report(config, results, elapsed, errors)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+                "git_revision": git_revision(),
+                "python": platform.python_version(),
+                "config": config,
+                "elapsed_seconds": round(elapsed, 3),
+                "errors": errors,
+                "results": results,
+            }, f, indent=2)
+        print(f"Results written to {args.json}")
+    if args.compare and compare(config, results, args.compare, args.threshold):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
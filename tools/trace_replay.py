@@ -0,0 +1,110 @@
+"""
+Replays a key access trace against every hot cache policy and reports
+their hit ratios, without starting a server.
+
+A trace is a text file with one access per line, either a bare key or a
+command (`GET k`, `MGET k1 k2 ...`, `SET k v`, `DEL k`, `MDEL k1 ...`);
+other lines are ignored. Reads are looked up in the hot tier (and admitted
+on a miss), writes update hot keys and deletes remove them, as in the server.
+
+    python tools/trace_replay.py access.log --capacity 10000
+    python tools/trace_replay.py --synthetic --capacity 10000
+"""
+import sys
+import os
+import argparse
+import itertools
+import random
+import time
+
+# Ensure project root is in the path for core imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.hot_cache import HOT_CACHE_POLICIES, make_hot_cache
+
+def read_trace(path):
+    """Yields (op, key) with op one of "read", "write", "delete"."""
+    with open(path, encoding="utf-8", errors="surrogateescape") as f:
+        for line in f:
+            parts = line.split()
+            if not parts:
+                continue
+            if len(parts) == 1:
+                yield "read", parts[0]
+                continue
+            cmd = parts[0].upper()
+            if cmd in ("GET", "MGET"):
+                for key in parts[1:]:
+                    yield "read", key
+            elif cmd in ("SET", "INCR"):
+                yield "write", parts[1]
+            elif cmd in ("DEL", "MDEL"):
+                for key in parts[1:]:
+                    yield "delete", key
+
+def synthetic_trace(keys, requests, skew, scan_every, scan_size, seed=0):
+    """
+    Zipf-distributed reads over `keys` keys, interrupted every `scan_every`
+    requests by a sequential scan over `scan_size` keys nobody reads otherwise.
+    """
+    rng = random.Random(seed)
+    weights = list(itertools.accumulate(1 / (rank ** skew) for rank in range(1, keys + 1)))
+    scan_start = 0
+    batch = 10000
+    for done in range(0, requests, batch):
+        for key in rng.choices(range(keys), cum_weights=weights, k=min(batch, requests - done)):
+            yield "read", f"key:{key}"
+        if scan_every and (done + batch) % scan_every < batch:
+            for i in range(scan_start, scan_start + scan_size):
+                yield "read", f"scan:{i}"
+            scan_start += scan_size
+
+def replay(policy, capacity, trace):
+    hot = make_hot_cache(policy, capacity)
+    hits = misses = 0
+    for op, key in trace:
+        if op == "read":
+            if hot.lookup(key) is not None:
+                hits += 1
+            else:
+                misses += 1
+                hot.admit(key, None)
+        elif op == "write":
+            hot.update(key, None)
+        else:
+            hot.remove(key)
+    return hits, misses
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare hot cache policies on an access trace")
+    parser.add_argument("trace", nargs="?", help="Trace file (one key or command per line)")
+    parser.add_argument("--capacity", type=int, default=1000, help="Hot cache capacity to simulate")
+    parser.add_argument("--policies", default=",".join(HOT_CACHE_POLICIES),
+                        help="Comma-separated policies to compare")
+    parser.add_argument("--synthetic", action="store_true",
+                        help="Generate a skewed workload with periodic scans instead of reading a trace")
+    parser.add_argument("--keys", type=int, default=100000, help="Synthetic: distinct hot-set keys")
+    parser.add_argument("--requests", type=int, default=1000000, help="Synthetic: reads")
+    parser.add_argument("--skew", type=float, default=0.9, help="Synthetic: Zipf exponent")
+    parser.add_argument("--scan-every", type=int, default=200000, help="Synthetic: reads between scans")
+    parser.add_argument("--scan-size", type=int, default=50000, help="Synthetic: keys per scan")
+    args = parser.parse_args(argv)
+
+    if args.synthetic:
+        trace = list(synthetic_trace(args.keys, args.requests, args.skew, args.scan_every, args.scan_size))
+    elif args.trace:
+        trace = list(read_trace(args.trace))
+    else:
+        parser.error("a trace file or --synthetic is required")
+
+    print(f"{len(trace)} operations, capacity {args.capacity}")
+    print(f"{'policy':<12} {'hits':>10} {'misses':>10} {'hit ratio':>10} {'seconds':>8}")
+    for policy in args.policies.split(","):
+        start = time.perf_counter()
+        hits, misses = replay(policy, args.capacity, trace)
+        elapsed = time.perf_counter() - start
+        ratio = hits / (hits + misses) if hits + misses else 0.0
+        print(f"{policy:<12} {hits:>10} {misses:>10} {ratio:>10.4f} {elapsed:>8.2f}")
+
+if __name__ == "__main__":
+    main()